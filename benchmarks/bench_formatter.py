@@ -0,0 +1,204 @@
+"""Micro-benchmark for the shared single-pass formatter.
+
+Compares trip_formatter against the line-by-line formatter the apps used
+before it, on synthetic agent output of a few hundred KB, and checks that
+both produce identical HTML and Markdown. The 'both' row renders HTML and
+Markdown from a single parse, against running both legacy formatters.
+
+    python benchmarks/bench_formatter.py [--sizes 100 300 600] [--repeat 5]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'v3', 'api'))
+
+from trip_formatter import format_output, format_markdown, parse_output, render_html, render_markdown
+
+
+SAMPLE_LINES = [
+    "Paris: The capital of France, famous for its museums, cafes and the Eiffel Tower.",
+    "Hotel 1: Le Grand Paris",
+    "Day 3: Montmartre and Sacre-Coeur",
+    "Location: 2 Rue Scribe, 9th arrondissement",
+    "- Amenities: Spa, rooftop bar, free Wi-Fi",
+    "- Walk along the Seine at sunset",
+    "* Price: $250 per night",
+    "1. Arrive in the morning and check in",
+    "7. Evening river cruise",
+    "**Transportation** options include the metro and RER trains.",
+    "Estimated total cost for food is around $60 per day per person.",
+    "Features: Rooftop pool and 24-hour concierge service included in the rate",
+    "The old town is best explored on foot, with narrow lanes and hidden courtyards.",
+    "• Visit the Louvre early to avoid queues",
+    "Weather in June is mild with long daylight hours and occasional showers.",
+    "",
+]
+
+
+def legacy_format_html(result):
+    """The HTML formatter as it was duplicated in v2/api/app.py and v3/api/app.py"""
+    content = str(result.raw) if hasattr(result, 'raw') else str(result)
+    content = content.replace('\\n', '\n')
+    content = content.replace('**', '')
+    lines = content.split('\n')
+    formatted_lines = []
+    for i, line in enumerate(lines):
+        line = line.strip()
+        if not line:
+            continue
+        if ':' in line and not line.startswith(('•', '-', '*', '1.', '2.', '3.', '4.', '5.')) and len(line.split(':')[0]) < 50:
+            location_name = line.split(':')[0].strip()
+            if location_name and not any(word in location_name.lower() for word in ['hotel', 'day', 'cost', 'price', 'budget']):
+                formatted_lines.append(f"<h2 class='text-2xl font-bold text-primary-600 mt-6 mb-3'>🌟 {location_name}</h2>")
+                if len(line.split(':', 1)) > 1:
+                    description = line.split(':', 1)[1].strip()
+                    if description:
+                        formatted_lines.append(f"<p class='mb-4'>{description}</p>")
+            else:
+                formatted_lines.append(f"<h3 class='text-xl font-semibold text-gray-800 mt-4 mb-2'>{line}</h3>")
+        elif line.startswith(('Hotel 1:', 'Hotel 2:', 'Hotel 3:', 'Day 1:', 'Day 2:', 'Day 3:', 'Day 4:', 'Day 5:')):
+            icon = '🏨' if 'Hotel' in line else '📅'
+            formatted_lines.append(f"<h2 class='text-2xl font-bold text-primary-600 mt-6 mb-3'>{icon} {line}</h2>")
+        elif any(section in line.lower() for section in ['accommodation', 'transportation', 'food', 'activities', 'budget breakdown', 'weather', 'best time to visit']):
+            formatted_lines.append(f"<h3 class='text-xl font-semibold text-gray-800 mt-4 mb-2'>📋 {line}</h3>")
+        elif line.startswith('-') or line.startswith('*'):
+            bullet_content = line[1:].strip()
+            if ':' in bullet_content and len(bullet_content.split(':')[0]) < 30:
+                category = bullet_content.split(':')[0].strip()
+                description = bullet_content.split(':', 1)[1].strip()
+                formatted_lines.append(f"<p class='mb-2'><strong>{category}:</strong> {description}</p>")
+            else:
+                formatted_lines.append(f"<p class='mb-2'>• {bullet_content}</p>")
+        elif line.startswith(('1.', '2.', '3.', '4.', '5.', '6.', '7.', '8.', '9.')):
+            formatted_lines.append(f"<p class='mb-2 font-semibold'>{line}</p>")
+        elif any(word in line.lower() for word in ['price', 'cost', '$', 'budget', 'estimate']):
+            formatted_lines.append(f"<p class='mb-2 text-green-600 font-semibold'>💰 {line}</p>")
+        elif line.startswith('Location:'):
+            formatted_lines.append(f"<p class='mb-2 text-blue-600 font-semibold'>📍 {line}</p>")
+        elif any(word in line.lower() for word in ['features:', 'amenities:', 'includes:']):
+            formatted_lines.append(f"<p class='mb-2 text-purple-600 font-semibold'>✨ {line}</p>")
+        else:
+            formatted_lines.append(f"<p class='mb-2'>{line}</p>")
+    return '\n'.join(formatted_lines) if formatted_lines else content
+
+
+def legacy_format_markdown(result):
+    """The Markdown formatter as it was in main.py"""
+    content = str(result.raw) if hasattr(result, 'raw') else str(result)
+    content = content.replace('\\n', '\n')
+    content = content.replace('**', '')
+    lines = content.split('\n')
+    formatted_lines = []
+    for i, line in enumerate(lines):
+        line = line.strip()
+        if not line:
+            continue
+        if ':' in line and not line.startswith(('•', '-', '*', '1.', '2.', '3.', '4.', '5.')) and len(line.split(':')[0]) < 50:
+            location_name = line.split(':')[0].strip()
+            if location_name and not any(word in location_name.lower() for word in ['hotel', 'day', 'cost', 'price', 'budget']):
+                formatted_lines.append(f"## 🌟 {location_name}")
+                if len(line.split(':', 1)) > 1:
+                    description = line.split(':', 1)[1].strip()
+                    if description:
+                        formatted_lines.append(description)
+            else:
+                formatted_lines.append(f"### {line}")
+        elif line.startswith(('Hotel 1:', 'Hotel 2:', 'Hotel 3:', 'Day 1:', 'Day 2:', 'Day 3:', 'Day 4:', 'Day 5:')):
+            formatted_lines.append(f"## 🏨 {line}" if 'Hotel' in line else f"## 📅 {line}")
+        elif any(section in line.lower() for section in ['accommodation', 'transportation', 'food', 'activities', 'budget breakdown', 'weather', 'best time to visit']):
+            formatted_lines.append(f"### 📋 {line}")
+        elif line.startswith('-') or line.startswith('*'):
+            bullet_content = line[1:].strip()
+            if ':' in bullet_content and len(bullet_content.split(':')[0]) < 30:
+                category = bullet_content.split(':')[0].strip()
+                description = bullet_content.split(':', 1)[1].strip()
+                formatted_lines.append(f"**{category}:** {description}")
+            else:
+                formatted_lines.append(f"• {bullet_content}")
+        elif line.startswith(('1.', '2.', '3.', '4.', '5.', '6.', '7.', '8.', '9.')):
+            formatted_lines.append(f"**{line}**")
+        elif any(word in line.lower() for word in ['price', 'cost', '$', 'budget', 'estimate']):
+            formatted_lines.append(f"💰 **{line}**")
+        elif line.startswith('Location:'):
+            formatted_lines.append(f"📍 **{line}**")
+        elif any(word in line.lower() for word in ['features:', 'amenities:', 'includes:']):
+            formatted_lines.append(f"✨ **{line}**")
+        else:
+            formatted_lines.append(line)
+    result_text = []
+    for i, line in enumerate(formatted_lines):
+        if line.startswith('##'):
+            if i > 0:
+                result_text.append('')
+            result_text.append(line)
+            result_text.append('')
+        elif line.startswith('###'):
+            if i > 0:
+                result_text.append('')
+            result_text.append(line)
+        else:
+            result_text.append(line)
+    return '\n'.join(result_text) if result_text else content
+
+
+def legacy_format_both(content):
+    """Both legacy formatters, each parsing the output on its own"""
+    return legacy_format_html(content), legacy_format_markdown(content)
+
+
+def shared_format_both(content):
+    """HTML and Markdown rendered from one shared parse"""
+    parsed = parse_output(content)
+    return render_html(parsed), render_markdown(parsed)
+
+
+def sample_output(size_kb, seed=0):
+    """Build synthetic agent output of roughly size_kb kilobytes"""
+    rng = random.Random(seed)
+    lines = []
+    size = 0
+    while size < size_kb * 1024:
+        line = rng.choice(SAMPLE_LINES)
+        lines.append(line)
+        size += len(line.encode('utf-8')) + 1
+    return '\n'.join(lines)
+
+
+def best_time(func, content, repeat):
+    """Return the fastest of repeat runs, in seconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(content)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 300, 600], help='output sizes in KB')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per measurement, the fastest is reported')
+    args = parser.parse_args()
+
+    formats = [
+        ('html', legacy_format_html, format_output),
+        ('markdown', legacy_format_markdown, format_markdown),
+        ('both', legacy_format_both, shared_format_both),
+    ]
+
+    print(f"{'format':<10}{'size':>8}{'legacy ms':>12}{'shared ms':>12}{'speedup':>10}")
+    for size_kb in args.sizes:
+        content = sample_output(size_kb)
+        for name, legacy, shared in formats:
+            if legacy(content) != shared(content):
+                raise SystemExit(f"{name} output differs from the legacy formatter at {size_kb} KB")
+            legacy_time = best_time(legacy, content, args.repeat)
+            shared_time = best_time(shared, content, args.repeat)
+            print(f"{name:<10}{size_kb:>6}KB{legacy_time * 1000:>12.1f}{shared_time * 1000:>12.1f}{legacy_time / shared_time:>9.2f}x")
+
+
+if __name__ == '__main__':
+    main()
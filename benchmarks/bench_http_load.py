@@ -0,0 +1,370 @@
+"""Open-loop HTTP load test for the v2 and v3 planning APIs on the stub LLM.
+
+Starts the chosen API under the chosen server with the deterministic stub
+backend, then sends plan requests at each offered rate for a fixed time.
+Arrivals follow a Poisson process and do not wait for earlier responses,
+so a slow server builds a queue the way it would in production instead of
+slowing the load generator down. Latency is measured from the scheduled
+arrival time, which keeps queueing delay in the numbers.
+
+For every rate it reports achieved throughput, p50/p95/p99 latency, the
+error rate and the most requests in flight, and it marks the first rate
+the server could not keep up with as the saturation point.
+
+    python benchmarks/bench_http_load.py --api v3 --server threaded --rates 1 2 4 8
+    python benchmarks/bench_http_load.py --api v2 --server processes --workers 4
+    python benchmarks/bench_http_load.py --api v3 --server asgi --rates 8 16 32
+    python benchmarks/bench_http_load.py --api v3 --url http://127.0.0.1:5001
+
+Server modes: threaded runs Flask's development server with a thread per
+request, processes forks one worker process per request, and gunicorn runs
+--workers processes with --threads threads each (when gunicorn is
+installed). asgi runs the v3 API's asyncio app (v3/api/asgi.py) in a
+single uvicorn process, where every plan is a set of tasks on one event
+loop instead of a thread. --url skips starting a server and loads one that is already
+running, which covers any other server setup.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+APIS = {
+    'v2': {'dir': os.path.join(ROOT, 'v2', 'api'), 'plan': '/api/plan-trip', 'health': '/api/health'},
+    'v3': {'dir': os.path.join(ROOT, 'v3', 'api'), 'plan': '/trip/plan', 'health': '/trip/health'},
+}
+
+DESTINATIONS = [
+    'France', 'Japan', 'Italy', 'Spain', 'Peru', 'Morocco', 'Vietnam', 'Portugal', 'Mexico', 'Greece',
+    'Thailand', 'Iceland', 'Canada', 'Australia', 'South Africa', 'Turkey', 'India', 'Norway', 'any country'
+]
+TRAVEL_TYPES = ['leisure', 'business', 'adventure', 'family', 'romantic', 'solo', 'cultural']
+BUDGETS = ['budget', 'mid-range', 'luxury', '$500-$1000', '$1000-$2500', '$2500-$5000']
+INTERESTS = [
+    'art', 'food', 'history', 'hiking', 'beaches', 'nightlife', 'museums', 'architecture', 'wine',
+    'photography', 'shopping', 'wildlife', 'music', 'festivals', 'street food', 'temples', 'skiing'
+]
+
+
+def random_payload(rng):
+    """A plan request with the fields both APIs accept, drawn like real user input"""
+    start = date.today() + timedelta(days=rng.randint(7, 365))
+    end = start + timedelta(days=rng.choice([2, 3, 4, 5, 7, 7, 10, 14, 21]))
+    return {
+        'destination': rng.choice(DESTINATIONS),
+        'startDate': start.isoformat(),
+        'endDate': end.isoformat(),
+        'travelers': rng.randint(1, 6),
+        'budget': rng.choice(BUDGETS),
+        'travelType': rng.choice(TRAVEL_TYPES),
+        'interests': ', '.join(rng.sample(INTERESTS, rng.randint(1, 4)))
+    }
+
+
+class Payloads:
+    """Draws request payloads, reusing a small set of popular ones for a share of requests"""
+
+    def __init__(self, seed, repeat=0.0, popular=10):
+        self.rng = random.Random(seed)
+        self.repeat = repeat
+        self.popular = [random_payload(self.rng) for _ in range(popular)]
+
+    def next(self):
+        if self.repeat and self.rng.random() < self.repeat:
+            return self.rng.choice(self.popular)
+        return random_payload(self.rng)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def threaded_command(port, args):
+    return [sys.executable, '-c', f"from app import app; app.run(host='127.0.0.1', port={port}, threaded=True)"]
+
+
+def processes_command(port, args):
+    return [sys.executable, '-c',
+            f"from app import app; app.run(host='127.0.0.1', port={port}, threaded=False, processes={args.workers})"]
+
+
+def gunicorn_command(port, args):
+    gunicorn = shutil.which('gunicorn')
+    if not gunicorn:
+        raise SystemExit("gunicorn is not installed; pip install gunicorn or pick another --server")
+    return [gunicorn, '--workers', str(args.workers), '--threads', str(args.threads),
+            '--timeout', str(int(args.timeout) + 30), '--bind', f'127.0.0.1:{port}', 'app:app']
+
+
+def asgi_command(port, args):
+    if args.api != 'v3':
+        raise SystemExit("The asgi server only serves the v3 API")
+    return [sys.executable, '-m', 'uvicorn', '--host', '127.0.0.1', '--port', str(port), '--no-access-log', 'asgi:app']
+
+
+SERVERS = {
+    'threaded': threaded_command,
+    'processes': processes_command,
+    'gunicorn': gunicorn_command,
+    'asgi': asgi_command,
+}
+
+
+def server_env(args):
+    """Environment for the server: stub LLM, no completion or knowledge cache, no tracing.
+
+    The plan cache stays on; random payloads almost never repeat, and
+    --repeat sends popular ones on purpose to measure cache hits.
+    """
+    env = dict(os.environ)
+    env.update({
+        'TRIP_LLM_BACKEND': 'stub',
+        'TRIP_STUB_LATENCY': str(args.latency),
+        'TRIP_STUB_TOKENS_PER_SEC': str(args.tokens_per_second),
+        'TRIP_STUB_OUTPUT_TOKENS': str(args.output_tokens),
+        'TRIP_COMPLETION_CACHE_PATH': '',
+        'TRIP_KNOWLEDGE_CACHE_PATH': '',
+        'TRIP_TRACE_PATH': '',
+        'OTEL_SDK_DISABLED': 'true',
+        'PYTHONUNBUFFERED': '1'
+    })
+    return env
+
+
+def get_json(url, timeout=5):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def wait_until_ready(url, process, timeout):
+    """Poll the health endpoint until it answers and, on v3, the agents are loaded"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            raise SystemExit(f"Server exited with status {process.returncode}; see the server log")
+        try:
+            if get_json(url).get('agents_loaded', True):
+                return
+        except (OSError, ValueError):
+            pass
+        time.sleep(0.5)
+    raise SystemExit(f"Server was not ready after {timeout}s")
+
+
+def start_server(args):
+    """Start the API under the chosen server and return (process, base url)"""
+    port = free_port()
+    command = SERVERS[args.server](port, args)
+    log = open(args.server_log, 'w') if args.server_log else subprocess.DEVNULL
+    process = subprocess.Popen(command, cwd=APIS[args.api]['dir'], env=server_env(args),
+                               stdout=log, stderr=subprocess.STDOUT)
+    return process, f'http://127.0.0.1:{port}'
+
+
+def stop_server(process):
+    if process is None or process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def post_plan(url, payload, timeout):
+    """Send one plan request and return None on success or a short error label"""
+    request = urllib.request.Request(url, data=json.dumps(payload).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            body = json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return f'HTTP {e.code}'
+    except socket.timeout:
+        return 'timeout'
+    except urllib.error.URLError as e:
+        return 'timeout' if isinstance(e.reason, socket.timeout) else type(e.reason).__name__
+    except (OSError, ValueError) as e:
+        return type(e).__name__
+    # v2 reports failures in the body as well as the status code
+    if isinstance(body, dict) and body.get('success') is False:
+        return 'failed'
+    return None
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)] if ordered else 0.0
+
+
+def spread_rate(times):
+    """Events per second between the first and the last of a list of timestamps.
+
+    Applied to completion times this is the rate the server finished
+    requests at; a server that keeps up finishes them as fast as they
+    arrive, however long each one takes.
+    """
+    if len(times) < 2:
+        return 0.0
+    span = max(times) - min(times)
+    return (len(times) - 1) / span if span > 0 else 0.0
+
+
+def run_rate(url, rate, duration, payloads, rng, timeout):
+    """Send Poisson arrivals at rate per second for duration seconds and return the results"""
+    latencies = []
+    finishes = []
+    arrivals = []
+    errors = {}
+    lock = threading.Lock()
+    in_flight = [0, 0]  # current, most
+
+    def send(scheduled, payload):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight)
+        error = post_plan(url, payload, timeout)
+        finished = time.perf_counter()
+        with lock:
+            in_flight[0] -= 1
+            if error:
+                errors[error] = errors.get(error, 0) + 1
+            else:
+                latencies.append(finished - scheduled)
+                finishes.append(finished)
+
+    threads = []
+    start = time.perf_counter()
+    arrival = start
+    while True:
+        arrival += rng.expovariate(rate)
+        if arrival - start >= duration:
+            break
+        wait = arrival - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        arrivals.append(arrival)
+        thread = threading.Thread(target=send, args=(arrival, payloads.next()), daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    # Let the requests already sent finish; they count against this rate
+    for thread in threads:
+        thread.join(max(0.0, start + duration + timeout - time.perf_counter()))
+    sent = len(threads)
+    failed = sum(errors.values()) + sum(thread.is_alive() for thread in threads)
+
+    return {
+        'offered': rate,
+        'sent': sent,
+        'ok': len(latencies),
+        'errors': failed,
+        'error_rate': round(failed / sent, 4) if sent else 0.0,
+        'arrival_rate': round(spread_rate(arrivals), 3),
+        'throughput': round(spread_rate(finishes), 3),
+        'p50': round(percentile(latencies, 50), 3),
+        'p95': round(percentile(latencies, 95), 3),
+        'p99': round(percentile(latencies, 99), 3),
+        'max_in_flight': in_flight[1],
+        'error_kinds': errors
+    }
+
+
+def saturated(result, args):
+    """Return why the server could not keep up at this rate, or None"""
+    if not result['sent']:
+        return None
+    if result['error_rate'] > args.max_error_rate:
+        return f"error rate {result['error_rate']:.1%}"
+    if result['throughput'] < result['arrival_rate'] * args.min_throughput:
+        return f"throughput {result['throughput']:.2f} < {args.min_throughput:.0%} of arrivals"
+    if result['p95'] > args.slo:
+        return f"p95 {result['p95']:.1f}s > {args.slo:g}s"
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--api', choices=sorted(APIS), default='v3', help='which API to load')
+    parser.add_argument('--server', choices=sorted(SERVERS), default='threaded', help='how to serve it')
+    parser.add_argument('--url', help='load an already running server at this base URL instead of starting one')
+    parser.add_argument('--workers', type=int, default=4, help='worker processes for processes and gunicorn')
+    parser.add_argument('--threads', type=int, default=8, help='threads per gunicorn worker')
+    parser.add_argument('--rates', type=float, nargs='+', default=[0.5, 1, 2, 4, 8], help='offered requests per second')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of arrivals per rate')
+    parser.add_argument('--timeout', type=float, default=120, help='seconds before a request counts as timed out')
+    parser.add_argument('--repeat', type=float, default=0.0, help='share of requests drawn from a few popular payloads')
+    parser.add_argument('--seed', type=int, default=1, help='seed for payloads and arrival times')
+    parser.add_argument('--slo', type=float, default=30, help='p95 seconds above which a rate counts as saturated')
+    parser.add_argument('--max-error-rate', type=float, default=0.01, help='error rate above which a rate counts as saturated')
+    parser.add_argument('--min-throughput', type=float, default=0.9, help='share of the arrival rate the server must complete')
+    parser.add_argument('--latency', type=float, default=0.2, help='stub seconds before the first token')
+    parser.add_argument('--tokens-per-second', type=float, default=200, help='stub token rate (0 for instant)')
+    parser.add_argument('--output-tokens', type=int, default=200, help='stub tokens per answer')
+    parser.add_argument('--startup-timeout', type=float, default=180, help='seconds to wait for the server to be ready')
+    parser.add_argument('--server-log', help='write the server output to this file')
+    parser.add_argument('--output', help='also write the results as JSON to this file')
+    args = parser.parse_args()
+
+    process = None
+    if args.url:
+        base = args.url.rstrip('/')
+        mode = 'external'
+    else:
+        process, base = start_server(args)
+        mode = args.server
+    rng = random.Random(args.seed)
+    payloads = Payloads(args.seed, args.repeat)
+
+    results = []
+    saturation = None
+    try:
+        wait_until_ready(base + APIS[args.api]['health'], process, args.startup_timeout)
+        print(f"api={args.api} server={mode} url={base} duration={args.duration:g}s "
+              f"stub latency={args.latency} tokens_per_second={args.tokens_per_second} output_tokens={args.output_tokens}")
+        print(f"{'offered':>8}{'arrived':>9}{'sent':>6}{'ok':>6}{'err %':>7}{'done/s':>8}{'p50 s':>8}{'p95 s':>8}{'p99 s':>8}{'in flight':>11}")
+        for rate in args.rates:
+            result = run_rate(base + APIS[args.api]['plan'], rate, args.duration, payloads, rng, args.timeout)
+            result['saturated'] = saturated(result, args)
+            results.append(result)
+            print(f"{rate:>8g}{result['arrival_rate']:>9.2f}{result['sent']:>6}{result['ok']:>6}{result['error_rate'] * 100:>7.1f}{result['throughput']:>8.2f}"
+                  f"{result['p50']:>8.2f}{result['p95']:>8.2f}{result['p99']:>8.2f}{result['max_in_flight']:>11}"
+                  f"  {'SATURATED: ' + result['saturated'] if result['saturated'] else ''}")
+            if result['error_kinds']:
+                print(f"{'':>8}errors: {', '.join(f'{kind} x{count}' for kind, count in sorted(result['error_kinds'].items()))}")
+            if result['saturated'] and saturation is None:
+                saturation = rate
+    finally:
+        stop_server(process)
+
+    sustained = [result['offered'] for result in results if not result['saturated']]
+    if saturation is None:
+        print(f"\nNot saturated up to {args.rates[-1]:g} req/s")
+    else:
+        below = [rate for rate in sustained if rate < saturation]
+        print(f"\nSaturation point: {saturation:g} req/s" + (f" (highest sustained rate below it: {max(below):g} req/s)" if below else ''))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'api': args.api, 'server': mode, 'settings': vars(args), 'saturation': saturation, 'rates': results},
+                      f, indent=2, default=str)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Import-time budget check for the v3 API.
+
+Imports app.py (and asgi.py) in a fresh interpreter, the way a new replica
+starts, and answers one /trip/health request. It fails if either takes
+longer than --budget seconds, or if the import pulled in the agent stack
+(crewai, langchain, trip_agents, trip_pipeline), which must only load on
+the first planning request or from the warm-up thread. Exits with status 1
+on any failure, so it can run as a check in CI.
+
+    python benchmarks/bench_import_time.py [--budget 1.0] [--runs 3] [--top 10]
+
+--top lists the slowest imports reported by python -X importtime for the
+last run, which shows where a regression came from.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+API_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'v3', 'api')
+
+# Importing any of these at module level would add seconds to every start
+HEAVY_MODULES = ('crewai', 'langchain', 'langchain_core', 'langchain_openai', 'trip_agents', 'trip_pipeline')
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+imported = time.perf_counter() - started
+from app import app
+started = time.perf_counter()
+response = app.test_client().get('/trip/health')
+health = time.perf_counter() - started
+heavy = sorted({{name.split('.')[0] for name in sys.modules}} & set({heavy!r}))
+print(json.dumps({{'import': imported, 'health': health, 'status': response.status_code, 'heavy': heavy}}))
+"""
+
+
+def probe(module):
+    """Import a module in a new interpreter and return its timings and the heavy modules it loaded, plus importtime output"""
+    env = dict(os.environ, TRIP_WARMUP='false', OTEL_SDK_DISABLED='true', PYTHONDONTWRITEBYTECODE='1')
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE.format(module=module, heavy=HEAVY_MODULES)],
+        cwd=API_DIR, env=env, capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise SystemExit(f"Importing {module} failed:\n{completed.stderr[-2000:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1]), completed.stderr
+
+
+def slowest_imports(importtime, top):
+    """Return (cumulative seconds, module) for the slowest top-level imports in -X importtime output"""
+    rows = []
+    for line in importtime.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        parts = [part.strip() for part in line[len('import time:'):].split('|')]
+        if not parts[1].isdigit():
+            continue
+        rows.append((int(parts[1]) / 1e6, parts[2]))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--budget', type=float, default=1.0, help='seconds allowed for the import and for the first health check')
+    parser.add_argument('--runs', type=int, default=3, help='fresh interpreters per module; the median is checked')
+    parser.add_argument('--modules', nargs='+', default=['app', 'asgi'], help='v3/api modules to import')
+    parser.add_argument('--top', type=int, default=0, help='list the slowest imports of the last run')
+    args = parser.parse_args()
+
+    failures = []
+    print(f"{'module':>8} {'import s':>9} {'health s':>9}  heavy modules")
+    for module in args.modules:
+        results = []
+        for _ in range(args.runs):
+            result, importtime = probe(module)
+            results.append(result)
+        imported = statistics.median(result['import'] for result in results)
+        health = statistics.median(result['health'] for result in results)
+        heavy = sorted({name for result in results for name in result['heavy']})
+        print(f"{module:>8} {imported:9.3f} {health:9.3f}  {', '.join(heavy) or '-'}")
+
+        if imported > args.budget:
+            failures.append(f"import {module} took {imported:.3f}s, over the {args.budget}s budget")
+        if health > args.budget or any(result['status'] != 200 for result in results):
+            failures.append(f"/trip/health after import {module} took {health:.3f}s or did not answer 200")
+        if heavy:
+            failures.append(f"import {module} loaded {', '.join(heavy)} at module level")
+
+        for seconds, name in slowest_imports(importtime, args.top):
+            print(f"{'':>8} {seconds:9.3f}  {name}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+"""Throughput benchmark for trip planning on the deterministic stub LLM.
+
+Runs complete plans through TripPlannerAPI.plan_trip (the v3 API) or the
+pipeline-plus-Markdown flow of the Streamlit app, at increasing numbers of
+concurrent plans, and reports requests/sec, p50/p95/p99 latency and memory.
+No network or API key is needed. Results are compared with the stored
+baseline for the same target and stub settings; a level that is slower or
+bigger than the baseline by more than --tolerance is reported as a
+regression and makes the script exit with status 1.
+
+    python benchmarks/bench_plan_throughput.py [--target api|streamlit] [--concurrency 1 8 64] [--save-baseline]
+
+Baselines are machine specific; refresh them with --save-baseline after
+changing hardware. The threads column counts live threads after each level,
+which shows leaks such as the telemetry thread CrewAI 0.51 starts for
+every Crew and Task (trip_agents turns that telemetry off unless
+TRIP_CREWAI_TELEMETRY=true). All levels run in one process: rss MB is the
+resident memory after each level, while cum peak MB is the process peak so
+far, so it never drops and a level's value may come from an earlier one.
+Only rss MB is compared with the baseline.
+"""
+import argparse
+import contextlib
+import json
+import math
+import os
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'v3', 'api'))
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'plan_throughput.json')
+
+
+def configure(args):
+    """Point the agents at the stub backend and turn off caching, tracing and warm-up"""
+    os.environ['TRIP_LLM_BACKEND'] = 'stub'
+    os.environ['TRIP_STUB_LATENCY'] = str(args.latency)
+    os.environ['TRIP_STUB_TOKENS_PER_SEC'] = str(args.tokens_per_second)
+    os.environ['TRIP_STUB_OUTPUT_TOKENS'] = str(args.output_tokens)
+    os.environ['TRIP_COMPLETION_CACHE_PATH'] = ''
+    os.environ['TRIP_KNOWLEDGE_CACHE_PATH'] = ''
+    os.environ['TRIP_TRACE_PATH'] = ''
+    os.environ['TRIP_WARMUP'] = 'false'
+    os.environ['OTEL_SDK_DISABLED'] = 'true'
+
+
+def request_data(i):
+    """A plan request; the interests differ per request so no plan is served from cache"""
+    return {
+        'travelType': 'leisure',
+        'startDate': '2025-06-01',
+        'endDate': '2025-06-06',
+        'budget': 'mid-range',
+        'interests': f'art, food, benchmark {i}',
+        'destination': 'France'
+    }
+
+
+def api_planner():
+    """Plan through the v3 API's TripPlannerAPI"""
+    from app import trip_planner
+    trip_planner.load()
+    return trip_planner.plan_trip
+
+
+def streamlit_planner():
+    """Plan the way main.py does: run the pipeline and format each section as Markdown"""
+    from trip_agents import TripAgents, triptasks, canonicalize_inputs
+    from trip_formatter import format_markdown
+    from trip_pipeline import TripPipeline
+
+    pipeline = TripPipeline(TripAgents(), triptasks())
+
+    def plan(data):
+        inputs = canonicalize_inputs({
+            "travel_type": data['travelType'],
+            "travel_duration": "4-7 days",
+            "travel_budget": data['budget'],
+            "travel_interests": data['interests'],
+            "travel_dates": data['startDate'],
+            "destination_country": data['destination']
+        })
+        results = {}
+        pipeline.run(inputs, lambda section, result: results.__setitem__(section, format_markdown(result)))
+        return results
+
+    return plan
+
+
+TARGETS = {
+    'api': api_planner,
+    'streamlit': streamlit_planner,
+}
+
+
+def rss_mb():
+    """Current resident memory of this process in MB, or the peak so far where /proc is missing"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process since it started in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)] if ordered else 0.0
+
+
+def run_level(plan, concurrency, requests, offset):
+    """Run requests plans with concurrency in flight and return the level's results"""
+    latencies = []
+    errors = 0
+    first_error = None
+
+    def one(i):
+        start = time.perf_counter()
+        plan(request_data(offset + i))
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(one, i) for i in range(requests)]:
+            try:
+                latencies.append(future.result())
+            except Exception as e:
+                errors += 1
+                first_error = first_error or str(e)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'requests': requests,
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 3),
+        'p50': round(percentile(latencies, 50), 3),
+        'p95': round(percentile(latencies, 95), 3),
+        'p99': round(percentile(latencies, 99), 3),
+        'rss_mb': round(rss_mb(), 1),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'threads': threading.active_count(),
+        'first_error': first_error
+    }
+
+
+def regressions(result, baseline, tolerance):
+    """Return the metrics of a level that are worse than the baseline by more than tolerance"""
+    worse = []
+    if result['rps'] < baseline['rps'] * (1 - tolerance):
+        worse.append('rps')
+    for metric in ('p95', 'p99', 'rss_mb', 'threads'):
+        if result[metric] > baseline[metric] * (1 + tolerance):
+            worse.append(metric)
+    if result['errors'] > baseline['errors']:
+        worse.append('errors')
+    return worse
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--target', choices=sorted(TARGETS), default='api', help='what to benchmark')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64], help='concurrent plans per level')
+    parser.add_argument('--rounds', type=int, default=2, help='requests per level as a multiple of the concurrency')
+    parser.add_argument('--min-requests', type=int, default=8, help='fewest requests per level')
+    parser.add_argument('--latency', type=float, default=0.2, help='stub seconds before the first token')
+    parser.add_argument('--tokens-per-second', type=float, default=200, help='stub token rate (0 for instant)')
+    parser.add_argument('--output-tokens', type=int, default=200, help='stub tokens per answer')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative slowdown against the baseline')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline JSON file')
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the new baseline')
+    args = parser.parse_args()
+
+    configure(args)
+    settings = {
+        'latency': args.latency,
+        'tokens_per_second': args.tokens_per_second,
+        'output_tokens': args.output_tokens,
+        'stage_workers': int(os.getenv('TRIP_STAGE_WORKERS', '3'))
+    }
+
+    # CrewAI agents are verbose; keep their chatter out of the report
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        plan = TARGETS[args.target]()
+        plan(request_data(-1))  # warm up agents and imports
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    baseline = baselines.get(args.target)
+    if baseline and baseline['settings'] != settings:
+        print(f"Baseline for {args.target} was recorded with {baseline['settings']}; not comparing")
+        baseline = None
+
+    print(f"target={args.target} {' '.join(f'{k}={v}' for k, v in settings.items())}")
+    print(f"{'conc':>5}{'reqs':>6}{'err':>5}{'req/s':>9}{'p50 s':>8}{'p95 s':>8}{'p99 s':>8}{'rss MB':>9}{'cum peak MB':>12}{'threads':>9}  vs baseline")
+
+    levels = {}
+    failed = False
+    offset = 0
+    for concurrency in args.concurrency:
+        requests = max(concurrency * args.rounds, args.min_requests)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            result = run_level(plan, concurrency, requests, offset)
+        offset += requests
+        levels[str(concurrency)] = {key: value for key, value in result.items() if key != 'first_error'}
+
+        comparison = ''
+        if baseline and str(concurrency) in baseline['levels']:
+            worse = regressions(result, baseline['levels'][str(concurrency)], args.tolerance)
+            comparison = f"REGRESSION: {', '.join(worse)}" if worse else 'ok'
+            failed = failed or bool(worse)
+        print(f"{concurrency:>5}{result['requests']:>6}{result['errors']:>5}{result['rps']:>9.2f}{result['p50']:>8.2f}"
+              f"{result['p95']:>8.2f}{result['p99']:>8.2f}{result['rss_mb']:>9.1f}{result['peak_rss_mb']:>12.1f}{result['threads']:>9}  {comparison}")
+        if result['first_error']:
+            print(f"      first error: {result['first_error'][:200]}")
+
+    if args.save_baseline:
+        baselines[args.target] = {'settings': settings, 'levels': levels}
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Saved baseline for {args.target} to {args.baseline}")
+    elif failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
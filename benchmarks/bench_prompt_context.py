@@ -0,0 +1,151 @@
+"""Measures what compact upstream context saves in downstream prompts.
+
+For sample city and hotel outputs, builds the hotel, budget, itinerary and
+local guide task descriptions twice, once with the full upstream text and
+once with the extracted names and key facts, and reports the prompt tokens
+of each. It first checks that the city names extracted from the output
+shapes in CITY_SHAPES are the expected ones, since the local guide keys
+shared facts on them, and exits with status 1 if any differ. With --live
+it also runs the whole pipeline against the configured LLM in both modes
+and reports the per-request latency.
+
+    python benchmarks/bench_prompt_context.py [--live] [--runs 3]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'v3', 'api'))
+
+from trip_agents import TripAgents, triptasks
+from trip_cache import place_key
+from trip_extract import compact_context
+from trip_pipeline import STAGES, TripPipeline, city_names, result_text
+
+
+SAMPLE_INPUTS = {
+    "travel_type": "leisure",
+    "travel_duration": "4-7 days",
+    "travel_budget": "$1000-$2500",
+    "travel_interests": "art, food",
+    "travel_dates": "June",
+    "destination_country": "France",
+}
+
+SAMPLE_CITIES = """Here are three cities in France that match your interests:
+
+- **Paris**: The capital of France is home to the Louvre, Musée d'Orsay and countless galleries. Its cafés and riverside walks make it ideal for a leisurely art-focused trip.
+- **Lyon**: France's gastronomic capital offers a UNESCO-listed old town and excellent food markets. It is also well connected by high-speed rail to the rest of the country.
+- **Nice**: Set on the Côte d'Azur, Nice combines beaches with the Matisse and Chagall museums. The mild June weather makes it perfect for outdoor exploring."""
+
+SAMPLE_HOTELS = """Here are 3 hotels in the recommended cities:
+
+1. **Hôtel Le Marais Boutique**
+   - Location: Le Marais, Paris
+   - Key Features: Free Wi-Fi, rooftop terrace, walking distance to the Picasso Museum and Place des Vosges
+   - Price Estimate: $180-$220 per night
+
+2. **Cour des Loges**
+   - Location: Vieux Lyon, Lyon
+   - Key Features: Renaissance building, spa, Michelin-starred restaurant and a cocktail bar in the courtyard
+   - Price Estimate: $250-$320 per night
+
+3. **Hotel La Pérouse**
+   - Location: Castle Hill, Nice
+   - Key Features: Sea views over the Baie des Anges, outdoor pool, lemon-tree garden terrace
+   - Price Estimate: $200-$280 per night"""
+
+# City stage outputs in the shapes agents actually write, with the city
+# names the local guide should get for them
+CITY_SHAPES = [
+    (SAMPLE_CITIES, ['Paris', 'Lyon', 'Nice']),
+    ("City 1: Rome\nThe capital, full of ancient sites.\nCity 2: Florence\nRenaissance art.\nCity 3: Venice\nCanals.",
+     ['Rome', 'Florence', 'Venice']),
+    ("Option 1: Lisbon - hills and trams\nOption 2: Porto - port wine cellars\nOption 3: Faro - beaches",
+     ['Lisbon', 'Porto', 'Faro']),
+    ("1. **Kyoto**\nTemples and gardens.\n2. **Osaka**\nStreet food capital.\n3. **Nara**\nDeer park.",
+     ['Kyoto', 'Osaka', 'Nara']),
+    # Labels without a name must not be taken for cities
+    ("City 1:\nA coastal town with a long beach.\nCity 2:\nA mountain village.", []),
+]
+
+
+def check_city_names():
+    """Return a failure message for every CITY_SHAPES output whose city names differ from the expected ones"""
+    failures = []
+    for output, expected in CITY_SHAPES:
+        names = city_names(output)
+        if [place_key(name) for name in names] != [place_key(name) for name in expected]:
+            failures.append(f"{output.splitlines()[0]!r}...: got {names}, expected {expected}")
+    return failures
+
+
+def token_counter():
+    """Count tokens with tiktoken when it is available, otherwise estimate four characters per token"""
+    try:
+        import tiktoken
+        encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
+        return lambda text: len(encoding.encode(text)), 'tiktoken'
+    except Exception:
+        return lambda text: (len(text) + 3) // 4, 'estimated'
+
+
+def prompt_tokens(count, upstream):
+    """Return the prompt tokens of each downstream task description"""
+    tasks = triptasks()
+    inputs = dict(SAMPLE_INPUTS, recommended_cities=upstream(SAMPLE_CITIES), recommended_hotels=upstream(SAMPLE_HOTELS))
+    return {
+        name: count(getattr(tasks, task_method)(inputs, None).description)
+        for name, depends_on, agent_method, task_method in STAGES if depends_on
+    }
+
+
+def live_latency(compact, runs):
+    """Return the mean seconds per request for the whole pipeline"""
+    pipeline = TripPipeline(TripAgents(), triptasks(), compact_upstream=compact)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        pipeline.run(SAMPLE_INPUTS)
+        timings.append(time.perf_counter() - start)
+    return sum(timings) / len(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--live', action='store_true', help='also time real pipeline runs (needs OPENAI_API_KEY)')
+    parser.add_argument('--runs', type=int, default=3, help='pipeline runs per mode with --live')
+    args = parser.parse_args()
+
+    failures = check_city_names()
+    print(f"city names: {len(CITY_SHAPES) - len(failures)}/{len(CITY_SHAPES)} output shapes extracted as expected")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    print()
+
+    count, method = token_counter()
+    full = prompt_tokens(count, result_text)
+    compact = prompt_tokens(count, compact_context)
+
+    print(f"prompt tokens ({method})")
+    print(f"{'stage':<14}{'full':>8}{'compact':>10}{'saved':>8}")
+    for name in full:
+        print(f"{name:<14}{full[name]:>8}{compact[name]:>10}{full[name] - compact[name]:>8}")
+    total_full, total_compact = sum(full.values()), sum(compact.values())
+    print(f"{'per request':<14}{total_full:>8}{total_compact:>10}{total_full - total_compact:>8}"
+          f"  ({(total_full - total_compact) / total_full:.0%})")
+
+    if args.live:
+        # Every run has to reach the LLM, so keep the completion cache out of it
+        os.environ['TRIP_COMPLETION_CACHE_PATH'] = ''
+        full_latency = live_latency(False, args.runs)
+        compact_latency = live_latency(True, args.runs)
+        print(f"\nlatency per request: full {full_latency:.2f}s, compact {compact_latency:.2f}s, "
+              f"saved {full_latency - compact_latency:.2f}s")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Deadline check for the synchronous planning stages on the stub LLM.
+
+Runs the cities stage with a deadline that passes while its first answer
+is still streaming, and counts the LLM calls the agent starts and the
+requests that reach the model. CrewAI's agent loop turns exceptions into
+observations and retries a failed task, so unless the stage ends the loop
+when its deadline passes the agent keeps starting calls until it runs out
+of iterations. Exits with status 1 if any call starts after the deadline,
+or if the stage does not end within --grace seconds of it.
+
+    python benchmarks/bench_stage_deadline.py [--deadline 0.3] [--grace 0.5]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'v3', 'api'))
+
+
+def configure(args):
+    """Point the pipeline at a slow stub whose first answer outlasts the deadline"""
+    os.environ.update({
+        'TRIP_LLM_BACKEND': 'stub',
+        'TRIP_STUB_LATENCY': str(args.latency),
+        'TRIP_STUB_TOKENS_PER_SEC': '50',
+        'TRIP_COMPLETION_CACHE_PATH': '',
+        'TRIP_KNOWLEDGE_CACHE_PATH': '',
+        'TRIP_WARMUP': 'false',
+        'OTEL_SDK_DISABLED': 'true'
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--deadline', type=float, default=0.3, help='seconds the stage may run')
+    parser.add_argument('--latency', type=float, default=0.1, help='stub seconds before the first token')
+    parser.add_argument('--grace', type=float, default=0.5, help='seconds the stage may take to stop after its deadline')
+    args = parser.parse_args()
+    configure(args)
+
+    from app import trip_planner
+    from trip_agents import StageCancelled, token_stream
+    from trip_pipeline import STAGES
+    from trip_stub_llm import StubChatModel
+
+    started_calls = []
+    requests = []
+    check_deadline = token_stream.check_deadline
+    stream = StubChatModel._stream
+
+    def on_chat_model_start(serialized, messages, **kwargs):
+        started_calls.append(time.monotonic())
+        check_deadline()
+
+    def counted_stream(self, *call_args, **call_kwargs):
+        requests.append(time.monotonic())
+        return stream(self, *call_args, **call_kwargs)
+
+    token_stream.on_chat_model_start = on_chat_model_start
+    StubChatModel._stream = counted_stream
+
+    data = {'destination': 'France', 'startDate': '2026-11-01', 'endDate': '2026-11-04'}
+    inputs, pipeline, key = trip_planner.prepare_inputs(data)
+    started = time.monotonic()
+    expires = started + args.deadline
+    try:
+        pipeline.run_stage(STAGES[0], inputs, expires=expires)
+        outcome = 'completed'
+    except StageCancelled:
+        outcome = 'cancelled'
+    except Exception as e:
+        outcome = f"failed: {e}"
+    stopped = time.monotonic()
+
+    late_calls = sum(1 for at in started_calls if at >= expires)
+    late_requests = sum(1 for at in requests if at >= expires)
+    overrun = stopped - expires
+    print(f"stage {outcome} after {stopped - started:.2f}s (deadline {args.deadline}s)")
+    print(f"LLM calls started: {len(started_calls)}, after the deadline: {late_calls}")
+    print(f"requests reaching the model: {len(requests)}, after the deadline: {late_requests}")
+
+    failures = []
+    if late_calls or late_requests:
+        failures.append(f"{late_calls} LLM calls started after the deadline")
+    if overrun > args.grace:
+        failures.append(f"the stage ran {overrun:.2f}s past its deadline")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
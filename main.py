@@ -1,8 +1,10 @@
 import streamlit as st
 import os
 from datetime import datetime, date
-from trip_agents import TripAgents, triptasks
-from crewai import Agent, Task, Crew
+from trip_agents import TripAgents, triptasks, canonicalize_inputs, BUDGET_RANGES
+from trip_pipeline import TripPipeline, STAGES
+from trip_formatter import format_markdown
+from trip_tracing import tracer
 from langchain_openai import ChatOpenAI
 from dotenv import load_dotenv
 import time
@@ -78,100 +80,24 @@ if 'trip_results' not in st.session_state:
 if 'planning_complete' not in st.session_state:
     st.session_state.planning_complete = False
 
+# Status shown once a stage finishes, describing the work still in progress
+STAGE_STATUS = {
+    'cities': "🏨 Finding hotels, itinerary and local insights for recommended cities...",
+    'hotels': "💰 Creating budget plan for recommended destinations...",
+    'budget': "📋 Finishing itinerary and local insights...",
+    'itinerary': "🗺️ Gathering remaining trip details...",
+    'local_guide': "🗺️ Gathering remaining trip details...",
+}
+
+@st.cache_resource
+def get_pipeline():
+    """Build the planning pipeline once so its agents and LLM client are shared by every session"""
+    return TripPipeline(TripAgents(), triptasks())
+
 def format_ai_output(result):
     """Format CrewAI output for better user display with proper headings and structure"""
     try:
-        # Try to extract the raw content from CrewAI result
-        if hasattr(result, 'raw'):
-            content = str(result.raw)
-        else:
-            content = str(result)
-        
-        # Clean up the content for better display
-        content = content.replace('\\n', '\n')
-        content = content.replace('**', '')
-        
-        # Split into lines for processing
-        lines = content.split('\n')
-        formatted_lines = []
-        
-        for i, line in enumerate(lines):
-            line = line.strip()
-            if not line:
-                continue
-                
-            # Check for city/location names (often followed by colon)
-            if ':' in line and not line.startswith(('•', '-', '*', '1.', '2.', '3.', '4.', '5.')) and len(line.split(':')[0]) < 50:
-                # This looks like a location or section header
-                location_name = line.split(':')[0].strip()
-                if location_name and not any(word in location_name.lower() for word in ['hotel', 'day', 'cost', 'price', 'budget']):
-                    formatted_lines.append(f"## 🌟 {location_name}")
-                    # Add the description after the colon if it exists
-                    if len(line.split(':', 1)) > 1:
-                        description = line.split(':', 1)[1].strip()
-                        if description:
-                            formatted_lines.append(description)
-                else:
-                    formatted_lines.append(f"### {line}")
-            
-            # Handle hotel names or numbered items
-            elif line.startswith(('Hotel 1:', 'Hotel 2:', 'Hotel 3:', 'Day 1:', 'Day 2:', 'Day 3:', 'Day 4:', 'Day 5:')):
-                formatted_lines.append(f"## 🏨 {line}" if 'Hotel' in line else f"## 📅 {line}")
-            
-            # Handle main section headings
-            elif any(section in line.lower() for section in ['accommodation', 'transportation', 'food', 'activities', 'budget breakdown', 'weather', 'best time to visit']):
-                formatted_lines.append(f"### 📋 {line}")
-            
-            # Handle bullet points and lists
-            elif line.startswith('-') or line.startswith('*'):
-                bullet_content = line[1:].strip()
-                # Check if this bullet point contains a sub-category
-                if ':' in bullet_content and len(bullet_content.split(':')[0]) < 30:
-                    category = bullet_content.split(':')[0].strip()
-                    description = bullet_content.split(':', 1)[1].strip()
-                    formatted_lines.append(f"**{category}:** {description}")
-                else:
-                    formatted_lines.append(f"• {bullet_content}")
-            
-            # Handle numbered lists
-            elif line.startswith(('1.', '2.', '3.', '4.', '5.', '6.', '7.', '8.', '9.')):
-                formatted_lines.append(f"**{line}**")
-            
-            # Handle price/cost information
-            elif any(word in line.lower() for word in ['price', 'cost', '$', 'budget', 'estimate']):
-                formatted_lines.append(f"💰 **{line}**")
-            
-            # Handle location information
-            elif line.startswith('Location:'):
-                formatted_lines.append(f"📍 **{line}**")
-            
-            # Handle features/amenities
-            elif any(word in line.lower() for word in ['features:', 'amenities:', 'includes:']):
-                formatted_lines.append(f"✨ **{line}**")
-            
-            # Regular text
-            else:
-                formatted_lines.append(line)
-        
-        # Join with proper spacing
-        result_text = []
-        for i, line in enumerate(formatted_lines):
-            if line.startswith('##'):
-                # Add extra space before main headings
-                if i > 0:
-                    result_text.append('')
-                result_text.append(line)
-                result_text.append('')
-            elif line.startswith('###'):
-                # Add space before subheadings
-                if i > 0:
-                    result_text.append('')
-                result_text.append(line)
-            else:
-                result_text.append(line)
-        
-        return '\n'.join(result_text) if result_text else content
-        
+        return format_markdown(result)
     except Exception as e:
         return str(result)
 
@@ -199,7 +125,7 @@ def main():
         # Travel Budget
         travel_budget = st.selectbox(
             "Travel Budget 💰",
-            ["Under $500", "$500-$1000", "$1000-$2500", "$2500-$5000", "$5000+"]
+            BUDGET_RANGES
         )
         
         # Travel Interests
@@ -232,15 +158,15 @@ def main():
             st.error("Please select at least one travel interest!")
             return
             
-        # Prepare inputs
-        inputs = {
+        # Prepare canonical inputs so equivalent preferences share cache entries
+        inputs = canonicalize_inputs({
             "travel_type": travel_type.lower(),
             "travel_duration": travel_duration,
             "travel_budget": travel_budget,
             "travel_interests": ", ".join(travel_interests),
             "travel_dates": str(travel_dates[0]) if travel_dates else str(date.today()),
             "destination_country": destination_country if destination_country else "any country"
-        }
+        }, os.getenv('TRIP_DATE_BUCKET', 'month'))
         
         # Check for OpenAI API key
         if not os.getenv("OPENAI_API_KEY"):
@@ -259,107 +185,24 @@ def main():
         status_text = st.empty()
         
         try:
-            # Initialize agents and tasks
-            agents = TripAgents()
-            tasks = triptasks()
+            # Agents are built once per process and reused across runs
+            pipeline = get_pipeline()
             
-            # Step 1: City Selection
+            # Hotels, itinerary and local guide run together once the cities are
+            # known; the budget waits for the hotels
             status_text.text("🏙️ Selecting best cities for your trip...")
-            progress_bar.progress(20)
-            
-            city_selector_agent = agents.city_selector()
-            city_task = tasks.city_selector_task(inputs, city_selector_agent)
-            
-            city_crew = Crew(
-                agents=[city_selector_agent],
-                tasks=[city_task],
-                verbose=False
-            )
-            
-            city_result = city_crew.kickoff()
-            city_recommendations = format_ai_output(city_result)
-            st.session_state.trip_results['cities'] = city_recommendations
-            
-            # Extract city names for subsequent tasks
-            city_text = str(city_result.raw) if hasattr(city_result, 'raw') else str(city_result)
-            
-            # Step 2: Hotel Selection (based on recommended cities)
-            status_text.text("🏨 Finding best hotels in recommended cities...")
-            progress_bar.progress(40)
-            
-            # Update inputs to include recommended cities
-            hotel_inputs = inputs.copy()
-            hotel_inputs['recommended_cities'] = city_text
-            
-            hotel_selector_agent = agents.hotel_selector()
-            hotel_task = tasks.hotel_selector_task(hotel_inputs, hotel_selector_agent)
-            
-            hotel_crew = Crew(
-                agents=[hotel_selector_agent],
-                tasks=[hotel_task],
-                verbose=False
-            )
-            
-            hotel_result = hotel_crew.kickoff()
-            st.session_state.trip_results['hotels'] = format_ai_output(hotel_result)
-            
-            # Step 3: Budget Planning (based on cities and hotels)
-            status_text.text("💰 Creating budget plan for recommended destinations...")
-            progress_bar.progress(60)
-            
-            budget_inputs = inputs.copy()
-            budget_inputs['recommended_cities'] = city_text
-            budget_inputs['recommended_hotels'] = str(hotel_result.raw) if hasattr(hotel_result, 'raw') else str(hotel_result)
-            
-            budget_agent = agents.budget_manager_agent()
-            budget_task = tasks.budget_manager_task(budget_inputs, budget_agent)
-            
-            budget_crew = Crew(
-                agents=[budget_agent],
-                tasks=[budget_task],
-                verbose=False
-            )
-            
-            budget_result = budget_crew.kickoff()
-            st.session_state.trip_results['budget'] = format_ai_output(budget_result)
-            
-            # Step 4: Itinerary Planning (based on cities)
-            status_text.text("📋 Creating detailed itinerary for recommended cities...")
-            progress_bar.progress(80)
-            
-            itinerary_inputs = inputs.copy()
-            itinerary_inputs['recommended_cities'] = city_text
-            
-            itinerary_agent = agents.itinerary_planner()
-            itinerary_task = tasks.itinerary_planner_task(itinerary_inputs, itinerary_agent)
-            
-            itinerary_crew = Crew(
-                agents=[itinerary_agent],
-                tasks=[itinerary_task],
-                verbose=False
-            )
-            
-            itinerary_result = itinerary_crew.kickoff()
-            st.session_state.trip_results['itinerary'] = format_ai_output(itinerary_result)
-            
-            # Step 5: Local Guide Information (based on cities)
-            status_text.text("🗺️ Gathering local insights for recommended destinations...")
-            progress_bar.progress(100)
-            
-            guide_inputs = inputs.copy()
-            guide_inputs['recommended_cities'] = city_text
-            
-            local_guide_agent = agents.local_guide()
-            city_research_task = tasks.city_researcher_task(guide_inputs, local_guide_agent)
-            
-            guide_crew = Crew(
-                agents=[local_guide_agent],
-                tasks=[city_research_task],
-                verbose=False
-            )
-            
-            guide_result = guide_crew.kickoff()
-            st.session_state.trip_results['local_guide'] = format_ai_output(guide_result)
+            completed = []
+            
+            def on_stage_complete(section, result):
+                completed.append(section)
+                with tracer.span(f'{section}.format'):
+                    st.session_state.trip_results[section] = format_ai_output(result)
+                progress_bar.progress(int(100 * len(completed) / len(STAGES)))
+                if len(completed) < len(STAGES):
+                    status_text.text(STAGE_STATUS[section])
+            
+            with tracer.span('plan_trip'):
+                pipeline.run(inputs, on_stage_complete)
             
             status_text.text("✅ Trip planning completed!")
             st.session_state.planning_complete = True
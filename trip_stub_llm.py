@@ -0,0 +1,124 @@
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+import asyncio
+import hashlib
+import os
+import random
+import time
+
+
+CITIES = ["Lisbon", "Kyoto", "Cusco", "Marrakech", "Vienna", "Hoi An", "Cape Town", "Oaxaca", "Tallinn", "Hobart"]
+WORDS = (
+    "old town harbour market museum cathedral garden viewpoint tram ferry trail beach "
+    "cafe gallery festival river bridge palace quarter bazaar temple night food tour "
+    "local guide sunset rooftop vineyard canal castle street art walk park"
+).split()
+
+
+class StubChatModel(BaseChatModel):
+    """Deterministic local stand-in for the OpenAI chat model.
+
+    Answers in CrewAI's 'Final Answer:' format with travel-like text built
+    from a hash of the prompt, so the same prompt always gets the same
+    answer. The wait before the first token, the token rate and the answer
+    length are configurable, which makes it possible to benchmark the
+    planning pipeline without the network or an API key.
+    """
+
+    # Named model rather than model_name: CrewAI attaches its tiktoken-based
+    # token counter to models with a model_name, and that needs the network
+    model: str = "stub"
+    temperature: float = 0.7
+    streaming: bool = True
+    latency: float = 0.5
+    tokens_per_second: float = 50.0
+    output_tokens: int = 200
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        """Create a stub configured by TRIP_STUB_LATENCY, TRIP_STUB_TOKENS_PER_SEC and TRIP_STUB_OUTPUT_TOKENS"""
+        return cls(
+            latency=float(os.getenv('TRIP_STUB_LATENCY', '0.5')),
+            tokens_per_second=float(os.getenv('TRIP_STUB_TOKENS_PER_SEC', '50')),
+            output_tokens=int(os.getenv('TRIP_STUB_OUTPUT_TOKENS', '200')),
+            **kwargs
+        )
+
+    @property
+    def _llm_type(self):
+        return "trip-stub"
+
+    def answer_tokens(self, messages):
+        """Return the tokens of the deterministic answer to a prompt"""
+        prompt = '\n'.join(str(message.content) for message in messages)
+        rng = random.Random(hashlib.sha256(prompt.encode('utf-8')).hexdigest())
+        tokens = ["Thought: ", "I ", "now ", "can ", "give ", "a ", "great ", "answer\n", "Final ", "Answer: "]
+
+        # Cycle through the line shapes the formatter and extractor understand:
+        # a city entry, then a price, a detail bullet and a line of text about it
+        line = 0
+        while len(tokens) < self.output_tokens:
+            kind = line % 4
+            if kind == 0:
+                tokens += [f"{rng.choice(CITIES)}: "] + [f"{rng.choice(WORDS)} " for _ in range(rng.randint(8, 16))]
+            elif kind == 1:
+                tokens += ["- ", "Price: ", f"${rng.randint(40, 400)} ", "per ", "night"]
+            elif kind == 2:
+                tokens += ["- "] + [f"{rng.choice(WORDS)} " for _ in range(rng.randint(4, 10))]
+            else:
+                tokens += [f"{rng.choice(WORDS).capitalize()} "] + [f"{rng.choice(WORDS)} " for _ in range(rng.randint(6, 14))]
+            tokens[-1] = tokens[-1].rstrip() + "\n"
+            line += 1
+        return tokens[:max(self.output_tokens, 10)]
+
+    def usage(self, messages, tokens):
+        prompt_tokens = sum(len(str(message.content)) for message in messages) // 4
+        return {'input_tokens': prompt_tokens, 'output_tokens': len(tokens), 'total_tokens': prompt_tokens + len(tokens)}
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self.answer_tokens(messages)
+        delay = self.latency + (len(tokens) / self.tokens_per_second if self.tokens_per_second > 0 else 0)
+        time.sleep(delay)
+        message = AIMessage(content=''.join(tokens), usage_metadata=self.usage(messages, tokens))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self.answer_tokens(messages)
+        interval = 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0
+        time.sleep(self.latency)
+        # Pace against a schedule so short sleeps do not add up to a slower rate
+        start = time.perf_counter()
+        for i, token in enumerate(tokens, 1):
+            wait = start + i * interval - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+        # The last chunk carries the usage, as OpenAI does with stream_usage
+        yield ChatGenerationChunk(message=AIMessageChunk(content='', usage_metadata=self.usage(messages, tokens)))
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self.answer_tokens(messages)
+        delay = self.latency + (len(tokens) / self.tokens_per_second if self.tokens_per_second > 0 else 0)
+        await asyncio.sleep(delay)
+        message = AIMessage(content=''.join(tokens), usage_metadata=self.usage(messages, tokens))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        # Same schedule as _stream, awaited so one event loop can serve many plans
+        tokens = self.answer_tokens(messages)
+        interval = 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0
+        await asyncio.sleep(self.latency)
+        start = time.perf_counter()
+        for i, token in enumerate(tokens, 1):
+            wait = start + i * interval - time.perf_counter()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+        yield ChatGenerationChunk(message=AIMessageChunk(content='', usage_metadata=self.usage(messages, tokens)))
@@ -1,17 +1,443 @@
 from crewai import Agent, Task, Crew
 from langchain_openai import ChatOpenAI
+from langchain_core.callbacks import BaseCallbackHandler
+from trip_ratelimit import AsyncRateLimitedTransport, RateLimitedTransport, rate_limiter
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+import httpx
+import importlib
+import json
 import os 
+import re
+import threading
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 
-llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0.7)
 
+def disable_crewai_telemetry():
+    """Stop crewai from starting a telemetry exporter thread for every Task and Crew.
+
+    crewai 0.51 builds a TracerProvider with its own BatchSpanProcessor
+    thread in each Telemetry() and never shuts it down, so a long-running
+    server gains a thread per planning stage. Every Telemetry method checks
+    ready first, so an instance that is never ready does nothing.
+    """
+    try:
+        from crewai.telemetry import Telemetry
+    except ImportError:
+        return
+
+    def __init__(self):
+        self.ready = False
+        self.trace_set = False
+
+    Telemetry.__init__ = __init__
+
+
+if os.getenv('TRIP_CREWAI_TELEMETRY', 'false').lower() != 'true':
+    disable_crewai_telemetry()
+
+# Budget ranges offered by the Streamlit app; every budget is bucketed into one of these
+BUDGET_RANGES = ["Under $500", "$500-$1000", "$1000-$2500", "$2500-$5000", "$5000+"]
+BUDGET_LIMITS = [500, 1000, 2500, 5000]
+
+# Named budget tiers sent by the React frontend, mapped to the closest range
+BUDGET_TIERS = {
+    "budget": "$500-$1000",
+    "mid-range": "$1000-$2500",
+    "luxury": "$2500-$5000",
+}
+
+# Hemisphere-neutral seasons so the same bucket reads correctly for any destination
+SEASONS = ["December-February", "March-May", "June-August", "September-November"]
+
+
+def canonical_interests(interests):
+    """Case-fold, de-duplicate and sort interests so equivalent selections match"""
+    if isinstance(interests, str):
+        interests = interests.split(',')
+    return ", ".join(sorted({interest.strip().casefold() for interest in interests if interest.strip()}))
+
+
+def canonical_budget(budget):
+    """Bucket a budget into one of BUDGET_RANGES, keeping unrecognised values as-is"""
+    budget = str(budget).strip()
+    for budget_range in BUDGET_RANGES:
+        if budget.casefold() == budget_range.casefold():
+            return budget_range
+    if budget.casefold() in BUDGET_TIERS:
+        return BUDGET_TIERS[budget.casefold()]
+
+    amounts = [float(amount.replace(',', '')) for amount in re.findall(r'\d[\d,]*(?:\.\d+)?', budget)]
+    if not amounts:
+        return budget
+    amount = sum(amounts) / len(amounts)
+    for limit, budget_range in zip(BUDGET_LIMITS, BUDGET_RANGES):
+        if amount < limit:
+            return budget_range
+    return BUDGET_RANGES[-1]
 
-class TripAgents:
+
+def canonical_dates(travel_dates, date_bucket="month"):
+    """Bucket a start date to its month name or season, keeping unparseable values as-is"""
+    try:
+        start = datetime.strptime(str(travel_dates).strip()[:10], "%Y-%m-%d")
+    except ValueError:
+        return travel_dates
+    if date_bucket == "season":
+        return SEASONS[start.month % 12 // 3]
+    return start.strftime("%B")
+
+
+def canonicalize_inputs(inputs, date_bucket="month"):
+    """Normalize free-form trip preferences so equivalent requests share cache entries"""
+    canonical = inputs.copy()
+    canonical['travel_type'] = str(inputs.get('travel_type', '')).strip().casefold()
+    canonical['travel_budget'] = canonical_budget(inputs.get('travel_budget', ''))
+    canonical['travel_interests'] = canonical_interests(inputs.get('travel_interests', ''))
+    canonical['travel_dates'] = canonical_dates(inputs.get('travel_dates', ''), date_bucket)
+    canonical['destination_country'] = str(inputs.get('destination_country') or 'any country').strip().casefold()
+    return canonical
+
+
+class StageCancelled(Exception):
+    """Raised inside an LLM call whose stage ran past its deadline"""
+
+
+class TokenStream(BaseCallbackHandler):
+    """Forwards streamed LLM tokens to the stage running on the current thread or task.
+
+    Stages run on worker threads, or as asyncio tasks in the ASGI app, so
+    whoever starts a stage sets a sink for it and every token the agent
+    generates is passed to it. A stage can also set a deadline: once it
+    passes, the next LLM call or streamed token raises StageCancelled,
+    which stops the call. Both are context variables, which behave like
+    thread locals on threads and are copied into each new asyncio task.
+    """
+
+    # Let StageCancelled reach the LLM call instead of being logged and ignored
+    raise_error = True
+    # Called directly on the event loop instead of on an executor thread
+    run_inline = True
 
     def __init__(self):
-        self.llm=ChatOpenAI(model="gpt-3.5-turbo", temperature=0.7)
+        self.current_sink = ContextVar('trip_token_sink', default=None)
+        self.current_deadline = ContextVar('trip_stage_deadline', default=None)
+
+    def set_sink(self, sink):
+        self.current_sink.set(sink)
+
+    def sink(self):
+        """Return the sink of the current thread or task, or None"""
+        return self.current_sink.get()
+
+    def set_deadline(self, expires):
+        """Cancel LLM calls of this thread or task after expires, a time.monotonic() value, or never if None"""
+        self.current_deadline.set(expires)
+
+    def deadline(self):
+        return self.current_deadline.get()
+
+    def check_deadline(self):
+        expires = self.deadline()
+        if expires is not None and time.monotonic() >= expires:
+            raise StageCancelled("Stage ran past its deadline")
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.check_deadline()
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.check_deadline()
+        sink = self.sink()
+        if sink and token:
+            sink(token)
+
+
+token_stream = TokenStream()
+
+
+class TokenUsage(BaseCallbackHandler):
+    """Counts the prompt and completion tokens of LLM calls made on the current thread or task.
+
+    Uses the usage the API reports for each call. When a provider reports
+    none, prompt tokens are estimated at four characters per token and each
+    streamed token is counted as one completion token.
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        self.counting = ContextVar('trip_token_usage', default=None)
+
+    def start(self):
+        """Start counting the calls made on this thread or task"""
+        self.counting.set({'usage': [0, 0], 'estimate': 0, 'streamed': 0})
+
+    def stop(self):
+        """Stop counting and return (prompt_tokens, completion_tokens) since start()"""
+        counting = self.counting.get()
+        self.counting.set(None)
+        return tuple(counting['usage']) if counting else (0, 0)
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        counting = self.counting.get()
+        if counting is not None:
+            counting['estimate'] = sum(len(str(message.content)) for batch in messages for message in batch) // 4
+            counting['streamed'] = 0
+
+    def on_llm_new_token(self, token, **kwargs):
+        counting = self.counting.get()
+        if counting is not None:
+            counting['streamed'] += 1
+
+    def on_llm_end(self, response, **kwargs):
+        counting = self.counting.get()
+        if counting is None:
+            return
+
+        usage = counting['usage']
+        reported = False
+        for generations in response.generations:
+            for generation in generations:
+                metadata = getattr(getattr(generation, 'message', None), 'usage_metadata', None)
+                if metadata:
+                    usage[0] += metadata.get('input_tokens', 0)
+                    usage[1] += metadata.get('output_tokens', 0)
+                    reported = True
+        if not reported:
+            usage[0] += counting['estimate']
+            usage[1] += counting['streamed']
+
+
+token_usage = TokenUsage()
+
+_llm_lock = threading.RLock()
+_http_client = None
+_async_http_client = None
+_llms = {}
+
+
+def http_limits():
+    max_connections = int(os.getenv('TRIP_LLM_MAX_CONNECTIONS', '20'))
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+        keepalive_expiry=float(os.getenv('TRIP_LLM_KEEPALIVE', '60'))
+    )
+
+
+def http_timeout():
+    return httpx.Timeout(float(os.getenv('TRIP_LLM_TIMEOUT', '120')), connect=10.0)
+
+
+def shared_http_client():
+    """Return the process-wide keep-alive connection pool used for every LLM call, behind the rate limiter"""
+    global _http_client
+    with _llm_lock:
+        if _http_client is None:
+            transport = httpx.HTTPTransport(limits=http_limits())
+            # Every call goes through the process-wide rate limiter unless it is turned off
+            if rate_limiter:
+                transport = RateLimitedTransport(transport, rate_limiter)
+            _http_client = httpx.Client(transport=transport, timeout=http_timeout())
+        return _http_client
+
+
+def shared_async_http_client():
+    """Return the connection pool for LLM calls awaited on an event loop, behind the same rate limiter.
+
+    Its connections belong to the event loop that first uses them, which is
+    the ASGI server's single loop.
+    """
+    global _async_http_client
+    with _llm_lock:
+        if _async_http_client is None:
+            transport = httpx.AsyncHTTPTransport(limits=http_limits())
+            if rate_limiter:
+                transport = AsyncRateLimitedTransport(transport, rate_limiter)
+            _async_http_client = httpx.AsyncClient(transport=transport, timeout=http_timeout())
+        return _async_http_client
+
+
+def openai_llm(model, temperature, callbacks, max_tokens=None, timeout=None):
+    """Chat model that calls the OpenAI API over the shared connection pool"""
+    return ChatOpenAI(
+        model=model,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        timeout=timeout,
+        # RateLimiter retries 429s and server errors; SDK retries on top would multiply them
+        max_retries=0,
+        streaming=True,
+        stream_usage=True,
+        callbacks=callbacks,
+        http_client=shared_http_client(),
+        http_async_client=shared_async_http_client()
+    )
+
+
+def stub_llm(model, temperature, callbacks, max_tokens=None, timeout=None):
+    """Deterministic local model for benchmarks, configured through TRIP_STUB_* variables"""
+    from trip_stub_llm import StubChatModel
+    llm = StubChatModel.from_env(model=f"stub-{model}", temperature=temperature, callbacks=callbacks)
+    if max_tokens:
+        llm.output_tokens = min(llm.output_tokens, max_tokens)
+    return llm
+
+
+# Backends selectable with TRIP_LLM_BACKEND. Any 'module:function' path taking
+# the same (model, temperature, callbacks) arguments can be used as well; it
+# also gets max_tokens and timeout keywords when a model tier sets them.
+LLM_BACKENDS = {
+    "openai": openai_llm,
+    "stub": stub_llm,
+}
+
+
+def llm_backend(name):
+    """Return the factory for a backend name or 'module:function' path"""
+    if name in LLM_BACKENDS:
+        return LLM_BACKENDS[name]
+    if ':' in name:
+        module, function = name.split(':', 1)
+        return getattr(importlib.import_module(module), function)
+    raise ValueError(f"Unknown LLM backend: {name}")
+
+
+def shared_llm(model="gpt-3.5-turbo", temperature=0.7, backend=None, max_tokens=None, timeout=None):
+    """Return the process-wide LLM client for a backend and model settings.
+
+    Clients are built once; the OpenAI ones share one HTTP connection pool,
+    so requests reuse warm TLS connections instead of opening new ones.
+    """
+    backend = backend or os.getenv('TRIP_LLM_BACKEND', 'openai')
+    with _llm_lock:
+        key = (backend, model, temperature, max_tokens, timeout)
+        if key not in _llms:
+            limits = {name: value for name, value in (('max_tokens', max_tokens), ('timeout', timeout)) if value is not None}
+            _llms[key] = llm_backend(backend)(model, temperature, [token_stream, token_usage], **limits)
+        return _llms[key]
+
+
+# Model settings for each TripAgents method, per tier. A 'default' entry applies
+# to every agent. Every tier starts from the standard tier's settings, so a tier
+# only lists what it changes. TRIP_MODEL_CONFIG can name a JSON file of the same
+# shape whose entries are merged over these.
+MODEL_TIERS = {
+    "standard": {
+        "default": {"model": "gpt-3.5-turbo", "temperature": 0.7, "max_tokens": None, "timeout": None},
+    },
+    "fast": {
+        "default": {"model": "gpt-4o-mini", "max_tokens": 800, "timeout": 30},
+        "city_selector": {"max_tokens": 300},
+        "budget_manager_agent": {"max_tokens": 600},
+        "itinerary_planner": {"max_tokens": 1200, "timeout": 60},
+    },
+}
+
+
+class ModelRegistry:
+    """Looks up the model, temperature, max_tokens and timeout of each agent for a tier.
+
+    Settings are taken from the standard tier's 'default' and agent entries,
+    then from the requested tier's, later ones winning.
+    """
+
+    SETTINGS = ('model', 'temperature', 'max_tokens', 'timeout')
+
+    def __init__(self, tiers, default_tier="standard"):
+        for tier, agents in tiers.items():
+            for role, settings in agents.items():
+                unknown = set(settings) - set(self.SETTINGS)
+                if unknown:
+                    raise ValueError(f"Unknown model settings for {tier}.{role}: {', '.join(sorted(unknown))}")
+        if default_tier not in tiers:
+            raise ValueError(f"Unknown model tier: {default_tier}")
+        self.tiers = tiers
+        self.default_tier = default_tier
+
+    @classmethod
+    def from_env(cls):
+        """Create the registry from MODEL_TIERS, TRIP_MODEL_CONFIG and the TRIP_MODEL_TIER default"""
+        tiers = {tier: {role: dict(settings) for role, settings in agents.items()} for tier, agents in MODEL_TIERS.items()}
+        path = os.getenv('TRIP_MODEL_CONFIG')
+        if path:
+            try:
+                with open(path, encoding='utf-8') as f:
+                    config = json.load(f)
+            except Exception as e:
+                raise Exception(f"Error reading model config {path}: {str(e)}")
+            for tier, agents in config.items():
+                for role, settings in agents.items():
+                    tiers.setdefault(tier, {}).setdefault(role, {}).update(settings)
+        return cls(tiers, os.getenv('TRIP_MODEL_TIER', 'standard'))
+
+    def names(self):
+        return sorted(self.tiers)
+
+    def settings(self, tier, role):
+        """Return the LLM settings of a TripAgents method in a tier"""
+        if tier not in self.tiers:
+            raise ValueError(f"Unknown model tier: {tier}")
+        settings = {}
+        for name in dict.fromkeys(("standard", tier)):
+            settings.update(self.tiers.get(name, {}).get("default", {}))
+            settings.update(self.tiers.get(name, {}).get(role, {}))
+        return settings
+
+
+model_registry = ModelRegistry.from_env()
+
+
+class AgentRegistry:
+    """Builds each agent once and lends it to one crew at a time.
+
+    A Crew attaches itself and a fresh executor to the agents it runs, so an
+    agent cannot be shared by two crews at once. Idle agents are kept per
+    factory method and reused; a new one is only built when every existing
+    agent for that role is busy.
+    """
+
+    def __init__(self, agents):
+        self.agents = agents
+        self.idle = defaultdict(list)
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def agent(self, method):
+        """Borrow an agent built by the given TripAgents method"""
+        with self.lock:
+            agent = self.idle[method].pop() if self.idle[method] else None
+        if agent is None:
+            agent = getattr(self.agents, method)()
+        try:
+            yield agent
+        finally:
+            with self.lock:
+                self.idle[method].append(agent)
+
+
+class TripAgents:
+
+    def __init__(self, temperature=None, backend=None, tier=None, registry=None):
+        self.registry = registry or model_registry
+        self.tier = tier or self.registry.default_tier
+        # temperature=0 gives deterministic answers for requests that opt into
+        # cached results; otherwise each agent uses its tier's temperature
+        self.temperature = temperature
+        self.backend = backend
+        self.registry.settings(self.tier, "default")
+
+    def llm_for(self, role):
+        """Return the shared LLM client configured for a TripAgents method"""
+        settings = self.registry.settings(self.tier, role)
+        if self.temperature is not None:
+            settings["temperature"] = self.temperature
+        return shared_llm(backend=self.backend, **settings)
 
     def city_selector(self):
         return Agent(
@@ -19,7 +445,7 @@ class TripAgents:
             goal="Identify the best city for the trip based on the user's preferences",
             backstory="You are a city selector who is responsible for selecting a city for the trip." 
             "An expert in city selection and travel planning. With Extensive knowledge of the world's cities and their unique features.",
-            llm=self.llm,
+            llm=self.llm_for("city_selector"),
             verbose=True,
         )
     
@@ -29,7 +455,7 @@ class TripAgents:
             goal="Identify the best hotel for the trip based on the user's preferences",
             backstory="You are a hotel selector who is responsible for selecting a hotel for the trip." 
             "An expert in hotel selection and travel planning. With Extensive knowledge of the world's hotels and their unique features.",
-            llm=self.llm,
+            llm=self.llm_for("hotel_selector"),
             verbose=True,
         )
     
@@ -40,7 +466,7 @@ class TripAgents:
             backstory="You are a location selector who is responsible for selecting a location for the trip." 
             "An expert in location selection and travel planning. With Extensive knowledge of the world's locations and their unique features."
             "You are also a local guide who is responsible for providing detailed insights about the selected location.",
-            llm=self.llm,
+            llm=self.llm_for("local_guide"),
             verbose=True,
         )
     
@@ -50,7 +476,7 @@ class TripAgents:
             goal="Identify the best budget for the trip based on the user's preferences",
             backstory="You are a budget manager who is responsible for identifying the best budget for the trip." 
             "An expert in budget management and travel planning. With Extensive knowledge of the world's budgets and their unique features.",
-            llm=self.llm,
+            llm=self.llm_for("budget_manager_agent"),
             verbose=True,
         )
     
@@ -60,7 +486,7 @@ class TripAgents:
             goal="Identify the best itinerary for the trip based on the user's preferences",
             backstory="You are a itinerary planner who is responsible for identifying the best itinerary for the trip." 
             "An expert in itinerary planning and travel planning. With Extensive knowledge of the world's itineraries and their unique features.",
-            llm=self.llm,
+            llm=self.llm_for("itinerary_planner"),
             verbose=True,
         )
 
@@ -74,8 +500,9 @@ class triptasks:
         return Task(
             name="city_selector_task",
             description=(
-                f"analyze the user's preferences and provide 3 cities that the user can choose from"
-                f"The cities should be in the user's preferred country"
+                f"analyze the user's preferences and provide 3 cities that the user can choose from.\n"
+                f"The cities should be in the user's preferred country.\n"
+                f"Destination Country:{inputs.get('destination_country', 'any country')}\n"
                 f"Travel Type:{inputs['travel_type']}\n"
                 f"Travel Duration:{inputs['travel_duration']}\n"
                 f"Travel Budget:{inputs['travel_budget']}\n"
@@ -125,6 +552,43 @@ class triptasks:
             agent=agent,
             expected_output="Organized and detailed report of the recommended destinations with 2 sentence explanation each" ,
         )
+    def city_facts_task(self, inputs, agent):
+        return Task(
+            name="city_facts_task",
+            description=(
+                f"provide reusable travel facts about {inputs['city']} for a visit in {inputs['travel_dates']} including :\n"
+                f"1. Weather conditions\n"
+                f"2. Best time to visit\n"
+                f"3. Best restaurants\n"
+                f"4. Best hotels\n"
+                f"5. Best activities\n"
+                f"6. Best transportation options\n"
+                f"These facts are shared by every traveller visiting {inputs['city']} at that time, so do not tailor them to anyone's budget or interests. "
+                f"Cover a range of prices and tastes so each traveller can pick what suits them."
+            ),
+            agent=agent,
+            expected_output=f"Short factual notes about {inputs['city']} under the 6 headings, with names and one line each" ,
+        )
+
+    def personalized_guide_task(self, inputs, agent):
+        recommended_cities = inputs.get('recommended_cities', '')
+        return Task(
+            name="personalized_guide_task",
+            description=(
+                f"provide detailed insights about the recommended destinations for this traveller, using the facts below:\n"
+                f"{inputs.get('city_facts', '')}\n"
+                f"Travel Type: {inputs['travel_type']}\n"
+                f"Travel Duration: {inputs['travel_duration']}\n"
+                f"Travel Budget: {inputs['travel_budget']}\n"
+                f"Travel Interests: {inputs['travel_interests']}\n"
+                f"Recommended Cities: {recommended_cities}\n"
+                f"IMPORTANT: Cover weather, best time to visit, restaurants, hotels, activities and transportation for each recommended city, "
+                f"choosing from the facts above what fits the traveller's budget and interests. Do not research anything else."
+            ),
+            agent=agent,
+            expected_output="Organized and detailed report of the recommended destinations with 2 sentence explanation each" ,
+        )
+
     def itinerary_planner_task(self, inputs, agent):
         recommended_cities = inputs.get('recommended_cities', '')
         return Task(
@@ -167,17 +631,20 @@ class TripCrew(Crew):
     def __init__(self, inputs):
         self.inputs = inputs
 
-        city_selector_agent = TripAgents().city_selector()
-        hotel_selector_agent = TripAgents().hotel_selector()
-        local_guide_agent = TripAgents().local_guide()
-        budget_manager_agent = TripAgents().budget_manager_agent()
-        itinerary_planner_agent = TripAgents().itinerary_planner()
-
-        city_selector_task = triptasks().city_selector_task(self.inputs, city_selector_agent)
-        hotel_selector_task = triptasks().hotel_selector_task(self.inputs, hotel_selector_agent)
-        city_researcher_task = triptasks().city_researcher_task("Paris", local_guide_agent)
-        budget_manager_task = triptasks().budget_manager_task(self.inputs, budget_manager_agent)
-        itinerary_planner_task = triptasks().itinerary_planner_task(self.inputs,"Paris", itinerary_planner_agent)
+        agents = TripAgents()
+        tasks = triptasks()
+
+        city_selector_agent = agents.city_selector()
+        hotel_selector_agent = agents.hotel_selector()
+        local_guide_agent = agents.local_guide()
+        budget_manager_agent = agents.budget_manager_agent()
+        itinerary_planner_agent = agents.itinerary_planner()
+
+        city_selector_task = tasks.city_selector_task(self.inputs, city_selector_agent)
+        hotel_selector_task = tasks.hotel_selector_task(self.inputs, hotel_selector_agent)
+        city_researcher_task = tasks.city_researcher_task("Paris", local_guide_agent)
+        budget_manager_task = tasks.budget_manager_task(self.inputs, budget_manager_agent)
+        itinerary_planner_task = tasks.itinerary_planner_task(self.inputs,"Paris", itinerary_planner_agent)
 
         crew=crew(
             agents=[city_selector_agent, hotel_selector_agent, local_guide_agent, budget_manager_agent, itinerary_planner_agent],
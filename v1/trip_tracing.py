@@ -0,0 +1,211 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+import argparse
+import json
+import math
+import os
+import threading
+import time
+import uuid
+
+
+class Span:
+    """One timed operation within a trace"""
+
+    def __init__(self, name, trace_id, parent_id=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start = time.time()
+        self.end = None
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': self.start,
+            'end': self.end,
+            'duration_ms': round((self.end - self.start) * 1000, 3),
+            'attributes': self.attributes
+        }
+
+
+class JsonlExporter:
+    """Appends finished spans to a JSON Lines file, one span per line.
+
+    The file is opened in append mode and every span is written with a
+    single call, so several worker processes can share one trace file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), default=str) + '\n'
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, 'a', buffering=1, encoding='utf-8')
+            self.file.write(line)
+
+
+class Tracer:
+    """Creates spans and tracks the active span of each thread or asyncio task.
+
+    Stages run on worker threads, so the caller passes the span they belong
+    to as parent; nested spans on the same thread pick up their parent
+    automatically. The active span is a context variable, so asyncio tasks
+    get their own and inherit the span that was active when they were
+    created. Without an exporter every span is a no-op.
+    """
+
+    def __init__(self, exporter=None):
+        self.exporter = exporter
+        self.active = ContextVar('trip_span', default=None)
+
+    @classmethod
+    def from_env(cls):
+        """Create a tracer that writes to TRIP_TRACE_PATH, or a disabled one if it is not set"""
+        path = os.getenv('TRIP_TRACE_PATH', '')
+        return cls(JsonlExporter(path) if path else None)
+
+    def current(self):
+        """Return the active span of this thread or task, or None"""
+        return self.active.get()
+
+    @contextmanager
+    def span(self, name, parent=None, **attributes):
+        """Time the enclosed block as a child of parent, or of this thread's active span"""
+        if self.exporter is None:
+            yield None
+            return
+
+        parent = parent or self.current()
+        span = Span(
+            name,
+            parent.trace_id if parent else uuid.uuid4().hex,
+            parent.span_id if parent else None,
+            attributes
+        )
+        previous = self.current()
+        self.active.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            # A generator closed early is not an error of the traced operation
+            if not isinstance(e, GeneratorExit):
+                span.attributes['error'] = str(e)
+            raise
+        finally:
+            self.active.set(previous)
+            span.end = time.time()
+            self.exporter.export(span)
+
+
+tracer = Tracer.from_env()
+
+
+def load_traces(path):
+    """Read a trace file and return {trace_id: [span dicts]}"""
+    traces = defaultdict(list)
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                span = json.loads(line)
+                traces[span['trace_id']].append(span)
+    return traces
+
+
+def critical_path(spans):
+    """Return the chain of (depth, span) that determined when the trace finished.
+
+    Starting from the root, the path goes to the child that ended last, then
+    to whichever sibling ended last before that child started, and so on,
+    descending into each child the same way.
+    """
+    children = defaultdict(list)
+    roots = []
+    for span in spans:
+        if span['parent_id']:
+            children[span['parent_id']].append(span)
+        else:
+            roots.append(span)
+    if not roots:
+        return []
+
+    def walk(span, depth):
+        path = [(depth, span)]
+        segments = []
+        cutoff = span['end']
+        remaining = sorted(children[span['span_id']], key=lambda child: child['end'])
+        while remaining:
+            candidates = [child for child in remaining if child['end'] <= cutoff + 1e-6]
+            if not candidates:
+                break
+            last = candidates[-1]
+            segments.insert(0, walk(last, depth + 1))
+            cutoff = last['start']
+            remaining = candidates[:-1]
+        for segment in segments:
+            path.extend(segment)
+        return path
+
+    return walk(max(roots, key=lambda span: span['end'] - span['start']), 0)
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def report(path, top=1):
+    """Print per-span p50/p95 and the critical path of the slowest traces in a trace file"""
+    traces = load_traces(path)
+    if not traces:
+        print(f"No spans in {path}")
+        return
+
+    durations = defaultdict(list)
+    on_path = defaultdict(list)
+    totals = []
+    paths = {}
+    for trace_id, spans in traces.items():
+        for span in spans:
+            durations[span['name']].append(span['duration_ms'])
+        paths[trace_id] = critical_path(spans)
+        if paths[trace_id]:
+            totals.append((paths[trace_id][0][1]['duration_ms'], trace_id))
+        for depth, span in paths[trace_id]:
+            on_path[span['name']].append(span['duration_ms'])
+
+    print(f"{len(traces)} traces from {path}\n")
+    print(f"{'span':<28}{'count':>7}{'p50 ms':>11}{'p95 ms':>11}{'critical':>10}")
+    for name in sorted(durations, key=lambda name: -percentile(durations[name], 50)):
+        values = durations[name]
+        share = f"{len(on_path[name]) / len(traces):.0%}"
+        print(f"{name:<28}{len(values):>7}{percentile(values, 50):>11.1f}{percentile(values, 95):>11.1f}{share:>10}")
+
+    for total, trace_id in sorted(totals, reverse=True)[:top]:
+        print(f"\nCritical path of trace {trace_id} ({total:.1f} ms)")
+        for depth, span in paths[trace_id]:
+            label = '  ' * depth + span['name']
+            print(f"  {label:<40}{span['duration_ms']:>11.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize a TravMate trace file')
+    parser.add_argument('path', nargs='?', default=os.getenv('TRIP_TRACE_PATH', 'traces.jsonl'), help='JSONL trace file')
+    parser.add_argument('--top', type=int, default=1, help='number of slowest traces to show the critical path for')
+    args = parser.parse_args()
+    report(args.path, args.top)
+
+
+if __name__ == '__main__':
+    main()
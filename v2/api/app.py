@@ -1,205 +1,94 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import sys
+import hmac
 import os
 from datetime import datetime
 
 # Add the parent directory to the Python path to import trip_agents
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from trip_agents import TripAgents, triptasks
-from crewai import Crew
-import json
+from trip_agents import TripAgents, triptasks, canonicalize_inputs
+from trip_pipeline import TripPipeline
+from trip_cache import PlanCache, cache_key
+from trip_formatter import format_output
+from trip_metrics import CONTENT_TYPE, render_metrics, track_requests
+from trip_tracing import tracer
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for React frontend
+track_requests(app)
 
 class TripPlannerAPI:
     def __init__(self):
         self.agents = TripAgents()
         self.tasks = triptasks()
+        self.pipeline = TripPipeline(self.agents, self.tasks)
+        # Temperature-0 agents for requests that opt into deterministic, cacheable answers
+        self.deterministic_pipeline = TripPipeline(TripAgents(temperature=0), self.tasks)
+        self.plan_cache = PlanCache()
 
     def format_ai_output(self, result):
         """Format CrewAI output for better user display with proper headings and structure"""
         try:
-            # Try to extract the raw content from CrewAI result
-            if hasattr(result, 'raw'):
-                content = str(result.raw)
-            else:
-                content = str(result)
-            
-            # Clean up the content for better display
-            content = content.replace('\\n', '\n')
-            content = content.replace('**', '')
-            
-            # Split into lines for processing
-            lines = content.split('\n')
-            formatted_lines = []
-            
-            for i, line in enumerate(lines):
-                line = line.strip()
-                if not line:
-                    continue
-                    
-                # Check for city/location names (often followed by colon)
-                if ':' in line and not line.startswith(('•', '-', '*', '1.', '2.', '3.', '4.', '5.')) and len(line.split(':')[0]) < 50:
-                    # This looks like a location or section header
-                    location_name = line.split(':')[0].strip()
-                    if location_name and not any(word in location_name.lower() for word in ['hotel', 'day', 'cost', 'price', 'budget']):
-                        formatted_lines.append(f"<h2 class='text-2xl font-bold text-primary-600 mt-6 mb-3'>🌟 {location_name}</h2>")
-                        # Add the description after the colon if it exists
-                        if len(line.split(':', 1)) > 1:
-                            description = line.split(':', 1)[1].strip()
-                            if description:
-                                formatted_lines.append(f"<p class='mb-4'>{description}</p>")
-                    else:
-                        formatted_lines.append(f"<h3 class='text-xl font-semibold text-gray-800 mt-4 mb-2'>{line}</h3>")
-                
-                # Handle hotel names or numbered items
-                elif line.startswith(('Hotel 1:', 'Hotel 2:', 'Hotel 3:', 'Day 1:', 'Day 2:', 'Day 3:', 'Day 4:', 'Day 5:')):
-                    icon = '🏨' if 'Hotel' in line else '📅'
-                    formatted_lines.append(f"<h2 class='text-2xl font-bold text-primary-600 mt-6 mb-3'>{icon} {line}</h2>")
-                
-                # Handle main section headings
-                elif any(section in line.lower() for section in ['accommodation', 'transportation', 'food', 'activities', 'budget breakdown', 'weather', 'best time to visit']):
-                    formatted_lines.append(f"<h3 class='text-xl font-semibold text-gray-800 mt-4 mb-2'>📋 {line}</h3>")
-                
-                # Handle bullet points and lists
-                elif line.startswith('-') or line.startswith('*'):
-                    bullet_content = line[1:].strip()
-                    # Check if this bullet point contains a sub-category
-                    if ':' in bullet_content and len(bullet_content.split(':')[0]) < 30:
-                        category = bullet_content.split(':')[0].strip()
-                        description = bullet_content.split(':', 1)[1].strip()
-                        formatted_lines.append(f"<p class='mb-2'><strong>{category}:</strong> {description}</p>")
-                    else:
-                        formatted_lines.append(f"<p class='mb-2'>• {bullet_content}</p>")
-                
-                # Handle numbered lists
-                elif line.startswith(('1.', '2.', '3.', '4.', '5.', '6.', '7.', '8.', '9.')):
-                    formatted_lines.append(f"<p class='mb-2 font-semibold'>{line}</p>")
-                
-                # Handle price/cost information
-                elif any(word in line.lower() for word in ['price', 'cost', '$', 'budget', 'estimate']):
-                    formatted_lines.append(f"<p class='mb-2 text-green-600 font-semibold'>💰 {line}</p>")
-                
-                # Handle location information
-                elif line.startswith('Location:'):
-                    formatted_lines.append(f"<p class='mb-2 text-blue-600 font-semibold'>📍 {line}</p>")
-                
-                # Handle features/amenities
-                elif any(word in line.lower() for word in ['features:', 'amenities:', 'includes:']):
-                    formatted_lines.append(f"<p class='mb-2 text-purple-600 font-semibold'>✨ {line}</p>")
-                
-                # Regular text
-                else:
-                    formatted_lines.append(f"<p class='mb-2'>{line}</p>")
-            
-            return '\n'.join(formatted_lines) if formatted_lines else content
-            
+            return format_output(result)
         except Exception as e:
             return str(result)
 
+    def format_section(self, section, result):
+        """Format one section's output, traced as its own span"""
+        with tracer.span(f'{section}.format'):
+            return self.format_ai_output(result)
+
     def plan_trip(self, data):
         """Plan a trip using the AI agents"""
         try:
-            # Prepare inputs for the agents
-            inputs = {
-                "travel_type": data.get('travelType', 'leisure'),
-                "travel_duration": self.calculate_duration(data.get('startDate'), data.get('endDate')),
-                "travel_budget": data.get('budget', 'mid-range'),
-                "travel_interests": data.get('interests', ''),
-                "travel_dates": data.get('startDate', ''),
-                "destination_country": data.get('destination', 'any country')
-            }
+            with tracer.span('plan_trip') as span:
+                # Prepare canonical inputs for the agents so equivalent preferences share cache entries
+                inputs = canonicalize_inputs({
+                    "travel_type": data.get('travelType', 'leisure'),
+                    "travel_duration": self.calculate_duration(data.get('startDate'), data.get('endDate')),
+                    "travel_budget": data.get('budget', 'mid-range'),
+                    "travel_interests": data.get('interests', ''),
+                    "travel_dates": data.get('startDate', ''),
+                    "destination_country": data.get('destination', 'any country')
+                }, os.getenv('TRIP_DATE_BUCKET', 'month'))
+                deterministic = data.get('deterministic') is True
 
-            # Step 1: City Selection
-            city_selector_agent = self.agents.city_selector()
-            city_task = self.tasks.city_selector_task(inputs, city_selector_agent)
-            
-            city_crew = Crew(
-                agents=[city_selector_agent],
-                tasks=[city_task],
-                verbose=False
-            )
-            
-            city_result = city_crew.kickoff()
-            city_text = str(city_result.raw) if hasattr(city_result, 'raw') else str(city_result)
-            
-            # Step 2: Hotel Selection (based on recommended cities)
-            hotel_inputs = inputs.copy()
-            hotel_inputs['recommended_cities'] = city_text
-            
-            hotel_selector_agent = self.agents.hotel_selector()
-            hotel_task = self.tasks.hotel_selector_task(hotel_inputs, hotel_selector_agent)
-            
-            hotel_crew = Crew(
-                agents=[hotel_selector_agent],
-                tasks=[hotel_task],
-                verbose=False
-            )
-            
-            hotel_result = hotel_crew.kickoff()
-            
-            # Step 3: Budget Planning
-            budget_inputs = inputs.copy()
-            budget_inputs['recommended_cities'] = city_text
-            budget_inputs['recommended_hotels'] = str(hotel_result.raw) if hasattr(hotel_result, 'raw') else str(hotel_result)
-            
-            budget_agent = self.agents.budget_manager_agent()
-            budget_task = self.tasks.budget_manager_task(budget_inputs, budget_agent)
-            
-            budget_crew = Crew(
-                agents=[budget_agent],
-                tasks=[budget_task],
-                verbose=False
-            )
-            
-            budget_result = budget_crew.kickoff()
-            
-            # Step 4: Itinerary Planning
-            itinerary_inputs = inputs.copy()
-            itinerary_inputs['recommended_cities'] = city_text
-            
-            itinerary_agent = self.agents.itinerary_planner()
-            itinerary_task = self.tasks.itinerary_planner_task(itinerary_inputs, itinerary_agent)
-            
-            itinerary_crew = Crew(
-                agents=[itinerary_agent],
-                tasks=[itinerary_task],
-                verbose=False
-            )
-            
-            itinerary_result = itinerary_crew.kickoff()
-            
-            # Step 5: Local Guide Information
-            guide_inputs = inputs.copy()
-            guide_inputs['recommended_cities'] = city_text
-            
-            local_guide_agent = self.agents.local_guide()
-            city_research_task = self.tasks.city_researcher_task(guide_inputs, local_guide_agent)
-            
-            guide_crew = Crew(
-                agents=[local_guide_agent],
-                tasks=[city_research_task],
-                verbose=False
-            )
-            
-            guide_result = guide_crew.kickoff()
-            
-            # Format all results
-            formatted_results = {
-                'cities': self.format_ai_output(city_result),
-                'hotels': self.format_ai_output(hotel_result),
-                'budget': self.format_ai_output(budget_result),
-                'itinerary': self.format_ai_output(itinerary_result),
-                'local_guide': self.format_ai_output(guide_result),
-                'combined_itinerary': self.create_combined_itinerary(
-                    city_result, hotel_result, budget_result, itinerary_result, guide_result
-                )
-            }
-            
-            return formatted_results
+                # Serve repeat queries straight from the plan cache
+                key = cache_key(dict(inputs, deterministic=deterministic))
+                cached_plan = self.plan_cache.get(key)
+                if span:
+                    span.attributes['cached'] = cached_plan is not None
+                if cached_plan is not None:
+                    return cached_plan
+
+                # Run the stages as a dependency graph: hotels, itinerary and local guide
+                # start together once the cities are known, budget waits for the hotels
+                pipeline = self.deterministic_pipeline if deterministic else self.pipeline
+                results = pipeline.run(inputs)
+                city_result = results['cities']
+                hotel_result = results['hotels']
+                budget_result = results['budget']
+                itinerary_result = results['itinerary']
+                guide_result = results['local_guide']
+            
+                # Format each section once; the combined itinerary reuses the same HTML
+                formatted_results = {
+                    'cities': self.format_section('cities', city_result),
+                    'hotels': self.format_section('hotels', hotel_result),
+                    'budget': self.format_section('budget', budget_result),
+                    'itinerary': self.format_section('itinerary', itinerary_result),
+                    'local_guide': self.format_section('local_guide', guide_result)
+                }
+                with tracer.span('combine'):
+                    formatted_results['combined_itinerary'] = self.create_combined_itinerary(
+                        formatted_results['cities'], formatted_results['hotels'], formatted_results['budget'],
+                        formatted_results['itinerary'], formatted_results['local_guide']
+                    )
+
+                self.plan_cache.set(key, formatted_results)
+                return formatted_results
             
         except Exception as e:
             raise Exception(f"Error planning trip: {str(e)}")
@@ -232,33 +121,33 @@ class TripPlannerAPI:
         except:
             return "1 week"
 
-    def create_combined_itinerary(self, city_result, hotel_result, budget_result, itinerary_result, guide_result):
-        """Create a comprehensive itinerary combining all results"""
+    def create_combined_itinerary(self, city_html, hotel_html, budget_html, itinerary_html, guide_html):
+        """Create a comprehensive itinerary combining the already formatted sections"""
         combined = f"""
         <div class="space-y-6">
             <div class="bg-blue-50 p-6 rounded-xl">
                 <h2 class="text-2xl font-bold text-blue-800 mb-4">🌟 Recommended Destinations</h2>
-                {self.format_ai_output(city_result)}
+                {city_html}
             </div>
             
             <div class="bg-green-50 p-6 rounded-xl">
                 <h2 class="text-2xl font-bold text-green-800 mb-4">🏨 Accommodation Options</h2>
-                {self.format_ai_output(hotel_result)}
+                {hotel_html}
             </div>
             
             <div class="bg-yellow-50 p-6 rounded-xl">
                 <h2 class="text-2xl font-bold text-yellow-800 mb-4">💰 Budget Breakdown</h2>
-                {self.format_ai_output(budget_result)}
+                {budget_html}
             </div>
             
             <div class="bg-purple-50 p-6 rounded-xl">
                 <h2 class="text-2xl font-bold text-purple-800 mb-4">📅 Daily Itinerary</h2>
-                {self.format_ai_output(itinerary_result)}
+                {itinerary_html}
             </div>
             
             <div class="bg-red-50 p-6 rounded-xl">
                 <h2 class="text-2xl font-bold text-red-800 mb-4">🗺️ Local Insights & Tips</h2>
-                {self.format_ai_output(guide_result)}
+                {guide_html}
             </div>
         </div>
         """
@@ -280,6 +169,9 @@ def plan_trip():
         for field in required_fields:
             if field not in data:
                 return jsonify({'error': f'Missing required field: {field}'}), 400
+        # bool('false') is True, so only a JSON boolean selects the deterministic pipeline
+        if data.get('deterministic') is not None and not isinstance(data['deterministic'], bool):
+            return jsonify({'error': 'deterministic must be true or false'}), 400
         
         # Plan the trip
         results = trip_planner.plan_trip(data)
@@ -296,6 +188,27 @@ def plan_trip():
             'error': str(e)
         }), 500
 
+def is_admin_request():
+    """Check the admin token header against TRIP_ADMIN_TOKEN; without a configured token nobody is admin"""
+    admin_token = os.getenv('TRIP_ADMIN_TOKEN')
+    if not admin_token:
+        return False
+    return hmac.compare_digest(request.headers.get('X-Admin-Token', ''), admin_token)
+
+@app.route('/api/cache', methods=['GET'])
+def plan_cache_stats():
+    return jsonify(trip_planner.plan_cache.stats())
+
+@app.route('/api/cache', methods=['DELETE'])
+def purge_plan_cache():
+    if not is_admin_request():
+        return jsonify({'error': 'Admin token required'}), 403
+    return jsonify({'removed': trip_planner.plan_cache.clear()})
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(render_metrics(), content_type=CONTENT_TYPE)
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({'status': 'healthy', 'message': 'TravMate API is running'})
@@ -0,0 +1,237 @@
+NOT_LOCATION_PREFIXES = ('•', '-', '*', '1.', '2.', '3.', '4.', '5.')
+NUMBERED_PREFIXES = ('1.', '2.', '3.', '4.', '5.', '6.', '7.', '8.', '9.')
+
+# (prefix, suffix) around the text of each kind of line; categories are
+# (prefix, separator, suffix) around the category name and its description
+HTML_TAGS = {
+    'location': ("<h2 class='text-2xl font-bold text-primary-600 mt-6 mb-3'>🌟 ", "</h2>"),
+    'description': ("<p class='mb-4'>", "</p>"),
+    'heading': ("<h3 class='text-xl font-semibold text-gray-800 mt-4 mb-2'>", "</h3>"),
+    'section': ("<h3 class='text-xl font-semibold text-gray-800 mt-4 mb-2'>📋 ", "</h3>"),
+    'category': ("<p class='mb-2'><strong>", ":</strong> ", "</p>"),
+    'bullet': ("<p class='mb-2'>• ", "</p>"),
+    'numbered': ("<p class='mb-2 font-semibold'>", "</p>"),
+    'price': ("<p class='mb-2 text-green-600 font-semibold'>💰 ", "</p>"),
+    'feature': ("<p class='mb-2 text-purple-600 font-semibold'>✨ ", "</p>"),
+    'text': ("<p class='mb-2'>", "</p>"),
+}
+
+MARKDOWN_TAGS = {
+    'location': ("## 🌟 ", ""),
+    'description': ("", ""),
+    'heading': ("### ", ""),
+    'section': ("### 📋 ", ""),
+    'category': ("**", ":** ", ""),
+    'bullet': ("• ", ""),
+    'numbered': ("**", "**"),
+    'price': ("💰 **", "**"),
+    'feature': ("✨ **", "**"),
+    'text': ("", ""),
+}
+
+
+def result_content(result):
+    """Return the raw text of a CrewAI result"""
+    if hasattr(result, 'raw'):
+        return str(result.raw)
+    return str(result)
+
+
+def clean_content(content):
+    """Turn escaped newlines into real ones and drop Markdown bold markers"""
+    return content.replace('\\n', '\n').replace('**', '')
+
+
+def classify_line(line):
+    """Classify one line of agent output in a single pass.
+
+    Returns (kind, text, extra), or None for a blank line. extra holds the
+    description of a location or a bulleted category, and is '' otherwise.
+    The line is lowercased once and split on its first colon once; the
+    keyword checks are plain substring tests, which CPython runs faster
+    than a compiled alternation.
+    """
+    line = line.strip()
+    if not line:
+        return None
+
+    lower = line.lower()
+    colon = line.find(':')
+
+    # Check for city/location names (often followed by colon)
+    if 0 <= colon < 50 and not line.startswith(NOT_LOCATION_PREFIXES):
+        location_name = line[:colon].strip()
+        name = location_name.lower()
+        if location_name and not ('hotel' in name or 'day' in name or 'cost' in name or 'price' in name or 'budget' in name):
+            return 'location', location_name, line[colon + 1:].strip()
+        return 'heading', line, ''
+
+    # Handle main section headings
+    if ('accommodation' in lower or 'transportation' in lower or 'food' in lower or 'activities' in lower
+            or 'budget breakdown' in lower or 'weather' in lower or 'best time to visit' in lower):
+        return 'section', line, ''
+
+    # Handle bullet points and lists
+    if line[0] in '-*':
+        bullet_content = line[1:].strip()
+        # Check if this bullet point contains a sub-category
+        category_end = bullet_content.find(':')
+        if 0 <= category_end < 30:
+            return 'category', bullet_content[:category_end].strip(), bullet_content[category_end + 1:].strip()
+        return 'bullet', bullet_content, ''
+
+    # Handle numbered lists
+    if line.startswith(NUMBERED_PREFIXES):
+        return 'numbered', line, ''
+
+    # Handle price/cost information
+    if 'price' in lower or 'cost' in lower or '$' in lower or 'budget' in lower or 'estimate' in lower:
+        return 'price', line, ''
+
+    # Handle features/amenities
+    if 'features:' in lower or 'amenities:' in lower or 'includes:' in lower:
+        return 'feature', line, ''
+
+    # Regular text
+    return 'text', line, ''
+
+
+def parse_content(content):
+    """Parse cleaned content into a list of (kind, text, extra) blocks"""
+    blocks = []
+    append = blocks.append
+    for line in content.split('\n'):
+        block = classify_line(line)
+        if block is not None:
+            append(block)
+    return blocks
+
+
+class ParsedOutput:
+    """Agent output parsed once into blocks, kept together with its raw text.
+
+    Stages hand these on instead of raw CrewAI results, so every renderer
+    and every later use of the same section shares a single parse.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self._content = None
+        self._blocks = None
+
+    @property
+    def content(self):
+        """The raw text with escaped newlines and bold markers cleaned up"""
+        if self._content is None:
+            self._content = clean_content(self.raw)
+        return self._content
+
+    @property
+    def blocks(self):
+        """The (kind, text, extra) blocks, parsed on first use"""
+        if self._blocks is None:
+            self._blocks = parse_content(self.content)
+        return self._blocks
+
+    def __str__(self):
+        return self.raw
+
+
+def parse_output(result):
+    """Return the parsed form of a CrewAI result, reusing it if it was already parsed"""
+    if isinstance(result, ParsedOutput):
+        return result
+    return ParsedOutput(result_content(result))
+
+
+def render_blocks(blocks, tags):
+    """Render blocks with a renderer's tags, returning the formatted lines"""
+    formatted_lines = []
+    append = formatted_lines.append
+    for kind, text, extra in blocks:
+        if kind == 'category':
+            prefix, separator, suffix = tags['category']
+            append(prefix + text + separator + extra + suffix)
+            continue
+
+        prefix, suffix = tags[kind]
+        append(prefix + text + suffix)
+        if kind == 'location' and extra:
+            prefix, suffix = tags['description']
+            append(prefix + extra + suffix)
+    return formatted_lines
+
+
+def render_html(parsed):
+    """Render parsed output as HTML with proper headings and structure"""
+    formatted_lines = render_blocks(parsed.blocks, HTML_TAGS)
+    return '\n'.join(formatted_lines) if formatted_lines else parsed.content
+
+
+def render_markdown(parsed):
+    """Render parsed output as Markdown with proper headings and structure"""
+    formatted_lines = render_blocks(parsed.blocks, MARKDOWN_TAGS)
+
+    # Add blank lines around headings
+    result_text = []
+    for i, line in enumerate(formatted_lines):
+        if line.startswith('##'):
+            if i > 0:
+                result_text.append('')
+            result_text.append(line)
+            result_text.append('')
+        else:
+            result_text.append(line)
+
+    return '\n'.join(result_text) if result_text else parsed.content
+
+
+def format_line(line):
+    """Format one line of agent output as HTML, returning the HTML lines it produces"""
+    return render_blocks(parse_content(line), HTML_TAGS)
+
+
+def format_output(result):
+    """Format CrewAI output as HTML with proper headings and structure"""
+    return render_html(parse_output(result))
+
+
+def format_markdown(result):
+    """Format CrewAI output as Markdown with proper headings and structure"""
+    return render_markdown(parse_output(result))
+
+
+class IncrementalFormatter:
+    """Formats agent output chunk by chunk as it streams in.
+
+    Every line is formatted on its own, so a line can be emitted as soon as
+    its newline arrives. Only the unfinished last line is kept and re-scanned
+    when the next chunk comes in.
+    """
+
+    def __init__(self, format_line=format_line):
+        self.format_line = format_line
+        self.pending = ''
+
+    def feed(self, chunk):
+        """Add a chunk of raw output and return the formatted lines it completes"""
+        self.pending += chunk
+
+        # Agents sometimes emit escaped newlines; hold back a trailing backslash
+        # until we know whether it starts one
+        held = ''
+        if self.pending.endswith('\\'):
+            self.pending, held = self.pending[:-1], '\\'
+
+        lines = self.pending.replace('\\n', '\n').split('\n')
+        self.pending = lines.pop() + held
+
+        formatted_lines = []
+        for line in lines:
+            formatted_lines.extend(self.format_line(line.replace('**', '')))
+        return formatted_lines
+
+    def close(self):
+        """Return the formatted lines for whatever is left once the output is complete"""
+        line, self.pending = self.pending, ''
+        return self.format_line(line.replace('**', ''))
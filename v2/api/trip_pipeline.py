@@ -0,0 +1,674 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from crewai import Crew
+from langchain_core.agents import AgentAction, AgentFinish
+from langchain_core.exceptions import OutputParserException
+from trip_agents import AgentRegistry, StageCancelled, token_stream, token_usage
+from trip_cache import CompletionCache, KnowledgeCache, SingleFlight, completion_key, model_settings, place_key
+from trip_extract import compact_context, extract_entries, is_entry_label
+from trip_formatter import ParsedOutput
+from trip_hedge import hedger
+from trip_metrics import STAGE_SECONDS, STAGE_ERRORS, STAGE_TIMEOUTS, PROMPT_TOKENS, COMPLETION_TOKENS
+from trip_tracing import tracer
+import asyncio
+import os
+import queue
+import time
+
+
+# Each stage: (section name, stages it depends on, TripAgents method, triptasks method)
+# Only hotels, budget, itinerary and local_guide need the city result, and only
+# budget needs the hotels, so hotels/itinerary/local_guide can run side by side.
+STAGES = [
+    ('cities', [], 'city_selector', 'city_selector_task'),
+    ('hotels', ['cities'], 'hotel_selector', 'hotel_selector_task'),
+    ('budget', ['cities', 'hotels'], 'budget_manager_agent', 'budget_manager_task'),
+    ('itinerary', ['cities'], 'itinerary_planner', 'itinerary_planner_task'),
+    ('local_guide', ['cities'], 'local_guide', 'city_researcher_task'),
+]
+
+# Cities the local guide gathers reusable facts for; the city task asks for 3
+MAX_GUIDE_CITIES = 3
+
+# Relative time each stage takes, used to split a plan's deadline between them;
+# the itinerary writes the longest answer and the guide makes two calls
+STAGE_WEIGHTS = {'cities': 1, 'hotels': 1, 'budget': 1, 'itinerary': 2, 'local_guide': 2}
+
+
+def downstream_weight(name):
+    """Weight of the longest chain of stages that waits on a stage"""
+    return max((STAGE_WEIGHTS.get(stage[0], 1) + downstream_weight(stage[0]) for stage in STAGES if name in stage[1]), default=0)
+
+
+class Deadline:
+    """The time by which a plan has to be finished, split across its stages.
+
+    A stage gets the share of the time left that its weight has in the
+    longest chain of stages starting with it, so an early stage cannot use
+    up the time of the stages waiting on it. Stages nothing waits on get
+    all the time left.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires - time.monotonic())
+
+    def stage_expires(self, name):
+        """Return the time.monotonic() value by which a stage starting now has to finish"""
+        weight = STAGE_WEIGHTS.get(name, 1)
+        return time.monotonic() + self.remaining() * weight / (weight + downstream_weight(name))
+
+
+def model_name(llm):
+    """Name of the model behind an agent's LLM client"""
+    return str(getattr(llm, 'model_name', None) or getattr(llm, 'model', ''))
+
+
+class FinalAnswerStream:
+    """Passes on only the tokens an agent writes after its 'Final Answer:' marker.
+
+    CrewAI agents think out loud before answering; that reasoning is part of
+    the token stream but never part of the result shown to users.
+    """
+
+    MARKER = 'Final Answer:'
+
+    def __init__(self, on_token):
+        self.on_token = on_token
+        self.buffer = ''
+        self.answering = False
+
+    def __call__(self, token):
+        if self.answering:
+            self.on_token(token)
+            return
+
+        # Only the tail can complete a marker that was not there before
+        start = max(0, len(self.buffer) - len(self.MARKER))
+        self.buffer += token
+        index = self.buffer.find(self.MARKER, start)
+        if index >= 0:
+            self.answering = True
+            answer = self.buffer[index + len(self.MARKER):].lstrip(' ')
+            self.buffer = ''
+            if answer:
+                self.on_token(answer)
+
+
+def result_text(result):
+    """Return the raw text of a CrewAI result"""
+    return str(result.raw) if hasattr(result, 'raw') else str(result)
+
+
+# What an agent executor answers when max_iter or max_execution_time runs out before a Final Answer
+STOPPED_ANSWERS = ('Agent stopped due to iteration limit or time limit.', 'Agent stopped due to max iterations.')
+
+
+class IncompleteAnswer(Exception):
+    """Raised when an agent stopped without writing a Final Answer"""
+
+
+def final_answer(text):
+    """Return an agent's answer, raising IncompleteAnswer if its executor stopped it first.
+
+    A stopped answer is never shown as a section or cached; the stage
+    fails instead.
+    """
+    if text.strip() in STOPPED_ANSWERS:
+        raise IncompleteAnswer(f"The agent stopped without a final answer: {text.strip()}")
+    return text
+
+
+async def aexecute_task(agent, task):
+    """Async counterpart of crewai's Agent.execute_task for the trip agents, which have no tools.
+
+    CrewAgentExecutor only overrides LangChain's synchronous agent loop, so
+    its async loop would skip crewai's handling. This follows
+    CrewAgentExecutor._call step by step instead: errors and unparsable
+    answers go back to the model as observations, the answer is forced at
+    force_answer_max_iterations, and the executor's stopped response is
+    returned once max_iter or max_execution_time runs out. Only the model
+    calls are awaited.
+    """
+    prompt = agent._use_trained_data(task_prompt=task.prompt())
+    agent.create_agent_executor(tools=[])
+    executor = agent.agent_executor
+    executor.task = task
+    inputs = {'input': prompt, 'tool_names': '', 'tools': ''}
+
+    steps = []
+    executor.iterations = 0
+    started = time.time()
+    while executor._should_continue(executor.iterations, time.time() - started):
+        if executor._should_force_answer():
+            error = executor._i18n.errors('force_final_answer')
+            executor.have_forced_answer = True
+            steps.append((AgentAction('_Exception', error, error), error))
+        else:
+            try:
+                output = await executor.agent.aplan(executor._prepare_intermediate_steps(steps), **inputs)
+            except OutputParserException as e:
+                observation = f"\n{e.observation}" if e.send_to_llm else ''
+                steps.append((AgentAction('_Exception', observation, ''), observation))
+            except StageCancelled:
+                raise
+            except Exception as e:
+                steps.append((AgentAction('_Exception', str(e), str(e)), str(e)))
+            else:
+                if isinstance(output, AgentFinish):
+                    return output.return_values['output']
+                # Without tools, every action is answered as a call to a tool that does not exist
+                for action in [output] if isinstance(output, AgentAction) else output:
+                    steps.append((action, executor._i18n.errors('wrong_tool_name').format(tool=action.tool, tools='')))
+        executor.iterations += 1
+
+    stopped = executor.agent.return_stopped_response(executor.early_stopping_method, steps, **inputs)
+    return stopped.return_values['output']
+
+
+def city_names(result):
+    """Return the distinct city names of a cities result that the local guide gathers facts for"""
+    names = {}
+    for name, facts in extract_entries(result):
+        # A bare label such as "Option 1" would key facts that belong to no city
+        if not is_entry_label(name):
+            names.setdefault(place_key(name), name)
+    return list(names.values())[:MAX_GUIDE_CITIES]
+
+
+class TripPipeline:
+    """Runs the trip planning stages as a dependency graph instead of one after another"""
+
+    def __init__(self, agents, tasks, max_workers=None, completion_cache=None, compact_upstream=None, knowledge=None):
+        self.agents = agents
+        self.registry = AgentRegistry(agents)
+        self.tasks = tasks
+        self.max_workers = max_workers or int(os.getenv('TRIP_STAGE_WORKERS', '3'))
+        self.completion_cache = completion_cache or CompletionCache.from_env()
+        self.knowledge = knowledge or KnowledgeCache.from_env()
+        self.facts_flight = SingleFlight()
+        # City facts being generated on the event loop, by (place, period)
+        self.facts_tasks = {}
+        if compact_upstream is None:
+            compact_upstream = os.getenv('TRIP_COMPACT_CONTEXT', 'true').lower() != 'false'
+        self.compact_upstream = compact_upstream
+
+    def stage_inputs(self, inputs, results):
+        """Add the outputs of finished upstream stages to the base inputs.
+
+        Unless compact_upstream is off, downstream prompts get a short list of
+        city and hotel names with their key facts instead of the full text.
+        """
+        upstream = compact_context if self.compact_upstream else result_text
+        stage_inputs = inputs.copy()
+        if 'cities' in results:
+            stage_inputs['recommended_cities'] = upstream(results['cities'])
+            stage_inputs['city_names'] = city_names(results['cities'])
+        if 'hotels' in results:
+            stage_inputs['recommended_hotels'] = upstream(results['hotels'])
+        return stage_inputs
+
+    def run_stage(self, stage, inputs, on_token=None, parent_span=None, flight=None, expires=None):
+        """Run a stage, passing every token its agent generates to on_token.
+
+        The stage is traced as a child of parent_span, since it runs on a
+        worker thread that does not know which request it belongs to. With
+        expires set, its LLM calls raise StageCancelled once that
+        time.monotonic() value has passed.
+        """
+        name, depends_on, agent_method, task_method = stage
+        token_stream.set_sink(FinalAnswerStream(on_token) if on_token else None)
+        token_stream.set_deadline(expires)
+        try:
+            with tracer.span(name, parent=parent_span):
+                if name == 'local_guide' and self.knowledge and inputs.get('city_names'):
+                    return self.kickoff_guide(inputs, flight)
+                return self.kickoff_stage(name, agent_method, task_method, inputs, flight)
+        except StageCancelled:
+            raise
+        except Exception:
+            STAGE_ERRORS.inc(stage=name)
+            raise
+        finally:
+            token_stream.set_sink(None)
+            token_stream.set_deadline(None)
+
+    def kickoff_stage(self, name, agent_method, task_method, inputs, flight=None):
+        """Build the agent and task for a stage and run it in its own crew.
+
+        Agents are borrowed from the registry instead of built per request.
+        Identical agent/task/model combinations are answered from the
+        completion cache, so a stage is reused even when other stages differ.
+        With a SingleFlight, identical stages of other plans sharing it run
+        only once. The result is returned as ParsedOutput so it is only
+        parsed once. Kickoff latency and token usage are recorded in
+        trip_metrics.
+        """
+        @contextmanager
+        def duplicate():
+            # A hedged kickoff needs an agent and task of its own
+            with self.registry.agent(agent_method) as agent:
+                yield agent, getattr(self.tasks, task_method)(inputs, agent)
+
+        def hedged(span):
+            output, was_hedged = self.kickoff_hedged(name, duplicate)
+            if span:
+                span.attributes['hedged'] = was_hedged
+            return output
+
+        def complete_once(key, labels, run):
+            if flight is None:
+                return self.complete(name, key, labels, run)
+            return flight.do(key, lambda: self.complete(name, key, labels, run))[0]
+
+        with self.registry.agent(agent_method) as agent:
+            with tracer.span(f'{name}.task'):
+                task = getattr(self.tasks, task_method)(inputs, agent)
+
+            key = completion_key(agent, task)
+            labels = {'role': agent.role, 'model': model_name(agent.llm)}
+            if not hedger.enabled(name):
+                return complete_once(key, labels, lambda span: self.kickoff(agent, task))
+
+        # A hedged kickoff borrows agents of its own, so this one goes back to the pool first
+        return complete_once(key, labels, hedged)
+
+    def kickoff_guide(self, inputs, flight=None):
+        """Write the local guide from per-city facts plus one personalized call.
+
+        Facts for each recommended city and travel month come from the
+        knowledge cache; missing ones are generated side by side, then
+        stored for every later plan. Only the short personalization step
+        runs for every request. Facts are generated without the stage's
+        deadline, since they are kept for later plans even if this one
+        gives up on them.
+        """
+        period = inputs.get('travel_dates') or 'any time'
+        parent_span = tracer.current()
+        cities = inputs['city_names']
+
+        def city_facts(city):
+            return f"Facts about {city}:\n{self.city_facts(city, period, flight, parent_span)}"
+
+        with ThreadPoolExecutor(max_workers=len(cities)) as executor:
+            facts = list(executor.map(city_facts, cities))
+
+        guide_inputs = dict(inputs, city_facts='\n\n'.join(facts))
+        return self.kickoff_stage('local_guide', 'local_guide', 'personalized_guide_task', guide_inputs, flight)
+
+    def city_facts(self, city, period, flight=None, parent_span=None):
+        """Return the reusable facts about a city for a travel period, generating them if needed.
+
+        The facts task leaves out everything about the traveller, so its
+        answer is stored in the knowledge cache for every later plan. Plans
+        running at the same time share one generation per city.
+        """
+        model = self.facts_model()
+        facts = self.knowledge.get(city, period, model)
+        if facts is not None:
+            return facts
+
+        def generate():
+            with tracer.span('local_guide.facts', parent=parent_span, city=city):
+                facts = self.kickoff_stage(
+                    'local_guide.facts', 'local_guide', 'city_facts_task',
+                    {'city': city, 'travel_dates': period}, flight
+                ).raw
+            self.knowledge.set(city, period, facts, model)
+            return facts
+
+        return self.facts_flight.do((place_key(city), period), generate)[0]
+
+    def facts_model(self):
+        """Model settings of the local guide agent, which city facts are stored under"""
+        return '|'.join(model_settings(self.agents.llm_for('local_guide')))
+
+    def complete(self, name, key, labels, run):
+        """Return the completion for a stage's task from the cache, or from run(span) on a miss.
+
+        labels are the role and model recorded on the stage's llm span.
+        """
+        if self.completion_cache:
+            with tracer.span(f'{name}.cache') as span:
+                cached = self.completion_cache.get(key)
+                if span:
+                    span.attributes['hit'] = cached is not None
+            if cached is not None:
+                return ParsedOutput(cached)
+
+        with STAGE_SECONDS.time(stage=name), tracer.span(f'{name}.llm', **labels) as span:
+            output = run(span)
+
+        if self.completion_cache:
+            self.completion_cache.set(key, output.raw)
+        return output
+
+    def kickoff(self, agent, task):
+        """Run an agent's task in its own crew, recording the tokens it used.
+
+        CrewAI turns the StageCancelled of an LLM call into an observation
+        and keeps starting calls until max_iter, then retries the task, so
+        the agent's step_callback ends the loop once the stage's deadline
+        has passed and uses up its retries.
+        """
+        def stop_at_deadline(step_output):
+            try:
+                token_stream.check_deadline()
+            except StageCancelled:
+                agent._times_executed = agent.max_retry_limit
+                raise
+
+        # Pooled agents keep CrewAI's retry count across crews, so each task starts afresh
+        agent._times_executed = 0
+        agent.step_callback = stop_at_deadline
+        crew = Crew(
+            agents=[agent],
+            tasks=[task],
+            verbose=False
+        )
+
+        token_usage.start()
+        try:
+            return ParsedOutput(final_answer(result_text(crew.kickoff())))
+        finally:
+            prompt_tokens, completion_tokens = token_usage.stop()
+            PROMPT_TOKENS.inc(prompt_tokens, role=agent.role)
+            COMPLETION_TOKENS.inc(completion_tokens, role=agent.role)
+
+    def kickoff_hedged(self, name, duplicate):
+        """Run a stage through the hedger and return (output, hedged).
+
+        Both kickoffs run on hedger threads with agents of their own, so a
+        losing kickoff can finish after the stage has moved on. Only the
+        first one streams its tokens to the stage's sink.
+        """
+        sink = token_stream.sink()
+        expires = token_stream.deadline()
+
+        def attempt(streaming):
+            def run():
+                token_stream.set_sink(sink if streaming else None)
+                token_stream.set_deadline(expires)
+                try:
+                    with duplicate() as (agent, task):
+                        return self.kickoff(agent, task)
+                finally:
+                    token_stream.set_sink(None)
+                    token_stream.set_deadline(None)
+            return run
+
+        return hedger.run(name, attempt(True), attempt(False))
+
+    def iter_events(self, inputs, stream_tokens=False, flight=None, deadline=None):
+        """Yield ('token', section, text) and ('stage', section, result) events as they happen.
+
+        Stages are started as soon as everything they depend on has finished.
+        Events are yielded on the calling thread, so callers can safely
+        update UI state or write to a response stream between them. Token
+        events are only produced when stream_tokens is set. Stages are run
+        through flight when one is given.
+
+        With a Deadline, the plan is best effort: a stage still running when
+        its share of the deadline runs out is cancelled, a failed stage no
+        longer stops the others, and every stage that does not finish gets a
+        ('status', section, 'timeout' | 'failed' | 'skipped') event, skipped
+        meaning a stage it depends on did not finish.
+        """
+        results = {}
+        pending = list(STAGES)
+        running = {}
+        expires = {}
+        events = queue.Queue()
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        parent_span = tracer.current()
+
+        try:
+            while pending or running:
+                # Start every stage whose dependencies are satisfied
+                for stage in [s for s in pending if all(dep in results for dep in s[1])]:
+                    pending.remove(stage)
+                    name = stage[0]
+                    on_token = (lambda token, name=name: events.put(('token', name, token))) if stream_tokens else None
+                    expires[name] = deadline.stage_expires(name) if deadline else None
+                    future = executor.submit(self.run_stage, stage, self.stage_inputs(inputs, results), on_token, parent_span, flight, expires[name])
+                    future.add_done_callback(lambda future, name=name: events.put(('stage', name, future)))
+                    running[name] = future
+
+                timeout = None
+                if deadline:
+                    timeout = max(0.0, min(expires[name] for name in running) - time.monotonic())
+                try:
+                    kind, name, payload = events.get(timeout=timeout)
+                except queue.Empty:
+                    # The stage threads cancel themselves; stop waiting for them now
+                    now = time.monotonic()
+                    for name in [name for name in running if expires[name] <= now]:
+                        running.pop(name).cancel()
+                        STAGE_TIMEOUTS.inc(stage=name)
+                        yield 'status', name, 'timeout'
+                        yield from self.skip_dependents(name, pending)
+                    continue
+
+                if name not in running:
+                    # Late tokens or the result of a stage that was given up on
+                    continue
+                if kind == 'token':
+                    yield kind, name, payload
+                    continue
+
+                del running[name]
+                if deadline and payload.exception() is not None:
+                    yield 'status', name, 'timeout' if isinstance(payload.exception(), StageCancelled) else 'failed'
+                    yield from self.skip_dependents(name, pending)
+                    continue
+                results[name] = payload.result()
+                yield kind, name, results[name]
+        finally:
+            for future in running.values():
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def skip_dependents(self, name, pending):
+        """Drop the pending stages that need a stage that did not finish, yielding a skipped status for each"""
+        for stage in [s for s in pending if name in s[1]]:
+            if stage in pending:
+                pending.remove(stage)
+                yield 'status', stage[0], 'skipped'
+                yield from self.skip_dependents(stage[0], pending)
+
+    def iter_stages(self, inputs, flight=None, deadline=None):
+        """Yield (section, result) pairs in the order the stages finish"""
+        for kind, name, result in self.iter_events(inputs, flight=flight, deadline=deadline):
+            if kind == 'stage':
+                yield name, result
+
+    def run(self, inputs, on_stage_complete=None, flight=None, deadline=None):
+        """Run all stages and return a dict of section name to CrewAI result.
+
+        With a deadline, only the sections that finished in time are returned.
+        """
+        results = {}
+        for name, result in self.iter_stages(inputs, flight, deadline):
+            results[name] = result
+            if on_stage_complete:
+                on_stage_complete(name, result)
+        return results
+
+    async def arun(self, inputs, deadline=None):
+        """Run all stages as asyncio tasks and return (results, status).
+
+        The event-loop counterpart of iter_events, used by the ASGI app:
+        every LLM call is awaited instead of holding a worker thread, so one
+        thread can drive hundreds of plans. Stages start as soon as their
+        dependencies finish. With a Deadline, a stage that runs out of its
+        share is cancelled and the stages needing it are skipped; status
+        maps each stage that did not finish to 'timeout', 'failed' or
+        'skipped'. Without one, a failed stage raises.
+        """
+        results = {}
+        status = {}
+        pending = list(STAGES)
+        running = {}
+        parent_span = tracer.current()
+
+        def stop(name, reason):
+            status[name] = reason
+            for kind, skipped, value in self.skip_dependents(name, pending):
+                status[skipped] = value
+
+        try:
+            while pending or running:
+                for stage in [s for s in pending if all(dep in results for dep in s[1])]:
+                    pending.remove(stage)
+                    name = stage[0]
+                    expires = deadline.stage_expires(name) if deadline else None
+                    task = asyncio.ensure_future(self.arun_stage(stage, self.stage_inputs(inputs, results), parent_span, expires))
+                    running[task] = (name, expires)
+
+                timeout = None
+                if deadline:
+                    timeout = max(0.0, min(expires for name, expires in running.values()) - time.monotonic())
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    name, expires = running.pop(task)
+                    if task.exception() is None:
+                        results[name] = task.result()
+                    elif deadline:
+                        stop(name, 'timeout' if isinstance(task.exception(), StageCancelled) else 'failed')
+                    else:
+                        raise task.exception()
+
+                now = time.monotonic()
+                for task, (name, expires) in list(running.items()):
+                    if expires is not None and expires <= now:
+                        del running[task]
+                        task.cancel()
+                        STAGE_TIMEOUTS.inc(stage=name)
+                        stop(name, 'timeout')
+        finally:
+            for task in running:
+                task.cancel()
+        return results, status
+
+    async def arun_stage(self, stage, inputs, parent_span=None, expires=None):
+        """Async counterpart of run_stage, without token streaming"""
+        name, depends_on, agent_method, task_method = stage
+        # Each task has its own copy of the context, so this only applies to the stage
+        token_stream.set_deadline(expires)
+        try:
+            with tracer.span(name, parent=parent_span):
+                if name == 'local_guide' and self.knowledge and inputs.get('city_names'):
+                    return await self.akickoff_guide(inputs)
+                return await self.akickoff_stage(name, agent_method, task_method, inputs)
+        except (StageCancelled, asyncio.CancelledError):
+            raise
+        except Exception:
+            STAGE_ERRORS.inc(stage=name)
+            raise
+
+    async def akickoff_stage(self, name, agent_method, task_method, inputs):
+        """Async counterpart of kickoff_stage"""
+        async def attempt():
+            # A hedged kickoff needs an agent and task of its own
+            with self.registry.agent(agent_method) as agent:
+                return await self.akickoff(agent, getattr(self.tasks, task_method)(inputs, agent))
+
+        async def hedged(span):
+            output, was_hedged = await hedger.run_async(name, attempt, attempt)
+            if span:
+                span.attributes['hedged'] = was_hedged
+            return output
+
+        with self.registry.agent(agent_method) as agent:
+            with tracer.span(f'{name}.task'):
+                task = getattr(self.tasks, task_method)(inputs, agent)
+
+            key = completion_key(agent, task)
+            labels = {'role': agent.role, 'model': model_name(agent.llm)}
+            if not hedger.enabled(name):
+                return await self.acomplete(name, key, labels, lambda span: self.akickoff(agent, task))
+
+        # A hedged kickoff borrows agents of its own, so this one goes back to the pool first
+        return await self.acomplete(name, key, labels, hedged)
+
+    async def acomplete(self, name, key, labels, run):
+        """Async counterpart of complete, for a run(span) coroutine.
+
+        The completion cache is SQLite, whose writes can wait up to 30
+        seconds for another worker's lock, so its lookups and writes run on
+        the loop's executor rather than on the loop.
+        """
+        loop = asyncio.get_running_loop()
+        if self.completion_cache:
+            with tracer.span(f'{name}.cache') as span:
+                cached = await loop.run_in_executor(None, self.completion_cache.get, key)
+                if span:
+                    span.attributes['hit'] = cached is not None
+            if cached is not None:
+                return ParsedOutput(cached)
+
+        with STAGE_SECONDS.time(stage=name), tracer.span(f'{name}.llm', **labels) as span:
+            output = await run(span)
+
+        if self.completion_cache:
+            await loop.run_in_executor(None, self.completion_cache.set, key, output.raw)
+        return output
+
+    async def akickoff(self, agent, task):
+        """Run an agent's task on the event loop, recording the tokens it used.
+
+        Crew.kickoff only runs synchronously, so the agent's executor is
+        driven through aexecute_task, which builds the same prompt and
+        parses the answer the same way.
+        """
+        token_usage.start()
+        try:
+            return ParsedOutput(final_answer(await aexecute_task(agent, task)))
+        finally:
+            prompt_tokens, completion_tokens = token_usage.stop()
+            PROMPT_TOKENS.inc(prompt_tokens, role=agent.role)
+            COMPLETION_TOKENS.inc(completion_tokens, role=agent.role)
+
+    async def akickoff_guide(self, inputs):
+        """Async counterpart of kickoff_guide"""
+        period = inputs.get('travel_dates') or 'any time'
+        cities = inputs['city_names']
+        facts = await asyncio.gather(*(self.acity_facts(city, period) for city in cities))
+        facts = [f"Facts about {city}:\n{city_facts}" for city, city_facts in zip(cities, facts)]
+
+        guide_inputs = dict(inputs, city_facts='\n\n'.join(facts))
+        return await self.akickoff_stage('local_guide', 'local_guide', 'personalized_guide_task', guide_inputs)
+
+    async def acity_facts(self, city, period):
+        """Async counterpart of city_facts; a plan that stops waiting does not cancel the generation.
+
+        Like the completion cache, the knowledge cache is read and written
+        on the loop's executor.
+        """
+        loop = asyncio.get_running_loop()
+        model = self.facts_model()
+        facts = await loop.run_in_executor(None, self.knowledge.get, city, period, model)
+        if facts is not None:
+            return facts
+
+        key = (place_key(city), period)
+        if key not in self.facts_tasks:
+            async def generate():
+                # Facts are kept for later plans, so this plan's deadline does not apply
+                token_stream.set_deadline(None)
+                with tracer.span('local_guide.facts', city=city):
+                    facts = (await self.akickoff_stage(
+                        'local_guide.facts', 'local_guide', 'city_facts_task',
+                        {'city': city, 'travel_dates': period}
+                    )).raw
+                await loop.run_in_executor(None, self.knowledge.set, city, period, facts, model)
+                return facts
+
+            task = asyncio.ensure_future(generate())
+            task.add_done_callback(lambda task: self.facts_tasks.pop(key, None))
+            self.facts_tasks[key] = task
+        return await asyncio.shield(self.facts_tasks[key])
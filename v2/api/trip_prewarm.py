@@ -0,0 +1,203 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date
+import argparse
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+from trip_agents import TripAgents, triptasks, canonicalize_inputs, canonical_dates
+from trip_cache import cache_key, place_key
+from trip_pipeline import STAGES, TripPipeline
+
+
+STAGE_BY_NAME = {stage[0]: stage for stage in STAGES}
+MONTHS = ['january', 'february', 'march', 'april', 'may', 'june', 'july',
+          'august', 'september', 'october', 'november', 'december']
+
+
+def month_date(month, today=None):
+    """Return the first day of the next occurrence of a month name or number as YYYY-MM-DD"""
+    today = today or date.today()
+    month = str(month).strip().casefold()
+    number = int(month) if month.isdigit() else next(
+        (index + 1 for index, name in enumerate(MONTHS) if name.startswith(month[:3])), None)
+    if not number or not 1 <= number <= 12:
+        raise ValueError(f"Unknown month: {month}")
+    year = today.year + (1 if number < today.month else 0)
+    return f"{year}-{number:02d}-01"
+
+
+class PrewarmProgress:
+    """Records finished jobs in a JSON Lines file so an interrupted run can resume.
+
+    Every finished job appends one line; jobs whose last line says 'done'
+    are skipped on the next run, failed ones are tried again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        if entry['status'] == 'done':
+                            self.done.add(entry['job'])
+                        else:
+                            self.done.discard(entry['job'])
+        self.file = open(path, 'a', buffering=1, encoding='utf-8') if path else None
+
+    def record(self, job, status, seconds, error=None):
+        entry = {'job': job, 'status': status, 'seconds': round(seconds, 3), 'finished_at': time.time()}
+        if error:
+            entry['error'] = error
+        with self.lock:
+            if status == 'done':
+                self.done.add(job)
+            if self.file:
+                self.file.write(json.dumps(entry) + '\n')
+
+
+class TripPrewarmer:
+    """Precomputes city-selector, hotel and local-guide outputs for popular trips.
+
+    Plans go through the same TripAgents, triptasks and TripPipeline as live
+    requests, with inputs canonicalized the way the apps do it, so their
+    prompts match and the results land in the completion cache under the
+    keys live requests look up. City facts go straight to the knowledge
+    cache the local guide reads.
+    """
+
+    def __init__(self, deterministic=False, tiers=None):
+        tasks = triptasks()
+        self.pipelines = []
+        for tier in tiers or [None]:
+            self.pipelines.append(TripPipeline(TripAgents(tier=tier), tasks))
+            if deterministic:
+                self.pipelines.append(TripPipeline(TripAgents(temperature=0, tier=tier), tasks))
+        self.date_bucket = os.getenv('TRIP_DATE_BUCKET', 'month')
+
+    def plan_jobs(self, countries, travel_types, budgets, durations, months, interests):
+        """Return {job key: inputs} for every combination, without duplicates"""
+        jobs = {}
+        for country in countries:
+            for travel_type in travel_types:
+                for budget in budgets:
+                    for duration in durations:
+                        for month in months:
+                            for interest in interests:
+                                inputs = canonicalize_inputs({
+                                    "travel_type": travel_type,
+                                    "travel_duration": duration,
+                                    "travel_budget": budget,
+                                    "travel_interests": interest,
+                                    "travel_dates": month_date(month),
+                                    "destination_country": country
+                                }, self.date_bucket)
+                                jobs['plan:' + cache_key(inputs)] = inputs
+        return jobs
+
+    def facts_jobs(self, cities, months):
+        """Return {job key: (city, period)} for every city and travel period"""
+        jobs = {}
+        for city in cities:
+            for month in months:
+                period = canonical_dates(month_date(month), self.date_bucket)
+                jobs[f'facts:{place_key(city)}:{period}'] = (city, period)
+        return jobs
+
+    def warm_plan(self, inputs):
+        """Run the cities stage, then the hotels and local guide stages that build on it"""
+        for pipeline in self.pipelines:
+            cities = pipeline.run_stage(STAGE_BY_NAME['cities'], pipeline.stage_inputs(inputs, {}))
+            downstream = pipeline.stage_inputs(inputs, {'cities': cities})
+            for name in ('hotels', 'local_guide'):
+                pipeline.run_stage(STAGE_BY_NAME[name], downstream)
+
+    def warm_facts(self, city, period):
+        """Store a city's facts for the model settings of every pipeline, since facts are keyed on them"""
+        for pipeline in self.pipelines:
+            pipeline.city_facts(city, period)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Precompute city, hotel and local guide outputs for popular trips',
+        fromfile_prefix_chars='@'
+    )
+    parser.add_argument('--countries', nargs='*', default=[], help='destination countries to plan trips for (@file reads one per line)')
+    parser.add_argument('--cities', nargs='*', default=[], help='cities to store local guide facts for (@file reads one per line)')
+    parser.add_argument('--travel-types', nargs='+', default=['leisure'], help='travel types to plan for')
+    parser.add_argument('--budgets', nargs='+', default=['mid-range'], help='budgets to plan for')
+    parser.add_argument('--durations', nargs='+', default=['4-7 days'], help='trip durations to plan for')
+    parser.add_argument('--months', nargs='+', default=[date.today().month], help='travel months, by name or number')
+    parser.add_argument('--interests', nargs='+', default=[''], help='interest lists to plan for, such as "art, food"')
+    parser.add_argument('--deterministic', action='store_true', help='also warm the temperature-0 agents used by deterministic requests')
+    parser.add_argument('--tiers', nargs='+', help='model tiers to warm (default: TRIP_MODEL_TIER)')
+    parser.add_argument('--concurrency', type=int, default=4, help='jobs to run at the same time')
+    parser.add_argument('--progress', default='prewarm_progress.jsonl', help='file recording finished jobs')
+    parser.add_argument('--restart', action='store_true', help='ignore earlier progress and run every job')
+    parser.add_argument('--dry-run', action='store_true', help='list the jobs without running them')
+    args = parser.parse_args()
+
+    prewarmer = TripPrewarmer(args.deterministic, args.tiers)
+    pipeline = prewarmer.pipelines[0]
+    plans = prewarmer.plan_jobs(args.countries, args.travel_types, args.budgets, args.durations, args.months, args.interests)
+    facts = prewarmer.facts_jobs(args.cities, args.months)
+    if plans and not pipeline.completion_cache:
+        raise SystemExit("Warming plans needs the completion cache; set TRIP_COMPLETION_CACHE_PATH")
+    if facts and not pipeline.knowledge:
+        raise SystemExit("Warming city facts needs the knowledge cache; set TRIP_KNOWLEDGE_CACHE_PATH")
+
+    if args.restart and os.path.exists(args.progress):
+        os.remove(args.progress)
+    progress = PrewarmProgress(args.progress)
+    jobs = [(key, prewarmer.warm_plan, (inputs,)) for key, inputs in plans.items()]
+    jobs += [(key, prewarmer.warm_facts, city_period) for key, city_period in facts.items()]
+    pending = [job for job in jobs if job[0] not in progress.done]
+    print(f"{len(jobs)} jobs, {len(jobs) - len(pending)} already done, {len(pending)} to run")
+    if args.dry_run:
+        for key, fn, job_args in pending:
+            print(f"  {key}")
+        return
+
+    def run(key, fn, job_args):
+        start = time.perf_counter()
+        try:
+            fn(*job_args)
+        except Exception as e:
+            progress.record(key, 'failed', time.perf_counter() - start, str(e))
+            return key, str(e), time.perf_counter() - start
+        progress.record(key, 'done', time.perf_counter() - start)
+        return key, None, time.perf_counter() - start
+
+    out = sys.stdout
+    failed = 0
+    executor = ThreadPoolExecutor(max_workers=args.concurrency)
+    # CrewAI agents are verbose; only the progress lines are printed
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        try:
+            futures = [executor.submit(run, *job) for job in pending]
+            for count, future in enumerate(as_completed(futures), 1):
+                key, error, seconds = future.result()
+                failed += bool(error)
+                status = f"failed: {error}" if error else 'done'
+                print(f"[{count}/{len(pending)}] {key[:100]} {status} ({seconds:.1f}s)", file=out, flush=True)
+        except KeyboardInterrupt:
+            print("Interrupted; finished jobs are kept and skipped on the next run", file=out)
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise SystemExit(130)
+        executor.shutdown()
+
+    print(f"{len(pending) - failed} jobs done, {failed} failed; progress in {args.progress}", file=out)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,34 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 from flask_restx import Api, Resource, fields
+from dotenv import load_dotenv
 import sys
+import hmac
+import math
 import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 # Add the parent directory to the Python path to import trip_agents
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from trip_agents import TripAgents, triptasks
-from crewai import Crew
+# trip_agents and trip_pipeline pull in crewai and langchain, which take seconds
+# to import; they are loaded on the first planning request or by the warm-up
+# thread so health checks and the docs respond straight away
+from trip_cache import PlanCache, SharedFlight, SingleFlight, cache_key
+from trip_formatter import format_output, IncrementalFormatter
+from trip_jobs import TripJobs, JobQueueFull
+from trip_metrics import CONTENT_TYPE, COALESCED_REQUESTS, render_metrics, track_requests
+from trip_tracing import tracer
 import json
 
+load_dotenv()
+
 app = Flask(__name__)
 CORS(app)  # Enable CORS for React frontend
+track_requests(app)
 
 # Initialize Swagger UI
 api = Api(app, version='1.0', 
@@ -32,191 +47,354 @@ trip_input = api.model('TripInput', {
     'endDate': fields.String(required=True, description='End date of the trip'),
     'budget': fields.String(required=True, description='Trip budget range'),
     'interests': fields.String(required=True, description='Travel interests'),
-    'destination': fields.String(required=False, description='Preferred destination country')
+    'destination': fields.String(required=False, description='Preferred destination country'),
+    'deterministic': fields.Boolean(required=False, default=False, description='Generate at temperature 0 so repeated requests get identical, cacheable answers'),
+    'tier': fields.String(required=False, description="Model tier for the agents, such as 'standard' or the faster, cheaper 'fast' (defaults to TRIP_MODEL_TIER)"),
+    'deadline': fields.Float(required=False, description='Seconds to plan within; stages still running then are cancelled and the finished sections are returned with their status (defaults to TRIP_PLAN_DEADLINE)')
 })
 
+class InvalidTripInput(ValueError):
+    """Raised for a planning request with a field the planner cannot use; answered with 400"""
+
 class TripPlannerAPI:
     def __init__(self):
-        self.agents = TripAgents()
-        self.tasks = triptasks()
+        self.pipeline = None
+        self.deterministic_pipeline = None
+        # Pipelines by (model tier, deterministic), built the first time a tier is requested
+        self.pipelines = {}
+        self.load_lock = threading.Lock()
+        self.plan_cache = PlanCache()
+        # Identical requests in flight at the same time share one plan, within
+        # this process and, with TRIP_SINGLEFLIGHT_PATH set, across workers
+        self.in_flight = SingleFlight()
+        self.shared_flight = SharedFlight.from_env()
+
+    @property
+    def loaded(self):
+        return self.pipeline is not None
+
+    def load(self):
+        """Import the agent stack and build the pipelines, once"""
+        if self.loaded:
+            return
+        with self.load_lock:
+            if self.loaded:
+                return
+            from trip_agents import TripAgents, triptasks, model_registry
+            from trip_pipeline import TripPipeline
+
+            self.agents = TripAgents()
+            self.tasks = triptasks()
+            # Temperature-0 agents for requests that opt into deterministic, cacheable answers
+            self.deterministic_pipeline = TripPipeline(TripAgents(temperature=0), self.tasks)
+            self.pipelines[(model_registry.default_tier, True)] = self.deterministic_pipeline
+            self.pipelines[(model_registry.default_tier, False)] = TripPipeline(self.agents, self.tasks)
+            self.pipeline = self.pipelines[(model_registry.default_tier, False)]
+
+    def pipeline_for(self, tier, deterministic):
+        """Return the pipeline whose agents use a model tier, building it on first use"""
+        with self.load_lock:
+            if (tier, deterministic) not in self.pipelines:
+                from trip_agents import TripAgents
+                from trip_pipeline import TripPipeline
+
+                agents = TripAgents(temperature=0 if deterministic else None, tier=tier)
+                self.pipelines[(tier, deterministic)] = TripPipeline(agents, self.tasks)
+            return self.pipelines[(tier, deterministic)]
+
+    def warm_up(self):
+        """Load the agent stack on a background thread"""
+        threading.Thread(target=self.load, name='trip-warmup', daemon=True).start()
 
     def format_ai_output(self, result):
         """Format CrewAI output for better user display with proper headings and structure"""
         try:
-            # Try to extract the raw content from CrewAI result
-            if hasattr(result, 'raw'):
-                content = str(result.raw)
-            else:
-                content = str(result)
-            
-            # Clean up the content for better display
-            content = content.replace('\\n', '\n')
-            content = content.replace('**', '')
-            
-            # Split into lines for processing
-            lines = content.split('\n')
-            formatted_lines = []
-            
-            for i, line in enumerate(lines):
-                line = line.strip()
-                if not line:
-                    continue
-                    
-                # Check for city/location names (often followed by colon)
-                if ':' in line and not line.startswith(('•', '-', '*', '1.', '2.', '3.', '4.', '5.')) and len(line.split(':')[0]) < 50:
-                    # This looks like a location or section header
-                    location_name = line.split(':')[0].strip()
-                    if location_name and not any(word in location_name.lower() for word in ['hotel', 'day', 'cost', 'price', 'budget']):
-                        formatted_lines.append(f"<h2 class='text-2xl font-bold text-primary-600 mt-6 mb-3'>🌟 {location_name}</h2>")
-                        # Add the description after the colon if it exists
-                        if len(line.split(':', 1)) > 1:
-                            description = line.split(':', 1)[1].strip()
-                            if description:
-                                formatted_lines.append(f"<p class='mb-4'>{description}</p>")
-                    else:
-                        formatted_lines.append(f"<h3 class='text-xl font-semibold text-gray-800 mt-4 mb-2'>{line}</h3>")
-                
-                # Handle hotel names or numbered items
-                elif line.startswith(('Hotel 1:', 'Hotel 2:', 'Hotel 3:', 'Day 1:', 'Day 2:', 'Day 3:', 'Day 4:', 'Day 5:')):
-                    icon = '🏨' if 'Hotel' in line else '📅'
-                    formatted_lines.append(f"<h2 class='text-2xl font-bold text-primary-600 mt-6 mb-3'>{icon} {line}</h2>")
-                
-                # Handle main section headings
-                elif any(section in line.lower() for section in ['accommodation', 'transportation', 'food', 'activities', 'budget breakdown', 'weather', 'best time to visit']):
-                    formatted_lines.append(f"<h3 class='text-xl font-semibold text-gray-800 mt-4 mb-2'>📋 {line}</h3>")
-                
-                # Handle bullet points and lists
-                elif line.startswith('-') or line.startswith('*'):
-                    bullet_content = line[1:].strip()
-                    # Check if this bullet point contains a sub-category
-                    if ':' in bullet_content and len(bullet_content.split(':')[0]) < 30:
-                        category = bullet_content.split(':')[0].strip()
-                        description = bullet_content.split(':', 1)[1].strip()
-                        formatted_lines.append(f"<p class='mb-2'><strong>{category}:</strong> {description}</p>")
-                    else:
-                        formatted_lines.append(f"<p class='mb-2'>• {bullet_content}</p>")
-                
-                # Handle numbered lists
-                elif line.startswith(('1.', '2.', '3.', '4.', '5.', '6.', '7.', '8.', '9.')):
-                    formatted_lines.append(f"<p class='mb-2 font-semibold'>{line}</p>")
-                
-                # Handle price/cost information
-                elif any(word in line.lower() for word in ['price', 'cost', '$', 'budget', 'estimate']):
-                    formatted_lines.append(f"<p class='mb-2 text-green-600 font-semibold'>💰 {line}</p>")
-                
-                # Handle location information
-                elif line.startswith('Location:'):
-                    formatted_lines.append(f"<p class='mb-2 text-blue-600 font-semibold'>📍 {line}</p>")
-                
-                # Handle features/amenities
-                elif any(word in line.lower() for word in ['features:', 'amenities:', 'includes:']):
-                    formatted_lines.append(f"<p class='mb-2 text-purple-600 font-semibold'>✨ {line}</p>")
-                
-                # Regular text
-                else:
-                    formatted_lines.append(f"<p class='mb-2'>{line}</p>")
-            
-            return '\n'.join(formatted_lines) if formatted_lines else content
-            
+            return format_output(result)
         except Exception as e:
             return str(result)
 
+    def format_section(self, section, result):
+        """Format one section's output, traced as its own span"""
+        with tracer.span(f'{section}.format'):
+            return self.format_ai_output(result)
+
+    def prepare_inputs(self, data):
+        """Build the canonical agent inputs, the pipeline to run and the plan cache key for a request"""
+        self.load()
+        from trip_agents import canonicalize_inputs
+
+        # Canonical inputs let equivalent preferences share cache entries
+        inputs = canonicalize_inputs({
+            "travel_type": data.get('travelType', 'leisure'),
+            "travel_duration": self.calculate_duration(data.get('startDate'), data.get('endDate')),
+            "travel_budget": data.get('budget', 'mid-range'),
+            "travel_interests": data.get('interests', ''),
+            "travel_dates": data.get('startDate', ''),
+            "destination_country": data.get('destination', 'any country')
+        }, os.getenv('TRIP_DATE_BUCKET', 'month'))
+        deterministic = self.request_deterministic(data)
+        tier = self.request_tier(data)
+
+        pipeline = self.pipeline_for(tier, deterministic)
+        return inputs, pipeline, cache_key(dict(inputs, deterministic=deterministic, tier=tier))
+
+    def request_tier(self, data):
+        """Return the request's model tier, or the default tier when it names none"""
+        self.load()
+        from trip_agents import model_registry
+
+        tier = data.get('tier') or model_registry.default_tier
+        if not isinstance(tier, str) or tier not in model_registry.names():
+            raise InvalidTripInput(f"Unknown tier {tier!r}; expected one of {', '.join(model_registry.names())}")
+        return tier
+
+    def request_deterministic(self, data):
+        """Return the request's 'deterministic' flag, which must be a JSON boolean when given"""
+        deterministic = data.get('deterministic')
+        if deterministic is None:
+            return False
+        # bool('false') is True, so strings and numbers are refused rather than guessed at
+        if not isinstance(deterministic, bool):
+            raise InvalidTripInput(f"deterministic must be true or false, not {deterministic!r}")
+        return deterministic
+
+    def validate_request(self, data):
+        """Raise InvalidTripInput for request data that cannot be planned, before any work starts"""
+        if not isinstance(data, dict):
+            raise InvalidTripInput("Expected a JSON object of trip inputs")
+        self.request_tier(data)
+        self.request_deterministic(data)
+        self.request_deadline(data)
+
+    def request_deadline(self, data):
+        """Return a Deadline for the request's 'deadline' seconds or TRIP_PLAN_DEADLINE, or None without either"""
+        seconds = data.get('deadline')
+        if seconds is None or seconds == '':
+            seconds = os.getenv('TRIP_PLAN_DEADLINE')
+            if not seconds:
+                return None
+            seconds = float(seconds)
+        else:
+            try:
+                # True would otherwise pass as one second
+                if isinstance(seconds, bool):
+                    raise TypeError()
+                seconds = float(seconds)
+            except (TypeError, ValueError):
+                raise InvalidTripInput(f"deadline must be a number of seconds, not {seconds!r}")
+            if not math.isfinite(seconds) or seconds <= 0:
+                raise InvalidTripInput("deadline must be a positive, finite number of seconds")
+        from trip_pipeline import Deadline
+        return Deadline(seconds)
+
+    def is_complete(self, plan):
+        """Whether every section of a plan finished"""
+        return all(status == 'completed' for status in plan['status'].values())
+
     def plan_trip(self, data):
-        """Plan a trip using the AI agents"""
+        """Plan a trip using the AI agents.
+
+        With a deadline the plan holds the sections that finished in time;
+        its 'status' tells which stages timed out, failed or were skipped.
+        Only complete plans are cached.
+        """
         try:
-            # Prepare inputs for the agents
-            inputs = {
-                "travel_type": data.get('travelType', 'leisure'),
-                "travel_duration": self.calculate_duration(data.get('startDate'), data.get('endDate')),
-                "travel_budget": data.get('budget', 'mid-range'),
-                "travel_interests": data.get('interests', ''),
-                "travel_dates": data.get('startDate', ''),
-                "destination_country": data.get('destination', 'any country')
-            }
+            with tracer.span('plan_trip') as span:
+                deadline = self.request_deadline(data)
+                inputs, pipeline, key = self.prepare_inputs(data)
 
-            # Step 1: City Selection
-            city_selector_agent = self.agents.city_selector()
-            city_task = self.tasks.city_selector_task(inputs, city_selector_agent)
-            
-            city_crew = Crew(
-                agents=[city_selector_agent],
-                tasks=[city_task],
-                verbose=False
-            )
-            
-            city_result = city_crew.kickoff()
-            city_text = str(city_result.raw) if hasattr(city_result, 'raw') else str(city_result)
-            
-            # Step 2: Hotel Selection (based on recommended cities)
-            hotel_inputs = inputs.copy()
-            hotel_inputs['recommended_cities'] = city_text
-            
-            hotel_selector_agent = self.agents.hotel_selector()
-            hotel_task = self.tasks.hotel_selector_task(hotel_inputs, hotel_selector_agent)
-            
-            hotel_crew = Crew(
-                agents=[hotel_selector_agent],
-                tasks=[hotel_task],
-                verbose=False
-            )
-            
-            hotel_result = hotel_crew.kickoff()
-            
-            # Step 3: Budget Planning
-            budget_inputs = inputs.copy()
-            budget_inputs['recommended_cities'] = city_text
-            budget_inputs['recommended_hotels'] = str(hotel_result.raw) if hasattr(hotel_result, 'raw') else str(hotel_result)
-            
-            budget_agent = self.agents.budget_manager_agent()
-            budget_task = self.tasks.budget_manager_task(budget_inputs, budget_agent)
-            
-            budget_crew = Crew(
-                agents=[budget_agent],
-                tasks=[budget_task],
-                verbose=False
-            )
-            
-            budget_result = budget_crew.kickoff()
-            
-            # Step 4: Itinerary Planning
-            itinerary_inputs = inputs.copy()
-            itinerary_inputs['recommended_cities'] = city_text
-            
-            itinerary_agent = self.agents.itinerary_planner()
-            itinerary_task = self.tasks.itinerary_planner_task(itinerary_inputs, itinerary_agent)
-            
-            itinerary_crew = Crew(
-                agents=[itinerary_agent],
-                tasks=[itinerary_task],
-                verbose=False
-            )
-            
-            itinerary_result = itinerary_crew.kickoff()
-            
-            # Step 5: Local Guide Information
-            guide_inputs = inputs.copy()
-            guide_inputs['recommended_cities'] = city_text
-            
-            local_guide_agent = self.agents.local_guide()
-            city_research_task = self.tasks.city_researcher_task(guide_inputs, local_guide_agent)
-            
-            guide_crew = Crew(
-                agents=[local_guide_agent],
-                tasks=[city_research_task],
-                verbose=False
-            )
-            
-            guide_result = guide_crew.kickoff()
-            
-            # Format and combine all results
-            return self.create_combined_itinerary(
-                city_result,
-                hotel_result,
-                budget_result,
-                itinerary_result,
-                guide_result
-            )
+                # Serve repeat queries straight from the plan cache
+                cached_plan = self.plan_cache.get(key)
+                if span:
+                    span.attributes['cached'] = cached_plan is not None
+                if cached_plan is not None:
+                    return cached_plan
+
+                plan, coalesced = self.coalesce(self.flight_key(key, deadline), lambda: self.build_plan(inputs, pipeline, deadline=deadline))
+                if span:
+                    span.attributes['coalesced'] = coalesced
+                    span.attributes['complete'] = self.is_complete(plan)
+                if self.is_complete(plan):
+                    self.plan_cache.set(key, plan)
+                return plan
             
+        except InvalidTripInput:
+            raise
+        except Exception as e:
+            raise Exception(f"Error planning trip: {str(e)}")
+
+    def flight_key(self, key, deadline):
+        """Key under which identical requests share one plan being built"""
+        # Only requests with the same deadline share a plan, so no one gets a shorter one
+        return key if deadline is None else f"{key}:deadline={deadline.seconds}"
+
+    def coalesce(self, key, build):
+        """Build the plan for a key once while identical requests wait for it.
+
+        Returns (plan, coalesced), where coalesced tells whether another
+        request built the plan.
+        """
+        def build_once():
+            if self.shared_flight is None:
+                return build()
+            plan, shared = self.shared_flight.do(key, build)
+            if shared:
+                COALESCED_REQUESTS.inc(scope='workers')
+            return plan
+
+        plan, shared = self.in_flight.do(key, build_once)
+        if shared:
+            COALESCED_REQUESTS.inc(scope='process')
+        return plan, shared
+
+    def build_plan(self, inputs, pipeline, flight=None, deadline=None):
+        """Run the pipeline for canonical inputs and return the formatted sections with their status"""
+        # Run the stages as a dependency graph: hotels, itinerary and local guide
+        # start together once the cities are known, budget waits for the hotels
+        results = {}
+        status = {}
+        for kind, section, payload in pipeline.iter_events(inputs, flight=flight, deadline=deadline):
+            if kind == 'status':
+                status[section] = payload
+            else:
+                results[section] = payload
+        return self.combine(results, status)
+
+    def combine(self, results, status):
+        """Format the finished stage results into a plan with the status of every section"""
+        from trip_pipeline import STAGES
+
+        # Format and combine all results
+        with tracer.span('combine'):
+            if status:
+                plan = {section: self.format_section(section, results[section]) for section, *_ in STAGES if section in results}
+            else:
+                plan = self.create_combined_itinerary(
+                    results['cities'],
+                    results['hotels'],
+                    results['budget'],
+                    results['itinerary'],
+                    results['local_guide']
+                )
+        plan['status'] = {section: status.get(section, 'completed') for section, *_ in STAGES}
+        return plan
+
+    def plan_batch(self, items):
+        """Plan several trips at once, planning each distinct request and each distinct stage once.
+
+        Requests are grouped by their canonical inputs and deadline, and the
+        groups are planned TRIP_BATCH_WORKERS at a time. Stages with the same
+        agent and prompt in different groups share one run through a
+        SingleFlight scoped to the batch. A failed plan, or an item with
+        invalid input, is reported in its place without failing the others,
+        and as with plan_trip only complete plans are cached.
+        """
+        try:
+            with tracer.span('plan_batch', size=len(items)) as span:
+                groups = OrderedDict()
+                plans = [None] * len(items)
+                for index, data in enumerate(items):
+                    try:
+                        self.validate_request(data)
+                        deadline = self.request_deadline(data)
+                        inputs, pipeline, key = self.prepare_inputs(data)
+                    except InvalidTripInput as e:
+                        plans[index] = {'error': str(e)}
+                        continue
+                    flight_key = self.flight_key(key, deadline)
+                    groups.setdefault(flight_key, (key, inputs, pipeline, deadline, []))[4].append(index)
+
+                flight = SingleFlight(keep=True)
+                parent_span = tracer.current()
+
+                def plan_group(flight_key, key, inputs, pipeline, deadline):
+                    with tracer.span('plan_batch.plan', parent=parent_span):
+                        cached_plan = self.plan_cache.get(key)
+                        if cached_plan is not None:
+                            return cached_plan
+                        plan, coalesced = self.coalesce(
+                            flight_key, lambda: self.build_plan(inputs, pipeline, flight, deadline=deadline)
+                        )
+                        if self.is_complete(plan):
+                            self.plan_cache.set(key, plan)
+                        return plan
+
+                workers = int(os.getenv('TRIP_BATCH_WORKERS', '4'))
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    futures = {
+                        flight_key: executor.submit(plan_group, flight_key, *group[:4])
+                        for flight_key, group in groups.items()
+                    }
+
+                for flight_key, (*_, indexes) in groups.items():
+                    try:
+                        plan = futures[flight_key].result()
+                    except Exception as e:
+                        plan = {'error': f"Error planning trip: {str(e)}"}
+                    for index in indexes:
+                        plans[index] = plan
+
+                stages = flight.stats()
+                if span:
+                    span.attributes.update(unique=len(groups), **stages)
+                return {
+                    'plans': plans,
+                    'stats': {
+                        'requests': len(items),
+                        'unique_plans': len(groups),
+                        'stages_run': stages['runs'],
+                        'stages_shared': stages['shared']
+                    }
+                }
+
+        except Exception as e:
+            raise Exception(f"Error planning trip batch: {str(e)}")
+
+    def iter_plan(self, data, stream_tokens=False):
+        """Yield (event, section, content) as the plan is generated.
+
+        A 'section' event carries the formatted output of a finished stage.
+        With stream_tokens set, 'chunk' events carry formatted lines while a
+        stage is still generating. With a deadline, a 'status' event reports
+        each stage that timed out, failed or was skipped.
+        """
+        try:
+            with tracer.span('plan_trip.stream') as span:
+                deadline = self.request_deadline(data)
+                inputs, pipeline, key = self.prepare_inputs(data)
+                from trip_pipeline import STAGES
+
+                cached_plan = self.plan_cache.get(key)
+                if span:
+                    span.attributes['cached'] = cached_plan is not None
+                if cached_plan is not None:
+                    for section, *_ in STAGES:
+                        yield 'section', section, cached_plan[section]
+                    return
+
+                plan = {}
+                status = {section: 'completed' for section, *_ in STAGES}
+                formatters = {section: IncrementalFormatter() for section, *_ in STAGES}
+                for kind, section, payload in pipeline.iter_events(inputs, stream_tokens, deadline=deadline):
+                    if kind == 'token':
+                        lines = formatters[section].feed(payload)
+                        if lines:
+                            yield 'chunk', section, '\n'.join(lines)
+                        continue
+                    if kind == 'status':
+                        status[section] = payload
+                        yield 'status', section, payload
+                        continue
+
+                    plan[section] = self.format_section(section, payload)
+                    yield 'section', section, plan[section]
+
+                plan['status'] = status
+                if self.is_complete(plan):
+                    self.plan_cache.set(key, plan)
+
+        except InvalidTripInput:
+            raise
         except Exception as e:
             raise Exception(f"Error planning trip: {str(e)}")
 
@@ -248,40 +426,181 @@ class TripPlannerAPI:
         """Create a combined and formatted itinerary from all results"""
         try:
             return {
-                'cities': self.format_ai_output(city_result),
-                'hotels': self.format_ai_output(hotel_result),
-                'budget': self.format_ai_output(budget_result),
-                'itinerary': self.format_ai_output(itinerary_result),
-                'local_guide': self.format_ai_output(guide_result)
+                'cities': self.format_section('cities', city_result),
+                'hotels': self.format_section('hotels', hotel_result),
+                'budget': self.format_section('budget', budget_result),
+                'itinerary': self.format_section('itinerary', itinerary_result),
+                'local_guide': self.format_section('local_guide', guide_result)
             }
         except Exception as e:
             raise Exception(f"Error creating combined itinerary: {str(e)}")
 
 trip_planner = TripPlannerAPI()
+trip_jobs = TripJobs(trip_planner)
+
+# Load the agents in the background so the first planning request does not pay for it
+if os.getenv('TRIP_WARMUP', 'true').lower() != 'false':
+    trip_planner.warm_up()
 
 @ns_trip.route('/plan')
 class TripPlanner(Resource):
     @ns_trip.expect(trip_input)
     @ns_trip.doc('plan_trip', 
         responses={
-            200: 'Success',
+            200: 'Success; with a deadline, the sections that finished and the status of each',
             400: 'Invalid input',
-            500: 'Server error'
+            500: 'Server error',
+            504: 'The deadline passed before any section finished'
         })
     def post(self):
         """Plan a new trip based on user preferences"""
         try:
+            trip_planner.validate_request(request.json)
             result = trip_planner.plan_trip(request.json)
+            # Out of time before any section finished
+            if not any(status == 'completed' for status in result['status'].values()):
+                return result, 504
             return jsonify(result)
+        except InvalidTripInput as e:
+            return {'error': str(e)}, 400
         except Exception as e:
             return {'error': str(e)}, 500
 
+@ns_trip.route('/plan/batch')
+class TripPlannerBatch(Resource):
+    @ns_trip.expect([trip_input])
+    @ns_trip.doc('plan_trip_batch',
+        responses={
+            200: 'Plans in request order, with counts of unique plans and shared stages',
+            400: 'Invalid input',
+            500: 'Server error'
+        })
+    def post(self):
+        """Plan a list of trips, running each distinct plan and stage only once"""
+        items = request.json
+        if not isinstance(items, list) or not items or not all(isinstance(item, dict) for item in items):
+            return {'error': 'Expected a non-empty list of trip inputs'}, 400
+        max_size = int(os.getenv('TRIP_BATCH_MAX_SIZE', '50'))
+        if len(items) > max_size:
+            return {'error': f'A batch can hold at most {max_size} trips'}, 400
+        try:
+            return jsonify(trip_planner.plan_batch(items))
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+@ns_trip.route('/jobs')
+class TripJobList(Resource):
+    @ns_trip.expect(trip_input)
+    @ns_trip.doc('create_trip_job',
+        responses={
+            202: 'Job accepted',
+            400: 'Invalid input',
+            503: 'Too many jobs in progress'
+        })
+    def post(self):
+        """Start planning a trip in the background and return its job id"""
+        try:
+            trip_planner.validate_request(request.json)
+            job_id = trip_jobs.submit(request.json)
+        except InvalidTripInput as e:
+            return {'error': str(e)}, 400
+        except JobQueueFull as e:
+            return {'error': str(e)}, 503
+        return {
+            'job_id': job_id,
+            'status': 'queued',
+            'status_url': api.url_for(TripJob, job_id=job_id)
+        }, 202
+
+@ns_trip.route('/jobs/<string:job_id>')
+class TripJob(Resource):
+    @ns_trip.doc('get_trip_job',
+        responses={
+            200: 'Job status and the sections finished so far',
+            404: 'Unknown job'
+        })
+    def get(self, job_id):
+        """Get the status of a planning job and any sections finished so far"""
+        job = trip_jobs.get(job_id)
+        if job is None:
+            return {'error': 'Job not found'}, 404
+        return job
+
+def is_admin_request():
+    """Check the admin token header against TRIP_ADMIN_TOKEN; without a configured token nobody is admin"""
+    admin_token = os.getenv('TRIP_ADMIN_TOKEN')
+    if not admin_token:
+        return False
+    return hmac.compare_digest(request.headers.get('X-Admin-Token', ''), admin_token)
+
+@ns_trip.route('/cache')
+class PlanCacheAdmin(Resource):
+    @ns_trip.doc('plan_cache_stats')
+    def get(self):
+        """Get plan cache size and hit/miss counters"""
+        return trip_planner.plan_cache.stats()
+
+    @ns_trip.doc('purge_plan_cache',
+        responses={
+            200: 'Cache purged',
+            403: 'Admin token required'
+        })
+    def delete(self):
+        """Purge all cached trip plans"""
+        if not is_admin_request():
+            return {'error': 'Admin token required'}, 403
+        return {'removed': trip_planner.plan_cache.clear()}
+
+def sse_event(event, data):
+    """Encode one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@ns_trip.route('/plan/stream')
+class TripPlannerStream(Resource):
+    @ns_trip.expect(trip_input)
+    @ns_trip.doc('plan_trip_stream',
+        responses={
+            200: 'Server-Sent Events stream of cities, hotels, budget, itinerary and local_guide sections',
+            400: 'Invalid input'
+        },
+        params={'tokens': 'Also stream formatted lines as chunk events while each section is generated (default true)'})
+    def post(self):
+        """Plan a new trip, streaming each section as soon as its stage finishes"""
+        data = request.json
+        stream_tokens = request.args.get('tokens', 'true').lower() != 'false'
+        # Reject bad input before the event stream starts, while a status code can still be sent
+        try:
+            trip_planner.validate_request(data)
+        except InvalidTripInput as e:
+            return {'error': str(e)}, 400
+
+        def generate():
+            try:
+                for event, section, content in trip_planner.iter_plan(data, stream_tokens):
+                    # Finished sections use the section name as the event name
+                    name = section if event == 'section' else event
+                    yield sse_event(name, {'section': section, 'content': content})
+                yield sse_event('done', {})
+            except Exception as e:
+                yield sse_event('error', {'error': str(e)})
+
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
+@app.route('/metrics')
+def metrics():
+    """Expose request, stage, token and cache metrics in the Prometheus text format"""
+    return Response(render_metrics(), content_type=CONTENT_TYPE)
+
 @ns_trip.route('/health')
 class HealthCheck(Resource):
     @ns_trip.doc('health_check')
     def get(self):
         """Check if the API is running"""
-        return {'status': 'healthy', 'timestamp': datetime.now().isoformat()}
+        return {'status': 'healthy', 'agents_loaded': trip_planner.loaded, 'timestamp': datetime.now().isoformat()}
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5001, debug=True) 
\ No newline at end of file
@@ -0,0 +1,155 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+import asyncio
+import os
+
+# The Flask app module holds the planner: its pipelines, plan cache and input
+# handling are shared, only the way plans are run differs
+from app import InvalidTripInput, trip_planner
+from trip_metrics import CONTENT_TYPE, COALESCED_REQUESTS, REQUESTS, REQUESTS_IN_FLIGHT, render_metrics
+from trip_tracing import tracer
+
+
+class AsyncTripPlanner:
+    """Plans trips on the event loop instead of one worker thread per plan.
+
+    Each stage of a plan is an asyncio task whose LLM calls are awaited, so
+    waiting plans cost a task rather than a thread and the thread count
+    stays fixed however many are in flight. How many LLM calls actually run
+    at once is still capped by the connection pool and the rate limiter
+    (TRIP_LLM_MAX_CONNECTIONS and TRIP_LLM_MAX_CONCURRENCY, 20 by default);
+    the other plans queue for them. Identical plans in flight at the same
+    time are built once.
+    """
+
+    def __init__(self, planner):
+        self.planner = planner
+        self.in_flight = {}
+
+    async def plan_trip(self, data):
+        """Plan a trip the way TripPlannerAPI.plan_trip does, awaiting every stage"""
+        try:
+            with tracer.span('plan_trip', server='asgi') as span:
+                deadline = self.planner.request_deadline(data)
+                inputs, pipeline, key = self.planner.prepare_inputs(data)
+
+                cached_plan = self.planner.plan_cache.get(key)
+                if span:
+                    span.attributes['cached'] = cached_plan is not None
+                if cached_plan is not None:
+                    return cached_plan
+
+                flight_key = self.planner.flight_key(key, deadline)
+                plan, coalesced = await self.coalesce(flight_key, lambda: self.build_plan(inputs, pipeline, deadline))
+                if span:
+                    span.attributes['coalesced'] = coalesced
+                    span.attributes['complete'] = self.planner.is_complete(plan)
+                if self.planner.is_complete(plan):
+                    self.planner.plan_cache.set(key, plan)
+                return plan
+
+        except InvalidTripInput:
+            raise
+        except Exception as e:
+            raise Exception(f"Error planning trip: {str(e)}")
+
+    async def coalesce(self, key, build):
+        """Await the plan for a key, building it only if no identical request is already doing so.
+
+        Returns (plan, coalesced). The build is shielded, so a request that
+        goes away does not cancel the plan for the others waiting on it.
+        """
+        task = self.in_flight.get(key)
+        if task is not None:
+            COALESCED_REQUESTS.inc(scope='process')
+            return await asyncio.shield(task), True
+
+        task = asyncio.ensure_future(build())
+        task.add_done_callback(lambda task: self.in_flight.pop(key, None))
+        self.in_flight[key] = task
+        return await asyncio.shield(task), False
+
+    async def build_plan(self, inputs, pipeline, deadline=None):
+        results, status = await pipeline.arun(inputs, deadline)
+        return self.planner.combine(results, status)
+
+
+async_planner = AsyncTripPlanner(trip_planner)
+
+
+def tracked(endpoint):
+    """Count requests to a handler and keep the in-flight gauge up to date, like track_requests"""
+    def decorate(handler):
+        async def wrapper(request):
+            REQUESTS_IN_FLIGHT.inc(endpoint=endpoint)
+            status = 500
+            try:
+                response = await handler(request)
+                status = response.status_code
+                return response
+            finally:
+                REQUESTS_IN_FLIGHT.dec(endpoint=endpoint)
+                REQUESTS.inc(endpoint=endpoint, status=status)
+        return wrapper
+    return decorate
+
+
+@tracked('/trip/plan')
+async def plan(request):
+    """Plan a new trip based on user preferences"""
+    try:
+        data = await request.json()
+    except ValueError:
+        return JSONResponse({'error': 'Expected a JSON object of trip inputs'}, status_code=400)
+    try:
+        trip_planner.validate_request(data)
+        result = await async_planner.plan_trip(data)
+    except InvalidTripInput as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    except Exception as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+    # Out of time before any section finished
+    if not any(status == 'completed' for status in result['status'].values()):
+        return JSONResponse(result, status_code=504)
+    return JSONResponse(result)
+
+
+@tracked('/trip/health')
+async def health(request):
+    """Check if the API is running"""
+    return JSONResponse({'status': 'healthy', 'agents_loaded': trip_planner.loaded, 'timestamp': datetime.now().isoformat()})
+
+
+async def metrics(request):
+    """Expose request, stage, token and cache metrics in the Prometheus text format"""
+    return Response(render_metrics(), headers={'Content-Type': CONTENT_TYPE})
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Only blocking leftovers run on threads, such as callbacks of verbose
+    # agents, so a few are enough however many plans are in flight
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(
+        max_workers=int(os.getenv('TRIP_ASGI_THREADS', '4')), thread_name_prefix='trip-asgi'))
+    # Building the agents blocks, so it is done before requests are served
+    await loop.run_in_executor(None, trip_planner.load)
+    yield
+
+
+app = Starlette(
+    routes=[
+        Route('/trip/plan', plan, methods=['POST']),
+        Route('/trip/health', health),
+        Route('/metrics', metrics),
+    ],
+    lifespan=lifespan
+)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=5001)
@@ -0,0 +1,412 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+from trip_metrics import record_cache_lookup
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+
+def cache_key(inputs):
+    """Build a stable cache key from a trip inputs dict"""
+    return json.dumps(inputs, sort_keys=True, default=str)
+
+
+class PlanCache:
+    """Bounded LRU cache with a time-to-live for finished trip plans"""
+
+    def __init__(self, max_size=None, ttl=None):
+        self.max_size = max_size or int(os.getenv('TRIP_PLAN_CACHE_SIZE', '256'))
+        self.ttl = ttl or float(os.getenv('TRIP_PLAN_CACHE_TTL', '3600'))
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached plan for a key, or None if missing or expired"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                record_cache_lookup('plan', False)
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            record_cache_lookup('plan', True)
+            return entry[1]
+
+    def set(self, key, value):
+        """Store a plan, evicting the least recently used entries when full"""
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        """Remove every cached plan and return how many were removed"""
+        with self.lock:
+            removed = len(self.entries)
+            self.entries.clear()
+            return removed
+
+    def stats(self):
+        """Return the cache size and hit/miss counters"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+def place_key(city):
+    """Normalize a city name such as '**Paris, France**' to 'paris'"""
+    return ' '.join(city.replace('*', '').split(',')[0].split()).casefold()
+
+
+class KnowledgeCache:
+    """SQLite-backed store of per-city travel facts, keyed by city, travel month and model.
+
+    Weather, restaurants, sights and transport depend on where and when
+    someone travels, not on who is travelling, so the facts are kept apart
+    from personalized output and reused by every plan visiting the same
+    city in the same month. Like completions, facts are only reused with
+    the model settings that wrote them (see model_settings), so a capped or
+    temperature-0 answer is never served to another tier. Entries expire
+    after ttl_days.
+    """
+
+    def __init__(self, path, ttl_days=None):
+        self.path = path
+        self.ttl = (ttl_days or float(os.getenv('TRIP_KNOWLEDGE_TTL_DAYS', '30'))) * 86400
+        self.local = threading.local()
+        conn = self.connection()
+        # Facts stored before they were keyed on the model cannot be told apart, so they are dropped
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(knowledge)")]
+        if columns and 'model' not in columns:
+            conn.execute("DROP TABLE knowledge")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS knowledge ("
+            "city TEXT NOT NULL, period TEXT NOT NULL, model TEXT NOT NULL, facts TEXT NOT NULL, "
+            "created_at REAL NOT NULL, PRIMARY KEY (city, period, model))"
+        )
+
+    @classmethod
+    def from_env(cls):
+        """Create the store at TRIP_KNOWLEDGE_CACHE_PATH, or None if it is set to an empty value"""
+        path = os.getenv('TRIP_KNOWLEDGE_CACHE_PATH', 'knowledge_cache.db')
+        return cls(path) if path else None
+
+    def connection(self):
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = connect(self.path)
+        return conn
+
+    def get(self, city, period, model=''):
+        """Return the facts for a city and travel period written by a model, or None if missing or expired"""
+        row = self.connection().execute(
+            "SELECT facts FROM knowledge WHERE city = ? AND period = ? AND model = ? AND created_at >= ?",
+            (place_key(city), period, model, time.time() - self.ttl)
+        ).fetchone()
+        record_cache_lookup('knowledge', row is not None)
+        return row[0] if row else None
+
+    def set(self, city, period, facts, model=''):
+        self.connection().execute(
+            "INSERT OR REPLACE INTO knowledge (city, period, model, facts, created_at) VALUES (?, ?, ?, ?, ?)",
+            (place_key(city), period, model, facts, time.time())
+        )
+
+    def clear(self):
+        """Remove every stored fact and return how many entries were removed"""
+        return self.connection().execute("DELETE FROM knowledge").rowcount
+
+    def stats(self):
+        """Return the number of entries and distinct cities stored"""
+        count, cities = self.connection().execute(
+            "SELECT COUNT(*), COUNT(DISTINCT city) FROM knowledge"
+        ).fetchone()
+        return {'entries': count, 'cities': cities, 'ttl_days': self.ttl / 86400}
+
+
+class SingleFlight:
+    """Runs a function once per key while other callers with the same key wait for its result.
+
+    By default a key is forgotten as soon as its call finishes, so only
+    calls that overlap are shared. With keep set, results are kept for the
+    life of the object, which suits work scoped to one batch.
+    """
+
+    def __init__(self, keep=False):
+        self.keep = keep
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.runs = 0
+        self.shared = 0
+
+    def do(self, key, fn):
+        """Return (result, shared): fn's result for this key and whether another caller computed it"""
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+                self.runs += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn()
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            if not self.keep:
+                with self.lock:
+                    del self.calls[key]
+
+    def stats(self):
+        """Return how many calls ran and how many were served from another caller's run"""
+        with self.lock:
+            return {'runs': self.runs, 'shared': self.shared}
+
+
+def model_settings(llm):
+    """Return the settings of an LLM client that change its answers: model, temperature and any token cap"""
+    settings = [
+        str(getattr(llm, 'model_name', None) or getattr(llm, 'model', '')),
+        str(getattr(llm, 'temperature', '')),
+    ]
+    # Only a capped answer can differ, so uncapped models keep their old keys
+    if getattr(llm, 'max_tokens', None):
+        settings.append(f"max_tokens={llm.max_tokens}")
+    return settings
+
+
+def completion_key(agent, task):
+    """Hash everything that determines an agent's completion for a task"""
+    parts = [agent.role, agent.goal, agent.backstory, task.description] + model_settings(getattr(agent, 'llm', None))
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+def connect(path):
+    """Open a SQLite connection set up for several processes sharing one file"""
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class CompletionCache:
+    """SQLite-backed cache of stage completions, shared by every worker process.
+
+    Each thread opens its own connection. The database runs in WAL mode so
+    readers never block the writer, and writes happen in immediate
+    transactions so several gunicorn workers can share one file. When the
+    stored completions grow past max_bytes, the least recently used entries
+    are evicted.
+    """
+
+    def __init__(self, path, max_bytes=None):
+        self.path = path
+        self.max_bytes = max_bytes or int(float(os.getenv('TRIP_COMPLETION_CACHE_MAX_MB', '100')) * 1024 * 1024)
+        self.local = threading.local()
+        conn = self.connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS completions_accessed_at ON completions (accessed_at)")
+
+    @classmethod
+    def from_env(cls):
+        """Create the cache at TRIP_COMPLETION_CACHE_PATH, or None if it is set to an empty value"""
+        path = os.getenv('TRIP_COMPLETION_CACHE_PATH', 'completion_cache.db')
+        return cls(path) if path else None
+
+    def connection(self):
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = connect(self.path)
+        return conn
+
+    def get(self, key):
+        """Return the cached completion for a key, or None"""
+        conn = self.connection()
+        row = conn.execute("SELECT value FROM completions WHERE key = ?", (key,)).fetchone()
+        record_cache_lookup('completion', row is not None)
+        if row is None:
+            return None
+        conn.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def set(self, key, value):
+        """Store a completion and evict old entries if the cache is over its size budget"""
+        conn = self.connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO completions (key, value, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode('utf-8')), now, now)
+            )
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+            if total > self.max_bytes:
+                self.evict(conn, total - self.max_bytes)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def evict(self, conn, excess):
+        """Delete least recently used entries until at least excess bytes are freed"""
+        freed = 0
+        stale = []
+        for key, size in conn.execute("SELECT key, size FROM completions ORDER BY accessed_at"):
+            stale.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        conn.executemany("DELETE FROM completions WHERE key = ?", stale)
+
+    def clear(self):
+        """Remove every cached completion and return how many were removed"""
+        return self.connection().execute("DELETE FROM completions").rowcount
+
+    def stats(self):
+        """Return the number of entries and bytes stored"""
+        count, size = self.connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completions"
+        ).fetchone()
+        return {'entries': count, 'bytes': size, 'max_bytes': self.max_bytes}
+
+
+class SharedFlight:
+    """Coalesces identical work across worker processes through a SQLite lease table.
+
+    The first process to claim a key holds a lease on it and stores the
+    JSON-encoded result when it is done; callers that find the work running
+    poll for that result instead of doing it again. Only those followers get
+    the result: a caller that arrives after the work finished takes a new
+    lease, so this never serves results of its own. A lease that runs out
+    before a result arrives means its owner died, and the next caller to
+    look takes over. If the work fails the lease is released and a follower
+    claims the key in turn, and a follower that has waited max_wait seconds
+    does the work itself.
+    """
+
+    def __init__(self, path, lease=None, poll_interval=None, max_wait=None, result_ttl=30):
+        self.path = path
+        self.lease = lease or float(os.getenv('TRIP_SINGLEFLIGHT_LEASE', '300'))
+        self.poll_interval = poll_interval or float(os.getenv('TRIP_SINGLEFLIGHT_POLL', '0.25'))
+        self.max_wait = max_wait or float(os.getenv('TRIP_SINGLEFLIGHT_WAIT', str(self.lease)))
+        # How long followers have to pick up a finished result
+        self.result_ttl = result_ttl
+        self.local = threading.local()
+        self.connection().execute(
+            "CREATE TABLE IF NOT EXISTS flights ("
+            "key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL, "
+            "result TEXT, finished_at REAL)"
+        )
+
+    @classmethod
+    def from_env(cls):
+        """Create the lease table at TRIP_SINGLEFLIGHT_PATH, or None if it is not set"""
+        path = os.getenv('TRIP_SINGLEFLIGHT_PATH', '')
+        return cls(path) if path else None
+
+    def connection(self):
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = connect(self.path)
+        return conn
+
+    def claim(self, key, following=None):
+        """Take the lease on a key unless another caller's work on it is running.
+
+        following is the owner whose work this caller has been waiting for.
+        Returns (owner, None) when this caller now owns the key,
+        (None, (owner, None)) while another caller's work is running, and
+        (None, (owner, result)) once the work being followed has finished.
+        """
+        conn = self.connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM flights WHERE finished_at < ?", (now - self.result_ttl,))
+            row = conn.execute(
+                "SELECT owner, result, finished_at, expires_at FROM flights WHERE key = ?", (key,)
+            ).fetchone()
+            running = row is not None and row[2] is None and row[3] >= now
+            if running or (row is not None and row[2] is not None and row[0] == following):
+                conn.execute("COMMIT")
+                return None, row[:2]
+
+            owner = uuid.uuid4().hex
+            conn.execute(
+                "INSERT OR REPLACE INTO flights (key, owner, expires_at, result, finished_at) "
+                "VALUES (?, ?, ?, NULL, NULL)",
+                (key, owner, now + self.lease)
+            )
+            conn.execute("COMMIT")
+            return owner, None
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def finish(self, key, owner, result):
+        """Publish the result of a key this caller owns"""
+        self.connection().execute(
+            "UPDATE flights SET result = ?, finished_at = ? WHERE key = ? AND owner = ?",
+            (result, time.time(), key, owner)
+        )
+
+    def release(self, key, owner):
+        """Give up the lease on a key this caller owns without publishing a result"""
+        self.connection().execute("DELETE FROM flights WHERE key = ? AND owner = ?", (key, owner))
+
+    def do(self, key, fn):
+        """Return (result, shared) like SingleFlight.do, coalescing across processes"""
+        following = None
+        give_up_at = time.time() + self.max_wait
+        while True:
+            owner, row = self.claim(key, following)
+            if owner is not None:
+                try:
+                    result = fn()
+                    encoded = json.dumps(result)
+                except BaseException:
+                    self.release(key, owner)
+                    raise
+                self.finish(key, owner, encoded)
+                return result, False
+
+            following, result = row
+            if result is not None:
+                return json.loads(result), True
+            if time.time() >= give_up_at:
+                return fn(), False
+            time.sleep(self.poll_interval)
@@ -0,0 +1,136 @@
+from trip_formatter import parse_output
+import re
+
+
+# Labels like "Hotel 1" or "Option 2" that stand in front of the real name
+ENTRY_LABEL = re.compile(r'^(hotel|city|option|destination)\s*#?\d*$', re.IGNORECASE)
+NUMBERING = re.compile(r'^\d+[.)]\s*')
+DETAIL_SEPARATORS = (':', ' - ', ' – ', ' — ')
+
+# Attribute labels such as "- Price: $200 per night" describe the current entry
+# instead of starting a new one; only FACT_LABEL ones are passed downstream
+FACT_LABEL = re.compile(r'\b(location|address|area|neighbou?rhood|price|cost|rates?)\b', re.IGNORECASE)
+ATTRIBUTE_LABEL = re.compile(r'\b(features?|amenities|highlights?|description|why|best for|rating|includes)\b', re.IGNORECASE)
+
+MAX_ENTRIES = 10
+MAX_FACTS = 3
+MAX_FACT_LENGTH = 120
+
+
+def first_sentence(text):
+    """Return the first sentence of text, cut to MAX_FACT_LENGTH characters"""
+    end = text.find('. ')
+    sentence = text[:end + 1] if end >= 0 else text
+    if len(sentence) > MAX_FACT_LENGTH:
+        sentence = sentence[:MAX_FACT_LENGTH].rsplit(' ', 1)[0] + '...'
+    return sentence.strip()
+
+
+def split_entry(text):
+    """Split an entry line such as '1. Paris - The capital' into (name, detail)"""
+    text = NUMBERING.sub('', text)
+    for separator in DETAIL_SEPARATORS:
+        index = text.find(separator)
+        if index > 0:
+            name, detail = text[:index].strip(), text[index + len(separator):].strip()
+            # "Hotel 1: Le Grand" names the hotel after the label
+            if ENTRY_LABEL.match(name):
+                return split_entry(detail) if detail else (name, '')
+            return name, detail
+    return text.strip(), ''
+
+
+def entry_name(name, detail):
+    """Drop numbering and a leading label from a location or category name, as split_entry does"""
+    name = NUMBERING.sub('', name).strip()
+    # "City 1: Rome" names the city after the label
+    if ENTRY_LABEL.match(name) and detail:
+        return split_entry(detail)
+    return name, detail
+
+
+def is_entry_label(name):
+    """Return True for a name that is only a label such as 'City 2' or 'Option 1'"""
+    return bool(ENTRY_LABEL.match(name.replace('*', '').strip()))
+
+
+def label_kind(name):
+    """Return 'fact' or 'attribute' for an attribute label, None for anything else"""
+    if len(name) > 30:
+        return None
+    if FACT_LABEL.search(name):
+        return 'fact'
+    if ATTRIBUTE_LABEL.search(name):
+        return 'attribute'
+    return None
+
+
+def extract_entries(result):
+    """Pull the named entries and their key facts out of a city or hotel result.
+
+    Returns a list of (name, facts). Top-level lines (locations, numbered
+    items, headings, sibling bullets) start entries; sub-bullets naming a
+    location or price and price lines become facts of the current entry.
+    """
+    entries = []
+    started_by_bullet = False
+
+    for kind, text, extra in parse_output(result).blocks:
+        entry = entries[-1] if entries else None
+
+        if kind == 'section':
+            # Lines mentioning food, weather etc. are classed as sections even
+            # when they are entries such as "- Lyon: known for its food"
+            bulleted = text[0] in '-*•'
+            name, detail = split_entry(text.lstrip('-*• '))
+            if not detail:
+                # A description such as "Street food capital." under an entry
+                if entry and not entry[1] and not bulleted:
+                    entry[1].append(first_sentence(text))
+                continue
+            kind = 'category' if bulleted else 'numbered'
+        elif kind in ('location', 'category'):
+            name, detail = entry_name(text, extra)
+        elif kind in ('heading', 'numbered'):
+            name, detail = split_entry(text)
+        elif kind == 'bullet':
+            if entry and not started_by_bullet:
+                entry[1].append(first_sentence(text))
+                continue
+            name, detail = split_entry(text)
+        elif kind == 'price':
+            if entry:
+                entry[1].append(first_sentence(text))
+            continue
+        elif kind == 'text':
+            if entry and not entry[1]:
+                entry[1].append(first_sentence(text))
+            continue
+        else:
+            continue
+
+        label = label_kind(name) if entry else None
+        if label == 'fact':
+            entry[1].append(first_sentence(f"{name}: {detail}"))
+        if label:
+            continue
+
+        started_by_bullet = kind in ('category', 'bullet')
+        entries.append((name, [first_sentence(detail)] if detail else []))
+
+    # Drop bare titles such as "Recommended Cities:" when real entries follow
+    if any(facts for name, facts in entries):
+        entries = [(name, facts) for name, facts in entries if facts]
+    return [(name, facts[:MAX_FACTS]) for name, facts in entries[:MAX_ENTRIES]]
+
+
+def compact_context(result):
+    """Summarize a city or hotel result as a short 'Name (fact, fact); ...' list.
+
+    Falls back to the full text when nothing could be extracted, so a
+    downstream stage never gets less to work with than it would have.
+    """
+    entries = extract_entries(result)
+    if not entries:
+        return parse_output(result).raw
+    return '; '.join(f"{name} ({', '.join(facts)})" if facts else name for name, facts in entries)
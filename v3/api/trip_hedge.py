@@ -0,0 +1,154 @@
+from collections import defaultdict, deque
+from concurrent.futures import Future, FIRST_COMPLETED, wait
+from trip_metrics import STAGE_HEDGES, STAGE_HEDGE_WINS
+import asyncio
+import math
+import os
+import threading
+import time
+
+
+class Hedger:
+    """Races a duplicate kickoff against a stage that is slower than usual.
+
+    Each hedged stage keeps the latencies of its recent kickoffs. When a
+    kickoff has not finished by the chosen percentile of them, a duplicate
+    is started and whichever finishes first wins; the other runs to the end
+    in the background and its result is dropped. Every kickoff adds budget
+    credits and a hedge spends a whole one, so hedges stay under that
+    fraction of kickoffs even during a slowdown. No hedge is sent until a
+    stage has min_samples latencies.
+    """
+
+    def __init__(self, stages=(), percentile=95, budget=0.05, window=200, min_samples=20):
+        self.stages = set(stages)
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.latencies = defaultdict(lambda: deque(maxlen=window))
+        # Credits never pile up beyond what one window of kickoffs would earn
+        self.max_credits = max(1.0, budget * window)
+        self.credits = 0.0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Create a hedger for the stages in TRIP_HEDGE_STAGES (comma separated, or 'all')"""
+        stages = [stage.strip() for stage in os.getenv('TRIP_HEDGE_STAGES', '').split(',') if stage.strip()]
+        if stages == ['all']:
+            stages = ['cities', 'hotels', 'budget', 'itinerary', 'local_guide']
+        return cls(
+            stages,
+            percentile=float(os.getenv('TRIP_HEDGE_PERCENTILE', '95')),
+            budget=float(os.getenv('TRIP_HEDGE_BUDGET', '0.05')),
+            min_samples=int(os.getenv('TRIP_HEDGE_MIN_SAMPLES', '20'))
+        )
+
+    def enabled(self, stage):
+        return stage in self.stages
+
+    def delay(self, stage):
+        """Seconds to wait before hedging a stage, or None while there are too few samples"""
+        with self.lock:
+            ordered = sorted(self.latencies[stage])
+        if len(ordered) < self.min_samples:
+            return None
+        return ordered[max(0, math.ceil(self.percentile / 100 * len(ordered)) - 1)]
+
+    def record(self, stage, seconds):
+        with self.lock:
+            self.latencies[stage].append(seconds)
+
+    def take_credit(self):
+        """Spend a hedge credit if one is available"""
+        with self.lock:
+            if self.credits < 1:
+                return False
+            self.credits -= 1
+            return True
+
+    def start(self, fn, stage=None):
+        """Run fn on its own thread and return a Future; with stage set, its latency is recorded"""
+        future = Future()
+        started = time.perf_counter()
+
+        def run():
+            try:
+                future.set_result(fn())
+            except BaseException as e:
+                future.set_exception(e)
+                return
+            if stage:
+                self.record(stage, time.perf_counter() - started)
+
+        threading.Thread(target=run, name='trip-hedge', daemon=True).start()
+        return future
+
+    def run(self, stage, primary, hedge):
+        """Return (result, hedged): primary's result, or hedge's if it was started and finished first.
+
+        primary and hedge are called on their own threads. If both fail,
+        primary's error is raised.
+        """
+        with self.lock:
+            self.credits = min(self.max_credits, self.credits + self.budget)
+        delay = self.delay(stage)
+        first = self.start(primary, stage)
+        if delay is None:
+            return first.result(), False
+
+        done, pending = wait([first], timeout=delay)
+        if done or not self.take_credit():
+            return first.result(), False
+
+        STAGE_HEDGES.inc(stage=stage)
+        second = self.start(hedge)
+        waiting = {first, second}
+        while waiting:
+            done, waiting = wait(waiting, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        STAGE_HEDGE_WINS.inc(stage=stage)
+                    return future.result(), True
+        return first.result(), True
+
+    async def run_async(self, stage, primary, hedge):
+        """Like run, for coroutine functions awaited on the event loop.
+
+        The attempt that loses is cancelled rather than left to finish, which
+        frees its LLM call straight away.
+        """
+        with self.lock:
+            self.credits = min(self.max_credits, self.credits + self.budget)
+        delay = self.delay(stage)
+        started = time.perf_counter()
+        first = asyncio.ensure_future(primary())
+        first.add_done_callback(
+            lambda future: future.cancelled() or future.exception() or self.record(stage, time.perf_counter() - started))
+        second = None
+        try:
+            if delay is None:
+                return await first, False
+            done, pending = await asyncio.wait({first}, timeout=delay)
+            if done or not self.take_credit():
+                return await first, False
+
+            STAGE_HEDGES.inc(stage=stage)
+            second = asyncio.ensure_future(hedge())
+            waiting = {first, second}
+            while waiting:
+                done, waiting = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        if future is second:
+                            STAGE_HEDGE_WINS.inc(stage=stage)
+                        return future.result(), True
+            return first.result(), True
+        finally:
+            for future in (first, second):
+                if future is not None and not future.done():
+                    future.cancel()
+
+
+hedger = Hedger.from_env()
@@ -0,0 +1,215 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from trip_cache import connect
+import json
+import os
+import threading
+import uuid
+
+
+class JobQueueFull(Exception):
+    """Raised when too many planning jobs are already waiting"""
+
+
+def new_job(job_id):
+    return {
+        'job_id': job_id,
+        'status': 'queued',
+        'sections': {},
+        'section_status': {},
+        'error': None,
+        'created_at': datetime.now().isoformat(),
+        'finished_at': None
+    }
+
+
+class MemoryJobStore:
+    """Keeps job records in this process, so only the worker that took a job can report on it"""
+
+    def __init__(self, max_jobs):
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, job):
+        with self.lock:
+            self.jobs[job['job_id']] = job
+            self.evict()
+
+    def update(self, job_id, **fields):
+        with self.lock:
+            self.jobs[job_id].update(fields)
+
+    def set_section(self, job_id, field, section, content):
+        """Record one entry of a job's sections or section_status"""
+        with self.lock:
+            self.jobs[job_id][field][section] = content
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            return dict(job, sections=dict(job['sections']), section_status=dict(job['section_status']))
+
+    def evict(self):
+        """Forget the oldest finished jobs once the history is full"""
+        finished = [job_id for job_id, job in self.jobs.items() if job['status'] in ('completed', 'failed')]
+        for job_id in finished[:max(0, len(self.jobs) - self.max_jobs)]:
+            del self.jobs[job_id]
+
+
+class SQLiteJobStore:
+    """Keeps job records in a SQLite file shared by every worker process.
+
+    A job runs on the worker that accepted it, but its status can be read
+    from any worker, so polling works behind a load balancer with several
+    gunicorn workers.
+    """
+
+    def __init__(self, path, max_jobs):
+        self.path = path
+        self.max_jobs = max_jobs
+        self.local = threading.local()
+        self.connection().execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_id TEXT PRIMARY KEY, status TEXT NOT NULL, sections TEXT NOT NULL, "
+            "section_status TEXT NOT NULL, error TEXT, created_at TEXT NOT NULL, finished_at TEXT)"
+        )
+
+    def connection(self):
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = connect(self.path)
+        return conn
+
+    def add(self, job):
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO jobs (job_id, status, sections, section_status, error, created_at, finished_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job['job_id'], job['status'], json.dumps(job['sections']), json.dumps(job['section_status']),
+                 job['error'], job['created_at'], job['finished_at'])
+            )
+            self.evict(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def update(self, job_id, **fields):
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        self.connection().execute(
+            f"UPDATE jobs SET {assignments} WHERE job_id = ?", (*fields.values(), job_id)
+        )
+
+    def set_section(self, job_id, field, section, content):
+        """Record one entry of a job's sections or section_status"""
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(f"SELECT {field} FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is not None:
+                values = json.loads(row[0])
+                values[section] = content
+                conn.execute(f"UPDATE jobs SET {field} = ? WHERE job_id = ?", (json.dumps(values), job_id))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get(self, job_id):
+        row = self.connection().execute(
+            "SELECT job_id, status, sections, section_status, error, created_at, finished_at "
+            "FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            'job_id': row[0],
+            'status': row[1],
+            'sections': json.loads(row[2]),
+            'section_status': json.loads(row[3]),
+            'error': row[4],
+            'created_at': row[5],
+            'finished_at': row[6]
+        }
+
+    def evict(self, conn):
+        """Forget the oldest finished jobs once the history is full"""
+        excess = conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0] - self.max_jobs
+        if excess > 0:
+            conn.execute(
+                "DELETE FROM jobs WHERE rowid IN (SELECT rowid FROM jobs "
+                "WHERE status IN ('completed', 'failed') ORDER BY rowid LIMIT ?)",
+                (excess,)
+            )
+
+
+class TripJobs:
+    """Runs trip plans in the background on a bounded worker pool.
+
+    Request threads only register a job and return its id; the plan itself
+    runs on the pool and records each section as soon as its stage finishes,
+    so clients can poll for partial results. Jobs are kept in memory unless
+    TRIP_JOBS_PATH names a SQLite file, which every worker process must share
+    when the app runs with more than one.
+    """
+
+    def __init__(self, planner, max_workers=None, max_pending=None, max_jobs=None, path=None):
+        self.planner = planner
+        self.max_pending = max_pending or int(os.getenv('TRIP_JOB_QUEUE_SIZE', '100'))
+        max_jobs = max_jobs or int(os.getenv('TRIP_JOB_HISTORY', '1000'))
+        path = path if path is not None else os.getenv('TRIP_JOBS_PATH', '')
+        self.store = SQLiteJobStore(path, max_jobs) if path else MemoryJobStore(max_jobs)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or int(os.getenv('TRIP_JOB_WORKERS', '4')),
+            thread_name_prefix='trip-job'
+        )
+        # Queued and running jobs of this process; each process bounds its own pool
+        self.active = 0
+        self.lock = threading.Lock()
+
+    def submit(self, data):
+        """Queue a plan for the given request data and return its job id"""
+        with self.lock:
+            if self.active >= self.max_pending:
+                raise JobQueueFull(f"{self.active} trip plans are already in progress")
+            self.active += 1
+
+        try:
+            job_id = uuid.uuid4().hex
+            self.store.add(new_job(job_id))
+            self.executor.submit(self.run, job_id, data)
+        except Exception:
+            self.finish()
+            raise
+        return job_id
+
+    def run(self, job_id, data):
+        """Plan the trip for a job, recording sections as they finish"""
+        try:
+            self.store.update(job_id, status='running')
+            for event, section, content in self.planner.iter_plan(data):
+                if event == 'section':
+                    self.store.set_section(job_id, 'sections', section, content)
+                elif event == 'status':
+                    # A stage that did not finish before the request's deadline
+                    self.store.set_section(job_id, 'section_status', section, content)
+            self.store.update(job_id, status='completed', finished_at=datetime.now().isoformat())
+        except Exception as e:
+            self.store.update(job_id, status='failed', error=str(e), finished_at=datetime.now().isoformat())
+        finally:
+            self.finish()
+
+    def finish(self):
+        with self.lock:
+            self.active -= 1
+
+    def get(self, job_id):
+        """Return a snapshot of a job, or None if it is unknown"""
+        return self.store.get(job_id)
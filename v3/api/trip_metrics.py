@@ -0,0 +1,243 @@
+from bisect import bisect_left
+import threading
+import time
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# LLM stages take seconds to minutes, so the buckets start at half a second
+STAGE_BUCKETS = (0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+# Waits for the outbound rate limiter are usually short
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=''):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """A named metric with a fixed set of label names"""
+
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def samples(self):
+        """Return (name, label string, value) for every sample"""
+        with self.lock:
+            return [(self.name, format_labels(self.labelnames, key), value) for key, value in sorted(self.values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{labels} {format_value(value)}")
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self.lock:
+            return self.values.get(self.key(labels), 0)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=STAGE_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # One count per bucket plus +Inf, then the running sum
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def time(self, **labels):
+        """Return a context manager that observes the seconds spent inside it"""
+        return Timer(self, labels)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            items = sorted((key, list(counts)) for key, counts in self.values.items())
+        for key, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = format_labels(self.labelnames, key, f'le="{format_value(bound)}"')
+                samples.append((self.name + '_bucket', labels, cumulative))
+            labels = format_labels(self.labelnames, key)
+            samples.append((self.name + '_sum', labels, counts[-1]))
+            samples.append((self.name + '_count', labels, cumulative))
+        return samples
+
+
+class Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class HitRatio(Metric):
+    """Hits divided by lookups, derived from a lookups counter labelled cache and result"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, lookups):
+        super().__init__(name, documentation, ('cache',))
+        self.lookups = lookups
+
+    def samples(self):
+        totals = {}
+        with self.lookups.lock:
+            for (cache, result), value in self.lookups.values.items():
+                hits, lookups = totals.get(cache, (0, 0))
+                totals[cache] = (hits + (value if result == 'hit' else 0), lookups + value)
+        return [
+            (self.name, format_labels(self.labelnames, (cache,)), hits / lookups if lookups else 0.0)
+            for cache, (hits, lookups) in sorted(totals.items())
+        ]
+
+
+class MetricsRegistry:
+    """Holds the metrics of this process and renders them in the Prometheus text format.
+
+    Everything is kept in memory and rendered on request by the /metrics
+    route, so no collector or extra dependency is needed to read the
+    numbers. Each worker process keeps its own counters.
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    'trip_stage_duration_seconds', 'Time spent in Crew.kickoff() for each planning stage', ('stage',)))
+STAGE_ERRORS = registry.register(Counter(
+    'trip_stage_errors_total', 'Planning stages that raised an error', ('stage',)))
+PROMPT_TOKENS = registry.register(Counter(
+    'trip_llm_prompt_tokens_total', 'Prompt tokens sent to the LLM by each agent role', ('role',)))
+COMPLETION_TOKENS = registry.register(Counter(
+    'trip_llm_completion_tokens_total', 'Completion tokens generated by each agent role', ('role',)))
+CACHE_LOOKUPS = registry.register(Counter(
+    'trip_cache_lookups_total', 'Cache lookups by cache and result (hit or miss)', ('cache', 'result')))
+CACHE_HIT_RATIO = registry.register(HitRatio(
+    'trip_cache_hit_ratio', 'Share of cache lookups that were hits', CACHE_LOOKUPS))
+REQUESTS_IN_FLIGHT = registry.register(Gauge(
+    'trip_requests_in_flight', 'HTTP requests currently being handled', ('endpoint',)))
+REQUESTS = registry.register(Counter(
+    'trip_requests_total', 'HTTP requests handled, by endpoint and status code', ('endpoint', 'status')))
+COALESCED_REQUESTS = registry.register(Counter(
+    'trip_coalesced_requests_total', 'Plan requests answered by an identical request already in flight, by scope (process or workers)', ('scope',)))
+STAGE_HEDGES = registry.register(Counter(
+    'trip_stage_hedges_total', 'Duplicate kickoffs started for stages slower than their hedge percentile', ('stage',)))
+STAGE_HEDGE_WINS = registry.register(Counter(
+    'trip_stage_hedge_wins_total', 'Hedged kickoffs that finished before the original', ('stage',)))
+STAGE_TIMEOUTS = registry.register(Counter(
+    'trip_stage_timeouts_total', 'Stages cancelled because their share of the plan deadline ran out', ('stage',)))
+LLM_THROTTLED = registry.register(Counter(
+    'trip_llm_throttled_total', 'LLM calls the provider answered with 429 Too Many Requests'))
+LLM_CONCURRENCY_LIMIT = registry.register(Gauge(
+    'trip_llm_concurrency_limit', 'Current adaptive limit on LLM calls in flight'))
+LLM_LIMITER_WAIT = registry.register(Histogram(
+    'trip_llm_limiter_wait_seconds', 'Time LLM calls waited for the outbound rate limiter', buckets=WAIT_BUCKETS))
+
+
+def record_cache_lookup(cache, hit):
+    CACHE_LOOKUPS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+def render_metrics():
+    """Return every metric of this process in the Prometheus text format"""
+    return registry.render()
+
+
+def track_requests(app):
+    """Count requests and keep the in-flight gauge of a Flask app up to date"""
+    from flask import g, request
+
+    def endpoint():
+        return request.url_rule.rule if request.url_rule else 'unmatched'
+
+    @app.before_request
+    def start_request():
+        g.metrics_endpoint = endpoint()
+        REQUESTS_IN_FLIGHT.inc(endpoint=g.metrics_endpoint)
+
+    @app.after_request
+    def count_request(response):
+        REQUESTS.inc(endpoint=g.get('metrics_endpoint', endpoint()), status=response.status_code)
+        return response
+
+    # Streamed responses are torn down only once the stream is finished
+    @app.teardown_request
+    def finish_request(exc):
+        if 'metrics_endpoint' in g:
+            REQUESTS_IN_FLIGHT.dec(endpoint=g.pop('metrics_endpoint'))
@@ -0,0 +1,372 @@
+from trip_metrics import LLM_THROTTLED, LLM_CONCURRENCY_LIMIT, LLM_LIMITER_WAIT
+import asyncio
+import httpx
+import json
+import os
+import random
+import threading
+import time
+
+
+# Besides 429, the statuses the OpenAI SDK would retry: timeouts, conflicts and server errors
+RETRY_STATUSES = (408, 409, 500, 502, 503, 504)
+
+
+class TokenBucket:
+    """Allows per_minute units a minute, in bursts of up to a minute's worth"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, amount):
+        """Take amount units if the bucket holds them and return 0, or return the seconds until it will"""
+        # A single call larger than the bucket would wait forever, so it takes a full bucket
+        amount = min(float(amount), self.capacity)
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0
+            return (amount - self.tokens) / self.rate
+
+    def acquire(self, amount=1):
+        """Take amount units, waiting until the bucket has refilled enough"""
+        while True:
+            wait = self.take(amount)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, amount=1):
+        """Take amount units, awaiting instead of blocking the event loop"""
+        while True:
+            wait = self.take(amount)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+class AdaptiveConcurrency:
+    """Limits calls in flight, adjusting the limit by additive increase, multiplicative decrease.
+
+    Every call that comes back quickly raises the limit by 1/limit, so it
+    grows by about one per round of calls. A throttled call halves it and a
+    call slower than latency_target cuts it by a tenth, at most once per
+    cooldown so one burst of 429s does not collapse it to the minimum.
+    """
+
+    def __init__(self, initial, maximum, minimum=1, latency_target=30.0, cooldown=1.0):
+        self.limit = float(initial)
+        self.maximum = maximum
+        self.minimum = minimum
+        self.latency_target = latency_target
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+        # Futures of coroutines waiting for a slot, with the event loops they belong to
+        self.async_waiters = []
+        LLM_CONCURRENCY_LIMIT.set(int(self.limit))
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    async def acquire_async(self):
+        """Take a slot, awaiting instead of blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.condition:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                waiter = loop.create_future()
+                self.async_waiters.append((loop, waiter))
+            await waiter
+
+    def release(self, latency=None, throttled=False):
+        """Free a slot and adjust the limit from how the call went"""
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled or (latency is not None and latency > self.latency_target):
+                if now - self.last_decrease >= self.cooldown:
+                    self.limit = max(self.minimum, self.limit * (0.5 if throttled else 0.9))
+                    self.last_decrease = now
+            elif latency is not None:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            LLM_CONCURRENCY_LIMIT.set(int(self.limit))
+            self.condition.notify_all()
+            waiters, self.async_waiters = self.async_waiters, []
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(wake, waiter)
+
+
+class RateLimiter:
+    """Process-wide limiter for outbound LLM calls.
+
+    Every agent shares one provider quota, so every call waits for a
+    request from the requests-per-minute bucket, its estimated tokens from
+    the tokens-per-minute bucket and a slot under the adaptive concurrency
+    limit. A 429 response is retried after the provider's Retry-After, or
+    after an exponential backoff with full jitter, up to max_retries times.
+    Server errors and dropped connections are retried the same way, so the
+    OpenAI client is created with max_retries=0 and this is the only retry
+    layer; only 429s lower the concurrency limit.
+    """
+
+    def __init__(self, rpm=0, tpm=0, max_concurrency=20, initial_concurrency=None,
+                 latency_target=30.0, max_retries=5, backoff=1.0, max_backoff=60.0):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.concurrency = AdaptiveConcurrency(
+            initial_concurrency or max_concurrency, max_concurrency, latency_target=latency_target)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    @classmethod
+    def from_env(cls):
+        """Create the limiter from TRIP_LLM_* variables, or None if TRIP_LLM_RATE_LIMIT is false"""
+        if os.getenv('TRIP_LLM_RATE_LIMIT', 'true').lower() == 'false':
+            return None
+        max_concurrency = int(os.getenv('TRIP_LLM_MAX_CONCURRENCY', os.getenv('TRIP_LLM_MAX_CONNECTIONS', '20')))
+        return cls(
+            rpm=float(os.getenv('TRIP_LLM_RPM', '0')),
+            tpm=float(os.getenv('TRIP_LLM_TPM', '0')),
+            max_concurrency=max_concurrency,
+            latency_target=float(os.getenv('TRIP_LLM_LATENCY_TARGET', '30')),
+            max_retries=int(os.getenv('TRIP_LLM_MAX_RETRIES', '5')),
+            backoff=float(os.getenv('TRIP_LLM_BACKOFF', '1'))
+        )
+
+    def retry_delay(self, attempt, retry_after=None):
+        """Seconds to wait before retry number attempt (from 0)"""
+        if retry_after is not None:
+            # Spread the retries of calls throttled together over a short window
+            return retry_after + random.uniform(0, self.backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def acquire(self, tokens):
+        start = time.perf_counter()
+        if self.requests:
+            self.requests.acquire(1)
+        if self.tokens:
+            self.tokens.acquire(tokens)
+        self.concurrency.acquire()
+        LLM_LIMITER_WAIT.observe(time.perf_counter() - start)
+
+    def call(self, send, tokens):
+        """Send a request through the limiter and return the response, retrying 429s and server errors.
+
+        send returns an httpx.Response. The concurrency slot is held until
+        the response body is closed, so streamed completions count as in
+        flight for as long as they stream.
+        """
+        attempt = 0
+        while True:
+            self.acquire(tokens)
+            start = time.perf_counter()
+            try:
+                response = send()
+            except httpx.TransportError:
+                self.concurrency.release()
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(self.retry_delay(attempt))
+                attempt += 1
+                continue
+            except Exception:
+                self.concurrency.release()
+                raise
+
+            throttled = response.status_code == 429
+            if (throttled or response.status_code in RETRY_STATUSES) and attempt < self.max_retries:
+                if throttled:
+                    LLM_THROTTLED.inc()
+                response.close()
+                self.concurrency.release(throttled=throttled)
+                time.sleep(self.retry_delay(attempt, retry_after(response)))
+                attempt += 1
+                continue
+
+            latency = time.perf_counter() - start
+            if response.status_code == 429:
+                # Out of retries: the caller gets the 429
+                LLM_THROTTLED.inc()
+                release = lambda: self.concurrency.release(throttled=True)
+            else:
+                release = lambda: self.concurrency.release(latency)
+            return httpx.Response(
+                response.status_code,
+                headers=response.headers,
+                stream=ReleasingStream(response.stream, release),
+                extensions=response.extensions
+            )
+
+    async def acquire_async(self, tokens):
+        start = time.perf_counter()
+        if self.requests:
+            await self.requests.acquire_async(1)
+        if self.tokens:
+            await self.tokens.acquire_async(tokens)
+        await self.concurrency.acquire_async()
+        LLM_LIMITER_WAIT.observe(time.perf_counter() - start)
+
+    async def call_async(self, send, tokens):
+        """Like call, for a send coroutine function returning an httpx.Response with an async body"""
+        attempt = 0
+        while True:
+            await self.acquire_async(tokens)
+            start = time.perf_counter()
+            try:
+                response = await send()
+            except httpx.TransportError:
+                self.concurrency.release()
+                if attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(self.retry_delay(attempt))
+                attempt += 1
+                continue
+            except BaseException:
+                # Cancelled calls give their slot back too
+                self.concurrency.release()
+                raise
+
+            throttled = response.status_code == 429
+            if (throttled or response.status_code in RETRY_STATUSES) and attempt < self.max_retries:
+                if throttled:
+                    LLM_THROTTLED.inc()
+                await response.aclose()
+                self.concurrency.release(throttled=throttled)
+                await asyncio.sleep(self.retry_delay(attempt, retry_after(response)))
+                attempt += 1
+                continue
+
+            latency = time.perf_counter() - start
+            if response.status_code == 429:
+                LLM_THROTTLED.inc()
+                release = lambda: self.concurrency.release(throttled=True)
+            else:
+                release = lambda: self.concurrency.release(latency)
+            return httpx.Response(
+                response.status_code,
+                headers=response.headers,
+                stream=AsyncReleasingStream(response.stream, release),
+                extensions=response.extensions
+            )
+
+
+def wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class ReleasingStream(httpx.SyncByteStream):
+    """Wraps a response body and calls release once when it is closed"""
+
+    def __init__(self, stream, release):
+        self.stream = stream
+        self.release = release
+        self.released = False
+        self.lock = threading.Lock()
+
+    def __iter__(self):
+        yield from self.stream
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            with self.lock:
+                released, self.released = self.released, True
+            if not released:
+                self.release()
+
+
+class AsyncReleasingStream(httpx.AsyncByteStream):
+    """Async counterpart of ReleasingStream"""
+
+    def __init__(self, stream, release):
+        self.stream = stream
+        self.release = release
+        self.released = False
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            # Only the event loop's thread closes it, so no lock is needed
+            released, self.released = self.released, True
+            if not released:
+                self.release()
+
+
+class RateLimitedTransport(httpx.BaseTransport):
+    """httpx transport that sends every request through a RateLimiter"""
+
+    def __init__(self, transport, limiter):
+        self.transport = transport
+        self.limiter = limiter
+
+    def handle_request(self, request):
+        return self.limiter.call(lambda: self.transport.handle_request(request), estimate_tokens(request))
+
+    def close(self):
+        self.transport.close()
+
+
+class AsyncRateLimitedTransport(httpx.AsyncBaseTransport):
+    """httpx async transport that sends every request through a RateLimiter"""
+
+    def __init__(self, transport, limiter):
+        self.transport = transport
+        self.limiter = limiter
+
+    async def handle_async_request(self, request):
+        return await self.limiter.call_async(lambda: self.transport.handle_async_request(request), estimate_tokens(request))
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def retry_after(response):
+    """Return the Retry-After header of a response in seconds, or None"""
+    value = response.headers.get('retry-after-ms')
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    try:
+        return float(response.headers.get('retry-after', ''))
+    except ValueError:
+        return None
+
+
+def estimate_tokens(request):
+    """Estimate the tokens a chat completion request uses: its prompt plus the completion it allows"""
+    try:
+        body = json.loads(request.content or b'{}')
+    except (ValueError, httpx.RequestNotRead):
+        return 1
+    if not isinstance(body, dict):
+        return 1
+    prompt = sum(len(str(message.get('content') or '')) for message in body.get('messages', []) if isinstance(message, dict))
+    completion = body.get('max_tokens') or body.get('max_completion_tokens') or 500
+    return prompt // 4 + completion
+
+
+rate_limiter = RateLimiter.from_env()
@@ -3,7 +3,25 @@ import { motion } from 'framer-motion';
 import DatePicker from 'react-datepicker';
 import 'react-datepicker/dist/react-datepicker.css';
 import { toast } from 'react-toastify';
-import axios from 'axios';
+
+// Sections streamed by the backend, in display order
+const resultSections = [
+  { key: 'cities', title: 'Recommended Destinations' },
+  { key: 'hotels', title: 'Accommodation Options' },
+  { key: 'budget', title: 'Budget Breakdown' },
+  { key: 'itinerary', title: 'Daily Itinerary' },
+  { key: 'local_guide', title: 'Local Insights & Tips' }
+];
+
+const parseSseEvent = (rawEvent) => {
+  let name = 'message';
+  let data = '';
+  rawEvent.split('\n').forEach(line => {
+    if (line.startsWith('event:')) name = line.slice(6).trim();
+    if (line.startsWith('data:')) data += line.slice(5).trim();
+  });
+  return { name, data: data ? JSON.parse(data) : {} };
+};
 
 const TripPlanner = () => {
   const [formData, setFormData] = useState({
@@ -77,25 +95,82 @@ const TripPlanner = () => {
 
     setIsLoading(true);
     
+    setTripResults(null);
+
     try {
-      // Call the backend API
-      const response = await axios.post('/api/plan-trip', {
-        destination: formData.destination,
-        startDate: formData.startDate.toISOString(),
-        endDate: formData.endDate.toISOString(),
-        travelers: formData.travelers,
-        budget: formData.budget,
-        travelType: formData.travelType,
-        interests: formData.interests.join(', ')
+      // Stream each section from the backend as soon as its stage finishes
+      const response = await fetch('/trip/plan/stream', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          destination: formData.destination,
+          startDate: formData.startDate.toISOString(),
+          endDate: formData.endDate.toISOString(),
+          travelers: formData.travelers,
+          budget: formData.budget,
+          travelType: formData.travelType,
+          interests: formData.interests.join(', ')
+        })
       });
 
-      setTripResults(response.data);
-      toast.success('Your trip has been planned successfully!');
-      
-      // Scroll to results
-      setTimeout(() => {
-        document.getElementById('trip-results')?.scrollIntoView({ behavior: 'smooth' });
-      }, 500);
+      if (!response.ok || !response.body) {
+        throw new Error(`Request failed with status ${response.status}`);
+      }
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let firstSection = true;
+
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // Server-Sent Events are separated by a blank line
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+
+        for (const rawEvent of events) {
+          const event = parseSseEvent(rawEvent);
+          if (event.name === 'error') {
+            throw new Error(event.data.error);
+          }
+          if (event.name === 'done') {
+            toast.success('Your trip has been planned successfully!');
+            continue;
+          }
+
+          if (event.name === 'status') {
+            // A section that did not finish before the deadline
+            const message = event.data.content === 'failed'
+              ? 'This section could not be planned.'
+              : 'This section ran out of time; try planning again.';
+            setTripResults(prev => ({ ...(prev || {}), [event.data.section]: `<p>${message}</p>` }));
+            continue;
+          }
+
+          if (event.name === 'chunk') {
+            // Lines of a section that is still being written
+            setTripResults(prev => {
+              const previous = prev?.[event.data.section];
+              const content = previous ? `${previous}\n${event.data.content}` : event.data.content;
+              return { ...(prev || {}), [event.data.section]: content };
+            });
+          } else {
+            // A finished section replaces its streamed lines
+            setTripResults(prev => ({ ...(prev || {}), [event.data.section]: event.data.content }));
+          }
+
+          if (firstSection) {
+            firstSection = false;
+            // Scroll to results as soon as the first section arrives
+            setTimeout(() => {
+              document.getElementById('trip-results')?.scrollIntoView({ behavior: 'smooth' });
+            }, 500);
+          }
+        }
+      }
       
     } catch (error) {
       console.error('Error planning trip:', error);
@@ -374,11 +449,16 @@ const TripPlanner = () => {
 
                 {/* Itinerary Details */}
                 <div className="lg:col-span-2">
-                  <div className="prose max-w-none">
-                    <div 
-                      className="text-gray-700 leading-relaxed"
-                      dangerouslySetInnerHTML={{ __html: tripResults.itinerary || 'Loading your amazing itinerary...' }}
-                    />
+                  <div className="prose max-w-none space-y-8">
+                    {resultSections.map(section => (
+                      <div key={section.key}>
+                        <h4 className="text-2xl font-bold text-gray-900 mb-4">{section.title}</h4>
+                        <div 
+                          className="text-gray-700 leading-relaxed"
+                          dangerouslySetInnerHTML={{ __html: tripResults[section.key] || 'Loading your amazing itinerary...' }}
+                        />
+                      </div>
+                    ))}
                   </div>
 
                   <div className="mt-8 flex flex-col sm:flex-row gap-4">